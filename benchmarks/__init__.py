@@ -0,0 +1 @@
+"""Benchmarks of fragile that can be run with asv (see asv.conf.json) or as scripts."""
@@ -0,0 +1,96 @@
+"""
+Measure the memory allocated by the environment step pipeline.
+
+It compares stepping a :class:`Function` and returning a new :class:`StatesEnv` \
+against writing the results into a preallocated ``out`` buffer, which is what \
+the :class:`Swarm` does with the back buffer of the :class:`Walkers`.
+
+``tracemalloc`` reports sizes instead of allocation counts, so the benchmark \
+reports the bytes allocated on top of the live memory during one step, and \
+the number of new arrays owned by the returned :class:`StatesEnv`.
+
+Only the arrays of the :class:`StatesEnv` are preallocated. The bounds check \
+and the evaluation of the function still allocate temporary arrays on every \
+step, so the peak bytes are reduced but they do not drop to zero. The number \
+of new arrays is the value that drops to zero when using ``out``.
+
+Usage (with fragile installed or in the ``PYTHONPATH``)::
+
+    python benchmarks/bench_allocations.py --n-walkers 1000 --dims 100
+
+"""
+import argparse
+import tracemalloc
+from typing import Callable, Tuple
+
+import numpy
+
+from fragile.core.states import StatesEnv, StatesModel
+from fragile.optimize.benchmarks import Rastrigin
+
+
+def peak_allocation(func: Callable, n_steps: int) -> int:
+    """Return the maximum number of bytes allocated on top of the live memory by ``func``."""
+    func()  # Warm up caches and lazily allocated buffers
+    peak = 0
+    for _ in range(n_steps):
+        # Restart the tracing at every step so its peak only counts the memory allocated by
+        # func. tracemalloc.reset_peak is not available before Python 3.9.
+        tracemalloc.start()
+        try:
+            func()
+            _, step_peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        peak = max(peak, step_peak)
+    return peak
+
+
+def new_arrays(old: StatesEnv, new: StatesEnv) -> int:
+    """Return the number of arrays of ``new`` that were not present in ``old``."""
+    old_ids = {id(val) for val in old.vals() if isinstance(val, numpy.ndarray)}
+    return sum(isinstance(v, numpy.ndarray) and id(v) not in old_ids for v in new.vals())
+
+
+def bench_step(n_walkers: int, dims: int, n_steps: int) -> Tuple[dict, dict]:
+    """Benchmark ``Function.step`` with and without an output buffer."""
+    env = Rastrigin(shape=(dims,))
+    env_states = env.reset(batch_size=n_walkers)
+    actions = numpy.random.standard_normal((n_walkers, dims)).astype(numpy.float32) * 1e-3
+    model_states = StatesModel(batch_size=n_walkers, actions=actions)
+    buffer = env.create_new_states(batch_size=n_walkers)
+
+    def step_new():
+        env.step(model_states=model_states, env_states=env_states)
+
+    def step_out():
+        env.step(model_states=model_states, env_states=env_states, out=buffer)
+
+    new_states = env.step(model_states=model_states, env_states=env_states)
+    out_states = env.step(model_states=model_states, env_states=env_states, out=buffer)
+    results_new = {
+        "peak_bytes": peak_allocation(step_new, n_steps),
+        "new_arrays": new_arrays(buffer, new_states),
+    }
+    results_out = {
+        "peak_bytes": peak_allocation(step_out, n_steps),
+        "new_arrays": new_arrays(buffer, out_states),
+    }
+    return results_new, results_out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--n-walkers", type=int, default=1000)
+    parser.add_argument("--dims", type=int, default=100)
+    parser.add_argument("--n-steps", type=int, default=20)
+    args = parser.parse_args()
+    results_new, results_out = bench_step(args.n_walkers, args.dims, args.n_steps)
+    print("n_walkers={} dims={}".format(args.n_walkers, args.dims))
+    print("{:<12} {:>14} {:>12}".format("step", "peak bytes", "new arrays"))
+    for name, results in (("new states", results_new), ("out buffer", results_out)):
+        print("{:<12} {:>14} {:>12}".format(name, results["peak_bytes"], results["new_arrays"]))
+
+
+if __name__ == "__main__":
+    main()
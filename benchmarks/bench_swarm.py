@@ -0,0 +1,211 @@
+"""
+Benchmark the hot loop of the :class:`Swarm` and report the time spent in each phase.
+
+The ``Time*`` classes are asv benchmarks, which can be run from the root of \
+the repository with ``asv run`` (see ``asv.conf.json``). The script can also \
+be run directly to sweep the number of walkers and the size of the \
+observations, printing a per-phase table.
+
+Usage (with fragile installed or in the ``PYTHONPATH``)::
+
+    python benchmarks/bench_swarm.py --env discrete --n-walkers 64 1024 100000 \
+        --obs-sizes 2 1000 100000 --n-steps 10
+
+"""
+import argparse
+import time
+from typing import Callable, Dict, List
+
+import numpy
+
+from fragile.core.callbacks import PHASES, SwarmMetrics
+from fragile.core.env import Environment
+from fragile.core.models import DiscreteUniform
+from fragile.core.states import StatesEnv, StatesModel
+from fragile.core.swarm import Swarm
+from fragile.core.tree import HistoryTree
+from fragile.core.utils import StateDict
+from fragile.core.walkers import Walkers
+from fragile.optimize.benchmarks import EggHolder, LennardJones, Rastrigin, Sphere
+from fragile.optimize.swarm import FunctionMapper
+
+
+class SyntheticDiscreteEnv(Environment):
+    """
+    Deterministic environment with discrete actions and ``uint8`` observations \
+    of arbitrary size, that is cheap enough to not hide the cost of the :class:`Swarm`.
+    """
+
+    def __init__(self, obs_size: int, n_actions: int = 6):
+        """
+        Initialize a :class:`SyntheticDiscreteEnv`.
+
+        Args:
+            obs_size: Number of bytes of each observation.
+            n_actions: Number of different discrete actions.
+        """
+        super(SyntheticDiscreteEnv, self).__init__(states_shape=(1,), observs_shape=(obs_size,))
+        self.n_actions = n_actions
+        self._pattern = numpy.arange(obs_size, dtype=numpy.uint8)
+
+    def get_params_dict(self) -> StateDict:
+        """Return the dictionary describing the data of the environment."""
+        params = super(SyntheticDiscreteEnv, self).get_params_dict()
+        params["observs"]["dtype"] = numpy.uint8
+        return params
+
+    def _states_to_data(self, states: numpy.ndarray, out: StatesEnv = None) -> StatesEnv:
+        """Derive the observations, rewards and end conditions from the internal states."""
+        low_byte = (states & 255).astype(numpy.uint8)
+        observs = numpy.add(low_byte, self._pattern, out=None if out is None else out.observs)
+        rewards = (states[:, 0] % 7).astype(numpy.float32)
+        ends = numpy.zeros(len(states), dtype=numpy.bool_)
+        return self.states_from_data(len(states), states, observs, rewards, ends, out=out)
+
+    def step(
+        self, model_states: StatesModel, env_states: StatesEnv, out: StatesEnv = None
+    ) -> StatesEnv:
+        """Apply the actions to the states using a linear congruential update."""
+        actions = model_states.actions.reshape(-1, 1).astype(numpy.int64)
+        states = env_states.states * 6364136223846793005 + actions + 1442695040888963407
+        return self._states_to_data(states, out=out)
+
+    def reset(self, batch_size: int = 1, **kwargs) -> StatesEnv:
+        """Return the initial states of the environment."""
+        return self._states_to_data(numpy.zeros((batch_size, 1), dtype=numpy.int64))
+
+
+FUNCTIONS = {
+    "sphere": lambda size: Sphere(shape=(size,)),
+    "rastrigin": lambda size: Rastrigin(shape=(size,)),
+    "eggholder": lambda size: EggHolder(),
+    "lennard_jones": lambda size: LennardJones(n_atoms=max(2, size // 3)),
+}
+# Functions whose dimension is fixed, so sweeping the size of the observations is meaningless
+FIXED_SIZE = {"eggholder": 2}
+
+
+def create_swarm(env_name: str, n_walkers: int, obs_size: int, tree: bool = False) -> Swarm:
+    """Create a :class:`Swarm` to be benchmarked."""
+    tree = HistoryTree if tree else None
+    if env_name == "discrete":
+        return Swarm(
+            model=lambda env: DiscreteUniform(env=env),
+            env=lambda: SyntheticDiscreteEnv(obs_size=obs_size),
+            walkers=Walkers,
+            n_walkers=n_walkers,
+            tree=tree,
+        )
+    function = FUNCTIONS[env_name](obs_size)
+    return FunctionMapper(env=lambda: function, n_walkers=n_walkers, tree=tree)
+
+
+def estimated_bytes(n_walkers: int, obs_size: int) -> int:
+    """Return a rough estimate of the memory needed to run a :class:`Swarm`."""
+    # Front and back env buffers, observation gathers and float temporaries
+    return n_walkers * obs_size * 16
+
+
+def time_phases(
+    env_name: str, n_walkers: int, obs_size: int, n_steps: int = 10, tree: bool = False
+) -> Dict[str, float]:
+    """
+    Run ``n_steps`` iterations of a :class:`Swarm` and return the average time \
+    per step spent in each phase, in seconds.
+    """
+    swarm = create_swarm(env_name, n_walkers=n_walkers, obs_size=obs_size, tree=tree)
+    swarm.reset()
+    swarm.run_step()  # Warm up caches and compiled kernels
+    metrics = SwarmMetrics(check_collisions=False)
+    swarm.add_callback(metrics)
+    start = time.perf_counter()
+    for _ in range(n_steps):
+        swarm.run_step()
+    total = time.perf_counter() - start
+    results = {phase: metrics.phase_times[phase] / n_steps for phase in PHASES}
+    results["other"] = total / n_steps - sum(results.values())
+    results["total"] = total / n_steps
+    return results
+
+
+def sweep(
+    env_name: str,
+    n_walkers: List[int],
+    obs_sizes: List[int],
+    n_steps: int,
+    max_bytes: int,
+    tree: bool = False,
+    print_fn: Callable = print,
+):
+    """Print a table with the time per phase for every combination of parameters."""
+    columns = list(PHASES.keys()) + ["other", "total"]
+    header = "{:>9} {:>9} ".format("walkers", "obs") + " ".join(
+        "{:>14}".format(c) for c in columns
+    )
+    print_fn("{} (ms per step)".format(env_name))
+    print_fn(header)
+    if env_name in FIXED_SIZE:
+        obs_sizes = [FIXED_SIZE[env_name]]
+    for n in n_walkers:
+        for size in obs_sizes:
+            if estimated_bytes(n, size) > max_bytes:
+                print_fn("{:>9} {:>9} skipped: exceeds the memory limit".format(n, size))
+                continue
+            results = time_phases(env_name, n, size, n_steps=n_steps, tree=tree)
+            row = " ".join("{:>14.3f}".format(results[c] * 1000) for c in columns)
+            print_fn("{:>9} {:>9} {}".format(n, size, row))
+
+
+class TimeDiscreteSwarm:
+    """asv benchmark of :meth:`Swarm.run_step` on a synthetic discrete environment."""
+
+    params = ([64, 1024, 16384, 100000], [2, 1000, 100000])
+    param_names = ["n_walkers", "obs_size"]
+
+    def setup(self, n_walkers, obs_size):
+        if estimated_bytes(n_walkers, obs_size) > 2 ** 32:
+            raise NotImplementedError("Exceeds the memory limit")
+        self.swarm = create_swarm("discrete", n_walkers=n_walkers, obs_size=obs_size)
+        self.swarm.reset()
+
+    def time_run_step(self, n_walkers, obs_size):
+        self.swarm.run_step()
+
+
+class TimeFunctionMapper:
+    """asv benchmark of :meth:`FunctionMapper.run_step` on the optimization benchmarks."""
+
+    params = (list(FUNCTIONS.keys()), [64, 1024, 16384, 100000], [2, 30, 300])
+    param_names = ["function", "n_walkers", "obs_size"]
+
+    def setup(self, function, n_walkers, obs_size):
+        if function in FIXED_SIZE and obs_size != FIXED_SIZE[function]:
+            raise NotImplementedError("{} has a fixed size".format(function))
+        self.swarm = create_swarm(function, n_walkers=n_walkers, obs_size=obs_size)
+        self.swarm.reset()
+
+    def time_run_step(self, function, n_walkers, obs_size):
+        self.swarm.run_step()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--env", default="discrete", choices=["discrete"] + list(FUNCTIONS))
+    parser.add_argument("--n-walkers", type=int, nargs="+", default=[64, 1024, 16384, 100000])
+    parser.add_argument("--obs-sizes", type=int, nargs="+", default=[2, 1000, 100000])
+    parser.add_argument("--n-steps", type=int, default=10)
+    parser.add_argument("--max-gb", type=float, default=4.0, help="Skip larger configurations")
+    parser.add_argument("--tree", action="store_true", help="Keep track of a HistoryTree")
+    args = parser.parse_args()
+    sweep(
+        args.env,
+        n_walkers=args.n_walkers,
+        obs_sizes=args.obs_sizes,
+        n_steps=args.n_steps,
+        max_bytes=int(args.max_gb * 2 ** 30),
+        tree=args.tree,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -24,7 +24,9 @@ class AtariEnv(DiscreteEnv):
         params.update(super_params)
         return params
 
-    def step(self, model_states: StatesModel, env_states: StatesEnv) -> StatesEnv:
+    def step(
+        self, model_states: StatesModel, env_states: StatesEnv, out: StatesEnv = None
+    ) -> StatesEnv:
         """
         Set the environment to the target states by applying the specified \
         actions an arbitrary number of time steps.
@@ -32,6 +34,7 @@ class AtariEnv(DiscreteEnv):
         Args:
             model_states: States representing the data to be used to act on the environment.
             env_states: States representing the data to be set in the environment.
+            out: Preallocated :class:`StatesEnv` where the new data will be written.
 
         Returns:
             States containing the information that describes the new state of the Environment.
@@ -51,6 +54,7 @@ class AtariEnv(DiscreteEnv):
             ends=ends,
             batch_size=len(actions),
             game_ends=game_ends,
+            out=out,
         )
         return new_state
 
@@ -1,10 +1,9 @@
 import numpy as np
 
+from fragile.core.distances import pairwise_distances
 from fragile.core.utils import relativize
 from fragile.core.walkers import Walkers
 
-# import line_profiler
-
 
 class AtariWalkers(Walkers):
     """
@@ -49,7 +48,6 @@ class MontezumaWalkers(Walkers):
     used in their Go-explore repository.
     """
 
-    # @profile
     def calculate_distances(self) -> None:
         """Calculate the corresponding distance function for each state with \
         respect to another state chosen at random.
@@ -61,7 +59,6 @@ class MontezumaWalkers(Walkers):
         compas_ix = np.random.permutation(np.arange(self.n))
         # This unpacks RAMs from Uber Go-explore custom Montezuma environment
         rams = self.env_states.states.reshape(self.n, -1)[:, :-12].astype(np.uint8)
-        vec = rams - rams[compas_ix]
-        dist_ram = self.distance_function(vec, axis=1).flatten()
+        dist_ram = pairwise_distances(self.distance_function, rams, compas_ix).flatten()
         distances = relativize(dist_ram)
         self.update_states(distances=distances, compas_dist=compas_ix)
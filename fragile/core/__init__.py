@@ -1,5 +1,6 @@
 """Core base classes for developing FAI algorithms."""
 from fragile.core.bounds import Bounds
+from fragile.core.callbacks import SwarmCallback, SwarmMetrics
 from fragile.core.env import DiscreteEnv
 from fragile.core.models import BinarySwap, ContinuousUniform, DiscreteUniform, NormalContinuous
 from fragile.core.swarm import Swarm
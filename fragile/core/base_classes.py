@@ -1,4 +1,4 @@
-from typing import Callable, List, Union
+from typing import Callable, List, Optional, Union
 
 import numpy as np
 
@@ -43,22 +43,34 @@ class StatesOwner:
         """Create new states of given batch_size to store the data of the class."""
         return self.STATE_CLASS(state_dict=self.get_params_dict(), batch_size=batch_size)
 
-    def states_from_data(self, batch_size: int, **kwargs) -> States:
+    def states_from_data(self, batch_size: int, out: Optional[States] = None, **kwargs) -> States:
         """
         Initialize a :class:`States` with the data provided as kwargs.
 
         Args:
             batch_size: Number of elements in the first dimension of the \
                        :class:`State` attributes.
+            out: :class:`States` where the data will be written. If ``None`` \
+                 a new :class:`States` will be created.
             **kwargs: Attributes that will be added to the returned :class:`States`.
 
         Returns:
-            A new :class:`States` created with the class ``params_dict`` updated \
-            with the attributes passed as keyword arguments.
+            A :class:`States` created with the class ``params_dict`` (or ``out`` \
+            if it is provided) updated with the attributes passed as keyword arguments. \
+            The arrays of ``out`` that are not passed as keyword arguments are \
+            filled with zeros, as they would be in a new :class:`States`.
 
         """
-        state = self.create_new_states(batch_size=batch_size)
-        state.update(**kwargs)
+        if out is None:
+            state = self.create_new_states(batch_size=batch_size)
+        else:
+            state = out
+            # Do not leak the data that a previous step wrote in the buffer
+            for name, value in state.items():
+                if name not in kwargs and isinstance(value, np.ndarray):
+                    value[...] = 0
+        # The target arrays are owned by the state, so the data can be written in place.
+        state.assign(**kwargs)
         return state
 
 
@@ -267,13 +279,17 @@ class BaseEnvironment(StatesOwner):
         """
         raise NotImplementedError
 
-    def step(self, model_states: StatesModel, env_states: StatesEnv) -> StatesEnv:
+    def step(
+        self, model_states: StatesModel, env_states: StatesEnv, out: StatesEnv = None
+    ) -> StatesEnv:
         """
         Step the environment for a batch of walkers.
 
         Args:
             model_states: States representing the data to be used to act on the environment.
             env_states: States representing the data to be set in the environment.
+            out: Preallocated :class:`StatesEnv` where the new data will be written. \
+                 If ``None`` a new :class:`StatesEnv` will be returned.
 
         Returns:
             States representing the next state of the environment and all \
@@ -451,7 +467,11 @@ class BaseWalkers(StatesOwner):
         return state_dict
 
     def update_states(
-        self, env_states: StatesEnv = None, model_states: StatesModel = None, **kwargs
+        self,
+        env_states: StatesEnv = None,
+        model_states: StatesModel = None,
+        take_ownership: bool = False,
+        **kwargs
     ) -> None:
         """
         Update the States variables that do not contain internal data and \
@@ -460,6 +480,8 @@ class BaseWalkers(StatesOwner):
         Args:
             env_states: States containing the data associated with the Environment.
             model_states: States containing data associated with the Environment.
+            take_ownership: If ``True`` the data of ``env_states`` and \
+                            ``model_states`` will be stored without copying it.
             **kwargs: Internal states will be updated via keyword arguments.
 
         """
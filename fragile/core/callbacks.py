@@ -0,0 +1,303 @@
+"""Hooks to instrument the evolution loop of a :class:`Swarm`."""
+from collections import defaultdict
+import time
+import tracemalloc
+from typing import Any, Dict
+
+import numpy
+
+# Name of each instrumented phase, and the attribute of the Swarm and the method that implement it.
+# When the attribute is None the method belongs to the Swarm itself.
+PHASES = {
+    "predict": ("model", "predict"),
+    "env_step": ("env", "step"),
+    "update_states": ("walkers", "update_states"),
+    "update_ids": ("walkers", "update_ids"),
+    "distances": ("walkers", "calculate_distances"),
+    "virtual_reward": ("walkers", "calculate_virtual_reward"),
+    "clone_probs": ("walkers", "update_clone_probs"),
+    "clone": ("walkers", "clone_walkers"),
+    "update_tree": (None, "update_tree"),
+    "prune_tree": (None, "prune_tree"),
+}
+
+
+class SwarmCallback:
+    """
+    Receive notifications of the different phases of the evolution loop of \
+    a :class:`Swarm`.
+
+    All the methods do nothing by default, so a callback only needs to \
+    override the hooks it is interested in. When a :class:`Swarm` has no \
+    callbacks its methods are not instrumented at all.
+
+    Set :attr:`uses_ids` to ``True`` in callbacks that read the ids of the \
+    walkers, so the :class:`Swarm` keeps computing them.
+    """
+
+    uses_ids = False
+
+    def on_reset(self, swarm) -> None:
+        """Call after the :class:`Swarm` has been reset."""
+        pass
+
+    def on_step_start(self, swarm) -> None:
+        """Call before running an iteration of the :class:`Swarm`."""
+        pass
+
+    def on_phase_start(self, swarm, phase: str) -> None:
+        """Call before running one of the phases defined in :data:`PHASES`."""
+        pass
+
+    def on_phase_end(self, swarm, phase: str, elapsed: float) -> None:
+        """
+        Call after running one of the phases defined in :data:`PHASES`.
+
+        Args:
+            swarm: :class:`Swarm` that is being instrumented.
+            phase: Name of the phase that has finished.
+            elapsed: Seconds spent in the phase, excluding the time spent in \
+                     the other phases that it called.
+
+        """
+        pass
+
+    def on_step_end(self, swarm, elapsed: float) -> None:
+        """
+        Call after running an iteration of the :class:`Swarm`.
+
+        Args:
+            swarm: :class:`Swarm` that is being instrumented.
+            elapsed: Seconds spent running the iteration.
+
+        """
+        pass
+
+
+class SwarmMetrics(SwarmCallback):
+    """
+    Keep track of the time spent in each phase of the :class:`Swarm`, and \
+    count the walkers that died and cloned, the hash collisions of their ids, \
+    and the bytes copied during the cloning process.
+
+    The values are accumulated since the last time the :class:`Swarm` was \
+    reset, and they can be accessed as a dictionary with :attr:`metrics`.
+    """
+
+    def __init__(self, check_collisions: bool = True, track_allocations: bool = False):
+        """
+        Initialize a :class:`SwarmMetrics`.
+
+        Args:
+            check_collisions: If ``True`` compare the states of the walkers that \
+                              share the same id to count the hash collisions.
+            track_allocations: If ``True`` use ``tracemalloc`` to measure the \
+                               peak memory allocated during each iteration. \
+                               It slows down the :class:`Swarm` considerably. \
+                               If ``tracemalloc`` was already tracing, only the \
+                               net memory allocated is measured.
+        """
+        self.check_collisions = check_collisions
+        self.uses_ids = check_collisions
+        self.track_allocations = track_allocations
+        self.phase_times = defaultdict(float)
+        self.counters = defaultdict(int)
+        self._alloc_start = 0
+        self._owns_tracing = False
+        self.reset()
+
+    @property
+    def metrics(self) -> Dict[str, Any]:
+        """Return a dictionary containing all the values measured."""
+        metrics = dict(self.counters)
+        metrics["phase_times"] = dict(self.phase_times)
+        return metrics
+
+    def reset(self) -> None:
+        """Clear all the values measured."""
+        self.phase_times = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.counters["steps"] = 0
+        self.counters["step_time"] = 0.0
+
+    def on_reset(self, swarm) -> None:
+        """Clear all the values measured."""
+        self.reset()
+
+    def on_step_start(self, swarm) -> None:
+        """Start measuring the memory allocated if applicable."""
+        if self.track_allocations:
+            # tracemalloc.reset_peak is not available before Python 3.9, so the
+            # tracing is restarted at every iteration to measure its peak.
+            self._owns_tracing = not tracemalloc.is_tracing()
+            if self._owns_tracing:
+                tracemalloc.start()
+            self._alloc_start, _ = tracemalloc.get_traced_memory()
+
+    def on_phase_end(self, swarm, phase: str, elapsed: float) -> None:
+        """Accumulate the time of the phase and update its counters."""
+        self.phase_times[phase] += elapsed
+        if phase == "clone":
+            n_cloned = int(swarm.walkers.states.will_clone.sum())
+            self.counters["walkers_cloned"] += n_cloned
+            self.counters["bytes_copied"] += n_cloned * self.cloned_row_bytes(swarm.walkers)
+        elif phase == "update_ids" and self.check_collisions:
+            self.counters["hash_collisions"] += self.count_collisions(swarm.walkers)
+
+    def on_step_end(self, swarm, elapsed: float) -> None:
+        """Update the counters that are measured once per iteration."""
+        self.counters["steps"] += 1
+        self.counters["step_time"] += elapsed
+        self.counters["dead_walkers"] += int(swarm.walkers.env_states.ends.sum())
+        if self.track_allocations:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._owns_tracing:
+                tracemalloc.stop()
+            allocated = peak if self._owns_tracing else current
+            self.counters["allocated_bytes"] += max(0, allocated - self._alloc_start)
+
+    @staticmethod
+    def cloned_row_bytes(walkers) -> int:
+        """Return the number of bytes copied for each walker that clones."""
+
+        def row_bytes(states, names):
+            return sum(
+                states[name].nbytes // walkers.n
+                for name in names
+                if isinstance(states[name], numpy.ndarray)
+                and states[name].ndim > 0
+                and len(states[name]) == walkers.n
+            )
+
+        ignore_env = walkers.ignore_clone.get("env", set())
+        ignore_model = walkers.ignore_clone.get("model", set())
+        env_names = [k for k in walkers.env_states.keys() if k not in ignore_env]
+        model_names = [k for k in walkers.model_states.keys() if k not in ignore_model]
+        return (
+            row_bytes(walkers.env_states, env_names)
+            + row_bytes(walkers.model_states, model_names)
+            + row_bytes(walkers.states, ["cum_rewards", "id_walkers"])
+        )
+
+    @staticmethod
+    def count_collisions(walkers) -> int:
+        """
+        Count the hash collisions of the walker ids.
+
+        The walkers are sorted by id, and each walker whose id is equal to the \
+        id of the previous walker but whose state is different counts as a collision.
+        """
+        ids = numpy.asarray(walkers.states.id_walkers)
+        order = numpy.argsort(ids, kind="stable")
+        repeated = ids[order[1:]] == ids[order[:-1]]
+        if not repeated.any():
+            return 0
+        states = walkers.env_states.states
+        if not isinstance(states, numpy.ndarray) or states.dtype == object:
+            return 0
+        states = states.reshape(len(states), -1)
+        first, second = order[:-1][repeated], order[1:][repeated]
+        return int((states[first] != states[second]).any(axis=1).sum())
+
+
+class PhaseTimer:
+    """
+    Wrap the methods of a :class:`Swarm` and its components to notify the \
+    callbacks of the :class:`Swarm` every time one of its phases is run.
+
+    The methods are wrapped at the instance level, so the classes are not \
+    modified, and a :class:`Swarm` without callbacks has no overhead. \
+    :meth:`restore` puts back the original methods.
+    """
+
+    def __init__(self, swarm):
+        """
+        Initialize a :class:`PhaseTimer`.
+
+        Args:
+            swarm: :class:`Swarm` that will be instrumented.
+        """
+        self.swarm = swarm
+        # Time spent in nested phases, which is excluded from the time of their callers
+        self._children = [0.0]
+        # Objects and attributes that have been wrapped, and their original values
+        self._wrapped = []
+
+    def _wrap(self, target, method: str, wrapped) -> None:
+        """Replace the target method with ``wrapped``, remembering how to restore it."""
+        original = target.__dict__.get(method) if hasattr(target, "__dict__") else None
+        self._wrapped.append((target, method, original))
+        setattr(target, method, wrapped)
+
+    def instrument(self) -> None:
+        """Wrap the methods of all the phases defined in :data:`PHASES`."""
+        for phase, (owner, method) in PHASES.items():
+            target = self.swarm if owner is None else getattr(self.swarm, owner)
+            if target is not None and hasattr(target, method):
+                self._wrap(target, method, self.wrap_phase(getattr(target, method), phase))
+        self._wrap(self.swarm, "run_step", self.wrap_step(self.swarm.run_step))
+        self._wrap(self.swarm, "reset", self.wrap_reset(self.swarm.reset))
+
+    def restore(self) -> None:
+        """Undo :meth:`instrument`, so the methods run without any overhead."""
+        for target, method, original in reversed(self._wrapped):
+            if original is None:
+                delattr(target, method)
+            else:
+                setattr(target, method, original)
+        self._wrapped = []
+
+    def wrap_phase(self, func, phase: str):
+        """Return a function that runs ``func`` notifying the start and end of ``phase``."""
+        swarm, children = self.swarm, self._children
+
+        def run_phase(*args, **kwargs):
+            start = time.perf_counter()
+            for callback in swarm.callbacks:
+                callback.on_phase_start(swarm, phase)
+            children.append(0.0)
+            func_start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - func_start - children.pop()
+            for callback in swarm.callbacks:
+                callback.on_phase_end(swarm, phase, elapsed)
+            children[-1] += time.perf_counter() - start
+            return result
+
+        run_phase.__wrapped__ = func
+        run_phase.__doc__ = func.__doc__
+        return run_phase
+
+    def wrap_step(self, func):
+        """Return a function that runs ``func`` notifying the start and end of the iteration."""
+        swarm = self.swarm
+
+        def run_step(*args, **kwargs):
+            for callback in swarm.callbacks:
+                callback.on_step_start(swarm)
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            elapsed = time.perf_counter() - start
+            for callback in swarm.callbacks:
+                callback.on_step_end(swarm, elapsed)
+            return result
+
+        run_step.__wrapped__ = func
+        run_step.__doc__ = func.__doc__
+        return run_step
+
+    def wrap_reset(self, func):
+        """Return a function that runs ``func`` and notifies the callbacks afterwards."""
+        swarm = self.swarm
+
+        def reset(*args, **kwargs):
+            result = func(*args, **kwargs)
+            for callback in swarm.callbacks:
+                callback.on_reset(swarm)
+            return result
+
+        reset.__wrapped__ = func
+        reset.__doc__ = func.__doc__
+        return reset
@@ -0,0 +1,217 @@
+"""Distance functions used to compare the observations of the walkers."""
+from typing import Callable, Optional, Union
+
+import numpy
+
+from fragile.core.utils import float_type, random_state
+
+# Maximum number of bytes of the temporary arrays created when processing a chunk of rows
+CHUNK_BYTES = 1 << 22
+
+DistanceFunction = Callable[[numpy.ndarray, numpy.ndarray], numpy.ndarray]
+
+
+def _chunk_rows(x: numpy.ndarray, chunk_bytes: int = CHUNK_BYTES) -> int:
+    """Return the number of rows of ``x`` that fit in a chunk of ``chunk_bytes``."""
+    row_bytes = max(1, x[0].size * 8) if len(x) > 0 else 1
+    return max(1, chunk_bytes // row_bytes)
+
+
+def _diff_dtype(x: numpy.ndarray, y: numpy.ndarray) -> numpy.dtype:
+    """Return a signed dtype that can hold the difference of ``x`` and ``y`` without wrapping."""
+    dtype = numpy.result_type(x, y)
+    if dtype.kind == "b":
+        return numpy.dtype(numpy.int8)
+    if dtype.kind in ("u", "i"):
+        return numpy.dtype(numpy.int16 if dtype.itemsize == 1 else numpy.int64)
+    return dtype
+
+
+def _chunked(kernel: Callable) -> Callable:
+    """Apply a row-wise kernel to ``x`` and ``y`` one chunk of rows at a time."""
+
+    def distance(
+        x: numpy.ndarray,
+        y: numpy.ndarray,
+        y_index: Optional[numpy.ndarray] = None,
+        chunk_bytes: int = CHUNK_BYTES,
+    ) -> numpy.ndarray:
+        x = x.reshape(len(x), -1)
+        y = y.reshape(len(y), -1)
+        distances = numpy.empty(len(x), dtype=float_type)
+        dtype = _diff_dtype(x, y)
+        step = _chunk_rows(x, chunk_bytes)
+        for start in range(0, len(x), step):
+            end = min(start + step, len(x))
+            y_chunk = y[start:end] if y_index is None else y[y_index[start:end]]
+            distances[start:end] = kernel(x[start:end], y_chunk, dtype)
+        return distances
+
+    distance.__name__ = kernel.__name__
+    distance.__doc__ = kernel.__doc__
+    return distance
+
+
+@_chunked
+def l2_distance(x: numpy.ndarray, y: numpy.ndarray, dtype: numpy.dtype) -> numpy.ndarray:
+    """
+    Compute the euclidean distance between each pair of rows of ``x`` and ``y``.
+
+    The rows are processed in chunks, so the full difference matrix is never \
+    allocated. Integer observations are subtracted using a wider signed type.
+    """
+    diff = numpy.subtract(x, y, dtype=dtype)
+    acc = numpy.float64 if dtype.kind == "f" else numpy.int64
+    return numpy.sqrt(numpy.einsum("ij,ij->i", diff, diff, dtype=acc))
+
+
+@_chunked
+def l1_distance(x: numpy.ndarray, y: numpy.ndarray, dtype: numpy.dtype) -> numpy.ndarray:
+    """
+    Compute the manhattan distance between each pair of rows of ``x`` and ``y``.
+
+    The rows are processed in chunks, so the full difference matrix is never \
+    allocated. Integer observations are subtracted using a wider signed type.
+    """
+    diff = numpy.subtract(x, y, dtype=dtype)
+    acc = numpy.float64 if dtype.kind == "f" else numpy.int64
+    return numpy.abs(diff, out=diff).sum(axis=1, dtype=acc)
+
+
+@_chunked
+def hamming_distance(x: numpy.ndarray, y: numpy.ndarray, dtype: numpy.dtype) -> numpy.ndarray:
+    """
+    Count the number of different values between each pair of rows of ``x`` and ``y``.
+
+    The rows are processed in chunks, so the full comparison matrix is never allocated.
+    """
+    return numpy.not_equal(x, y).sum(axis=1)
+
+
+DISTANCE_FUNCTIONS = {
+    "l2": l2_distance,
+    "l1": l1_distance,
+    "hamming": hamming_distance,
+}
+
+
+def get_distance_function(distance: Union[str, DistanceFunction, None]) -> DistanceFunction:
+    """
+    Return the distance function that corresponds to the target name.
+
+    Args:
+        distance: Name of a distance function of :data:`DISTANCE_FUNCTIONS`, or \
+                  a callable that will be returned as is. If ``None`` the "l2" \
+                  distance will be returned.
+
+    Returns:
+        Function that takes two batches of observations and returns a vector \
+        with the distance between each pair of rows.
+
+    """
+    if distance is None:
+        return l2_distance
+    elif callable(distance):
+        return distance
+    elif distance in DISTANCE_FUNCTIONS:
+        return DISTANCE_FUNCTIONS[distance]
+    raise ValueError(
+        "distance must be a callable or one of {}, got {} instead".format(
+            list(DISTANCE_FUNCTIONS.keys()), distance
+        )
+    )
+
+
+def pairwise_distances(
+    distance_function: DistanceFunction, observs: numpy.ndarray, compas_ix: numpy.ndarray
+) -> numpy.ndarray:
+    """
+    Calculate the distance between each observation and the observation of its companion.
+
+    The built-in distance functions read the observations of the companions \
+    directly, instead of gathering them in a new array.
+
+    Args:
+        distance_function: Function used to compare the observations.
+        observs: Batch of observations. Its first dimension indexes the walkers.
+        compas_ix: Index of the companion of each walker.
+
+    Returns:
+        Vector containing the distance of each walker to its companion.
+
+    """
+    observs = observs.reshape(len(observs), -1)
+    if distance_function in DISTANCE_FUNCTIONS.values():
+        return distance_function(observs, observs, y_index=compas_ix)
+    return distance_function(observs, observs[compas_ix])
+
+
+class RandomProjection:
+    """
+    Project the observations into a low dimensional space using a random \
+    gaussian matrix.
+
+    Distances between the projected observations approximate the distances \
+    between the original observations.
+    """
+
+    def __init__(self, n_components: int = 64, seed: int = None):
+        """
+        Initialize a :class:`RandomProjection`.
+
+        Args:
+            n_components: Dimension of the projected observations.
+            seed: Seed of the random matrix. If ``None`` the random state of \
+                  fragile will be used.
+        """
+        self.n_components = n_components
+        self.seed = seed
+        self._matrix = None
+
+    def __call__(self, observs: numpy.ndarray) -> numpy.ndarray:
+        """Return the projection of a batch of observations."""
+        observs = observs.reshape(len(observs), -1)
+        matrix = self._get_matrix(observs.shape[1])
+        embedding = numpy.empty((len(observs), self.n_components), dtype=float_type)
+        # Cast integer observations to float one chunk at a time
+        step = _chunk_rows(observs)
+        for start in range(0, len(observs), step):
+            end = min(start + step, len(observs))
+            numpy.dot(observs[start:end].astype(float_type), matrix, out=embedding[start:end])
+        return embedding
+
+    def _get_matrix(self, n_features: int) -> numpy.ndarray:
+        """Return the projection matrix, creating it if the number of features changed."""
+        if self._matrix is None or self._matrix.shape[0] != n_features:
+            rng = random_state if self.seed is None else numpy.random.RandomState(self.seed)
+            matrix = rng.standard_normal((n_features, self.n_components))
+            self._matrix = (matrix / numpy.sqrt(self.n_components)).astype(float_type)
+        return self._matrix
+
+
+class Downsample:
+    """
+    Reduce the size of the observations by keeping one out of every ``factor`` \
+    values along each one of their spatial dimensions.
+
+    The dtype of the observations is preserved, so ``uint8`` frames stay ``uint8``.
+    """
+
+    def __init__(self, factor: int = 2, n_spatial_dims: int = 2):
+        """
+        Initialize a :class:`Downsample`.
+
+        Args:
+            factor: Stride applied to each spatial dimension.
+            n_spatial_dims: Number of dimensions after the batch dimension that \
+                            will be downsampled. For frames of shape \
+                            (n_walkers, height, width, channels) it should be 2.
+        """
+        self.factor = factor
+        self.n_spatial_dims = n_spatial_dims
+
+    def __call__(self, observs: numpy.ndarray) -> numpy.ndarray:
+        """Return the downsampled version of a batch of observations."""
+        n_dims = min(self.n_spatial_dims, observs.ndim - 1)
+        index = (slice(None),) + tuple(slice(None, None, self.factor) for _ in range(n_dims))
+        return numpy.ascontiguousarray(observs[index]).reshape(len(observs), -1)
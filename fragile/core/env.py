@@ -50,19 +50,26 @@ class Environment(BaseEnvironment):
         }
         return params
 
-    def states_from_data(self, batch_size, states, observs, rewards, ends, **kwargs) -> StatesEnv:
-        """Return a new :class:`StatesEnv` object containing the data generated \
-        by the environment."""
-        ends = np.array(ends, dtype=np.bool_)
-        rewards = np.array(rewards, dtype=np.float32)
-        observs = np.array(observs)
-        states = np.array(states)
+    def states_from_data(
+        self, batch_size, states, observs, rewards, ends, out: StatesEnv = None, **kwargs
+    ) -> StatesEnv:
+        """
+        Return a :class:`StatesEnv` object containing the data generated by the environment.
+
+        If ``out`` is provided the data will be written into it instead of \
+        allocating a new :class:`StatesEnv`.
+        """
+        ends = np.asarray(ends, dtype=np.bool_)
+        rewards = np.asarray(rewards, dtype=np.float32)
+        observs = np.asarray(observs)
+        states = np.asarray(states)
         state = super(Environment, self).states_from_data(
             batch_size=batch_size,
             states=states,
             observs=observs,
             rewards=rewards,
             ends=ends,
+            out=out,
             **kwargs
         )
         return state
@@ -94,8 +101,9 @@ class DiscreteEnv(Environment):
         """Return the number of different discrete actions that can be taken in the environment."""
         return self._n_actions
 
-    # @profile
-    def step(self, model_states: StatesModel, env_states: StatesEnv) -> StatesEnv:
+    def step(
+        self, model_states: StatesModel, env_states: StatesEnv, out: StatesEnv = None
+    ) -> StatesEnv:
         """
         Set the environment to the target states by applying the specified \
         actions an arbitrary number of time steps.
@@ -103,6 +111,7 @@ class DiscreteEnv(Environment):
         Args:
             model_states: States representing the data to be used to act on the environment..
             env_states: States representing the data to be set in the environment.
+            out: Preallocated :class:`StatesEnv` where the new data will be written.
 
         Returns:
             States containing the information that describes the new state of the Environment.
@@ -114,10 +123,41 @@ class DiscreteEnv(Environment):
             actions=actions, states=env_states.states, n_repeat_action=n_repeat_actions
         )
 
-        new_state = self.states_from_data(len(actions), new_states, observs, rewards, ends)
+        new_state = self.states_from_data(
+            len(actions), new_states, observs, rewards, ends, out=out
+        )
         return new_state
 
-    # @profile
+    def replay(self, states: np.ndarray, actions: np.ndarray, dts: np.ndarray = None) -> StatesEnv:
+        """
+        Apply the recorded actions to the recorded states in a single call to \
+        ``step_batch``, to check that a recorded trajectory can be reproduced.
+
+        The state ``states[i]`` is reached applying ``actions[i]`` ``dts[i]`` \
+        times to ``states[i - 1]``, as in the branches returned by \
+        :meth:`HistoryTree.get_branch_arrays`. All the transitions are stepped \
+        at the same time, so it does not need to replay the trajectory one \
+        step after another.
+
+        Args:
+            states: Recorded states of the trajectory.
+            actions: Action that lead to each one of the states.
+            dts: Number of times each action was applied. If ``None`` every \
+                 action was applied once.
+
+        Returns:
+            States containing the ``len(states) - 1`` states reached from each \
+            recorded state but the last one. If the trajectory is reproducible \
+            its ``states`` will be equal to ``states[1:]``.
+
+        """
+        actions = np.asarray(actions)[1:].astype(np.int32)
+        dts = np.ones(len(actions), dtype=np.int64) if dts is None else np.asarray(dts)[1:]
+        new_states, observs, rewards, ends, infos = self._env.step_batch(
+            actions=actions, states=np.asarray(states)[:-1], n_repeat_action=dts
+        )
+        return self.states_from_data(len(actions), new_states, observs, rewards, ends)
+
     def reset(self, batch_size: int = 1, **kwargs) -> StatesEnv:
         """
         Reset the environment to the start of a new episode and returns a new \
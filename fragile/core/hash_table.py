@@ -0,0 +1,175 @@
+"""Open addressing hash table that maps state hashes to node ids."""
+from typing import Tuple
+
+from numba import jit
+import numpy
+
+_EMPTY = 0
+_FULL = 1
+_DELETED = 2
+_GOLDEN = numpy.uint64(0x9E3779B97F4A7C15)
+_SHIFT = numpy.uint64(29)
+
+
+@jit(nopython=True)
+def _first_slot(key, mask):
+    """Return the first slot of the target key in a table of ``mask + 1`` slots."""
+    h = numpy.uint64(key) * _GOLDEN
+    return numpy.int64((h ^ (h >> _SHIFT)) & numpy.uint64(mask))
+
+
+@jit(nopython=True)
+def _table_get(keys, values, status, queries, out):
+    """Write in ``out`` the values of the queried keys, or -1 if they are not present."""
+    mask = keys.shape[0] - 1
+    for i in range(queries.shape[0]):
+        query = queries[i]
+        slot = _first_slot(query, mask)
+        out[i] = -1
+        while status[slot] != _EMPTY:
+            if status[slot] == _FULL and keys[slot] == query:
+                out[i] = values[slot]
+                break
+            slot = (slot + 1) & mask
+
+
+@jit(nopython=True)
+def _table_insert(keys, values, status, new_keys, new_values):
+    """
+    Insert or update a batch of keys. Return the number of new keys and the \
+    number of deleted slots that were reused.
+    """
+    mask = keys.shape[0] - 1
+    n_new, n_reused = 0, 0
+    for i in range(new_keys.shape[0]):
+        key = new_keys[i]
+        slot = _first_slot(key, mask)
+        free_slot = -1
+        while status[slot] != _EMPTY:
+            if status[slot] == _FULL and keys[slot] == key:
+                break
+            if status[slot] == _DELETED and free_slot < 0:
+                free_slot = slot
+            slot = (slot + 1) & mask
+        if status[slot] == _FULL:
+            values[slot] = new_values[i]
+            continue
+        if free_slot >= 0:
+            slot = free_slot
+            n_reused += 1
+        keys[slot] = key
+        values[slot] = new_values[i]
+        status[slot] = _FULL
+        n_new += 1
+    return n_new, n_reused
+
+
+@jit(nopython=True)
+def _table_remove(keys, status, old_keys):
+    """Remove a batch of keys from the table and return the number of keys removed."""
+    mask = keys.shape[0] - 1
+    n_removed = 0
+    for i in range(old_keys.shape[0]):
+        key = old_keys[i]
+        slot = _first_slot(key, mask)
+        while status[slot] != _EMPTY:
+            if status[slot] == _FULL and keys[slot] == key:
+                status[slot] = _DELETED
+                n_removed += 1
+                break
+            slot = (slot + 1) & mask
+    return n_removed
+
+
+class HashTable:
+    """
+    Map int64 keys to int64 values using an open addressing hash table with \
+    linear probing.
+
+    All the operations work on batches of keys and run in compiled code, so \
+    no Python object is created for each key.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        """
+        Initialize a :class:`HashTable`.
+
+        Args:
+            capacity: Initial number of slots of the table. It will be rounded \
+                      up to a power of two.
+        """
+        self._keys = None
+        self._values = None
+        self._status = None
+        self._n_items = 0
+        self._n_deleted = 0
+        self._allocate(capacity)
+
+    def __len__(self) -> int:
+        return self._n_items
+
+    @property
+    def capacity(self) -> int:
+        """Return the number of slots of the table."""
+        return len(self._keys)
+
+    def _allocate(self, capacity: int) -> None:
+        """Replace the internal arrays with empty arrays of the target capacity."""
+        capacity = 1 << int(numpy.ceil(numpy.log2(max(capacity, 8))))
+        self._keys = numpy.zeros(capacity, dtype=numpy.int64)
+        self._values = numpy.zeros(capacity, dtype=numpy.int64)
+        self._status = numpy.zeros(capacity, dtype=numpy.uint8)
+        self._n_items = 0
+        self._n_deleted = 0
+
+    def _reserve(self, n_keys: int) -> None:
+        """Rebuild the table if inserting ``n_keys`` would fill more than half of its slots."""
+        if 2 * (self._n_items + self._n_deleted + n_keys) <= self.capacity:
+            return
+        keys, values = self.items()
+        self._allocate(4 * (self._n_items + n_keys))
+        self.insert(keys, values)
+
+    def clear(self) -> None:
+        """Remove all the keys of the table."""
+        self._status[:] = _EMPTY
+        self._n_items = 0
+        self._n_deleted = 0
+
+    def items(self) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """Return two arrays containing the keys and values stored in the table."""
+        full = self._status == _FULL
+        return self._keys[full], self._values[full]
+
+    def get(self, keys: numpy.ndarray) -> numpy.ndarray:
+        """
+        Return the values of the target keys.
+
+        Args:
+            keys: Array of integer keys.
+
+        Returns:
+            Array of int64 containing the value of each key, or -1 if the key \
+            is not present in the table.
+
+        """
+        keys = numpy.ascontiguousarray(keys, dtype=numpy.int64).reshape(-1)
+        out = numpy.empty(len(keys), dtype=numpy.int64)
+        _table_get(self._keys, self._values, self._status, keys, out)
+        return out
+
+    def insert(self, keys: numpy.ndarray, values: numpy.ndarray) -> None:
+        """Insert the target keys in the table, updating the value of the existing ones."""
+        keys = numpy.ascontiguousarray(keys, dtype=numpy.int64).reshape(-1)
+        values = numpy.ascontiguousarray(values, dtype=numpy.int64).reshape(-1)
+        self._reserve(len(keys))
+        n_new, n_reused = _table_insert(self._keys, self._values, self._status, keys, values)
+        self._n_items += n_new
+        self._n_deleted -= n_reused
+
+    def remove(self, keys: numpy.ndarray) -> None:
+        """Remove the target keys from the table. Missing keys are ignored."""
+        keys = numpy.ascontiguousarray(keys, dtype=numpy.int64).reshape(-1)
+        n_removed = _table_remove(self._keys, self._status, keys)
+        self._n_items -= n_removed
+        self._n_deleted += n_removed
@@ -0,0 +1,480 @@
+"""
+Low level routines that move the data of the walkers around and score it.
+
+The numba kernels are compiled with ``cache=True``, so the machine code is \
+stored on disk and reused by the next processes. The kernels that only work \
+with one type of data are compiled eagerly when the module is imported, and \
+:func:`warmup_kernels` compiles the rest for the dtypes used by the walkers.
+"""
+from typing import Iterable, Tuple
+
+from numba import boolean, float64, int64, jit, prange, void
+import numpy
+
+from fragile.core.utils import relativize
+
+BACKENDS = ("numpy", "numba")
+
+
+def clone_indexes(
+    will_clone: numpy.ndarray, compas_ix: numpy.ndarray
+) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Compute the indexes of the rows that will be overwritten during the cloning \
+    process, and the indexes of the rows that will be copied over them.
+
+    Args:
+        will_clone: Array of shape (n_walkers,) of booleans indicating the \
+                    index of the walkers that will clone to a random companion.
+        compas_ix: Array of integers of shape (n_walkers,). Contains the \
+                   indexes of the walkers that will be copied.
+
+    Returns:
+        Tuple containing the indexes of the cloning walkers and the indexes of \
+        their companions. Both arrays have the same length, equal to the number \
+        of walkers that will clone.
+
+    """
+    clone_ix = numpy.flatnonzero(will_clone)
+    return clone_ix, numpy.asarray(compas_ix)[clone_ix]
+
+
+@jit(nopython=True, cache=True)
+def _clone_rows_numba(data, clone_ix, source_ix):
+    """
+    Copy the rows ``source_ix`` of a 2D array over the rows ``clone_ix``.
+
+    Only the source rows that will also be overwritten are staged in a \
+    temporary buffer. The rest of the rows are copied directly.
+    """
+    is_target = numpy.zeros(data.shape[0], dtype=numpy.bool_)
+    for i in range(clone_ix.shape[0]):
+        is_target[clone_ix[i]] = True
+    n_staged = 0
+    for i in range(source_ix.shape[0]):
+        if is_target[source_ix[i]]:
+            n_staged += 1
+    staged = numpy.empty((n_staged, data.shape[1]), dtype=data.dtype)
+    slot = 0
+    for i in range(source_ix.shape[0]):
+        if is_target[source_ix[i]]:
+            staged[slot] = data[source_ix[i]]
+            slot += 1
+    slot = 0
+    for i in range(clone_ix.shape[0]):
+        if is_target[source_ix[i]]:
+            data[clone_ix[i]] = staged[slot]
+            slot += 1
+        else:
+            data[clone_ix[i]] = data[source_ix[i]]
+
+
+def _supports_numba(array: numpy.ndarray) -> bool:
+    """Return ``True`` if the target array can be cloned using the numba kernel."""
+    return (
+        array.ndim > 0
+        and array.size > 0
+        and array.flags.c_contiguous
+        and array.dtype.kind in "biuf"
+    )
+
+
+def clone_rows(
+    array: numpy.ndarray,
+    clone_ix: numpy.ndarray,
+    source_ix: numpy.ndarray,
+    backend: str = "numpy",
+) -> None:
+    """
+    Copy the rows ``source_ix`` of the target array over its rows ``clone_ix`` \
+    in place.
+
+    Only the rows that will be cloned are gathered, so the cost of the \
+    operation is proportional to the number of cloning walkers instead of the \
+    total number of walkers.
+
+    Args:
+        array: Array that will be modified. Its first dimension indexes the walkers.
+        clone_ix: Indexes of the rows that will be overwritten.
+        source_ix: Indexes of the rows that will be copied.
+        backend: "numpy" or "numba". Arrays that cannot be processed by the \
+                 numba kernel will always use the numpy backend.
+
+    Returns:
+        None.
+
+    """
+    if len(clone_ix) == 0:
+        return
+    if backend == "numba" and _supports_numba(array):
+        _clone_rows_numba(array.reshape(array.shape[0], -1), clone_ix, source_ix)
+    else:
+        array[clone_ix] = array[source_ix]
+
+
+_HASH_SEED = numpy.uint64(0x9E3779B97F4A7C15)
+_HASH_PRIME = numpy.uint64(0x100000001B3)
+_FMIX_1 = numpy.uint64(0xFF51AFD7ED558CCD)
+_FMIX_2 = numpy.uint64(0xC4CEB9FE1A85EC53)
+_SHIFT = numpy.uint64(33)
+
+
+@jit(nopython=True, cache=True)
+def _finalize_hash(h):
+    """Apply the Murmur3 finalizer to spread the entropy over all the bits."""
+    h ^= h >> _SHIFT
+    h *= _FMIX_1
+    h ^= h >> _SHIFT
+    h *= _FMIX_2
+    h ^= h >> _SHIFT
+    return h
+
+
+@jit(nopython=True, cache=True)
+def _hash_rows_numba(words, rows):
+    """Compute a 64-bit hash of the target rows of a 2D array of uint64 words."""
+    hashes = numpy.empty(rows.shape[0], dtype=numpy.uint64)
+    for i in range(rows.shape[0]):
+        h = _HASH_SEED ^ numpy.uint64(words.shape[1])
+        for j in range(words.shape[1]):
+            h = (h ^ words[rows[i], j]) * _HASH_PRIME
+            h ^= h >> _SHIFT
+        hashes[i] = _finalize_hash(h)
+    return hashes
+
+
+@jit(nopython=True, cache=True)
+def _hash_byte_rows_numba(data, rows):
+    """
+    Compute the same hash as :func:`_hash_rows_numba` for rows of bytes whose \
+    length is not a multiple of 8, as if they were padded with zeros.
+    """
+    n_bytes = data.shape[1]
+    n_words = (n_bytes + 7) // 8
+    hashes = numpy.empty(rows.shape[0], dtype=numpy.uint64)
+    for i in range(rows.shape[0]):
+        h = _HASH_SEED ^ numpy.uint64(n_words)
+        for j in range(n_words):
+            word = numpy.uint64(0)
+            for k in range(min(8, n_bytes - 8 * j)):
+                word |= numpy.uint64(data[rows[i], 8 * j + k]) << numpy.uint64(8 * k)
+            h = (h ^ word) * _HASH_PRIME
+            h ^= h >> _SHIFT
+        hashes[i] = _finalize_hash(h)
+    return hashes
+
+
+def hash_rows(array: numpy.ndarray, rows: numpy.ndarray = None) -> numpy.ndarray:
+    """
+    Compute a 64-bit hash for each row of the target array.
+
+    The hash is calculated over the raw bytes of each row in a single compiled \
+    pass, without creating a bytes object for every walker. Only the selected \
+    rows are read, and the array is not copied unless it is not contiguous.
+
+    Args:
+        array: Array whose first dimension indexes the walkers. It cannot \
+               have object dtype.
+        rows: Indexes of the rows that will be hashed. If ``None`` all the \
+              rows will be hashed.
+
+    Returns:
+        Array of int64 containing the hashes of the selected rows.
+
+    """
+    rows = numpy.arange(array.shape[0]) if rows is None else numpy.asarray(rows, dtype=numpy.int64)
+    if array.size == 0:
+        return numpy.zeros(len(rows), dtype=numpy.int64)
+    if not array.flags.c_contiguous:
+        # Copy only the selected rows
+        array = numpy.ascontiguousarray(array[rows])
+        rows = numpy.arange(len(rows))
+    data = array.reshape(array.shape[0], -1).view(numpy.uint8)
+    if data.shape[1] % 8 == 0:
+        return _hash_rows_numba(data.view(numpy.uint64), rows).view(numpy.int64)
+    return _hash_byte_rows_numba(data, rows).view(numpy.int64)
+
+
+@jit(nopython=True, cache=True)
+def _virtual_reward_numba(
+    rewards, distances, reward_scale, dist_scale, sign, processed_rewards, virtual_rewards
+):
+    """Compute the virtual reward and the entropy of the walkers in two passes."""
+    n_walkers = rewards.shape[0]
+    mean = sign * rewards.mean()
+    std = rewards.std()
+    sum_reward, sum_dist = 0.0, 0.0
+    for i in range(n_walkers):
+        if std == 0:
+            processed = 1.0
+        else:
+            standard = (sign * rewards[i] - mean) / std
+            processed = numpy.log1p(standard) + 1.0 if standard > 0 else numpy.exp(standard)
+        processed_rewards[i] = processed
+        score_reward = processed ** reward_scale
+        score_dist = distances[i] ** dist_scale
+        virtual_rewards[i] = score_reward * score_dist
+        sum_reward += score_reward
+        sum_dist += score_dist
+    total_entropy, min_entropy = 1.0, 1.0
+    for i in range(n_walkers):
+        reward_prob = processed_rewards[i] ** reward_scale / sum_reward
+        dist_prob = distances[i] ** dist_scale / sum_dist
+        total_entropy *= 2 - dist_prob ** reward_prob
+        min_entropy *= 2 - reward_prob ** reward_prob
+    return min_entropy, total_entropy
+
+
+def _virtual_reward_numpy(
+    rewards, distances, reward_scale, dist_scale, minimize, processed_rewards, virtual_rewards
+):
+    """Compute the virtual reward and the entropy of the walkers reusing the output buffers."""
+    rewards = numpy.negative(rewards) if minimize else rewards
+    processed_rewards = relativize(rewards, out=processed_rewards)
+    score_reward = numpy.power(processed_rewards, reward_scale, out=virtual_rewards)
+    score_dist = numpy.power(distances, dist_scale)
+    reward_prob = score_reward / score_reward.sum()
+    virtual_rewards = numpy.multiply(score_reward, score_dist, out=score_reward)
+    dist_prob = numpy.divide(score_dist, score_dist.sum(), out=score_dist)
+    # Both entropy terms are accumulated in the buffer of dist_prob
+    entropy = numpy.power(dist_prob, reward_prob, out=dist_prob)
+    total_entropy = numpy.subtract(2, entropy, out=entropy).prod()
+    entropy = numpy.power(reward_prob, reward_prob, out=entropy)
+    min_entropy = numpy.subtract(2, entropy, out=entropy).prod()
+    return processed_rewards, virtual_rewards, min_entropy, total_entropy
+
+
+def virtual_reward(
+    rewards: numpy.ndarray,
+    distances: numpy.ndarray,
+    reward_scale: float = 1.0,
+    dist_scale: float = 1.0,
+    minimize: bool = False,
+    processed_rewards: numpy.ndarray = None,
+    virtual_rewards: numpy.ndarray = None,
+    backend: str = "numpy",
+) -> Tuple[numpy.ndarray, numpy.ndarray, float, float]:
+    """
+    Calculate the virtual reward of the walkers and the entropy terms used \
+    to compute the efficiency of the :class:`Swarm`.
+
+    The rewards are relativized and combined with the distances in a single \
+    kernel. The results are written in the provided buffers, and they keep \
+    the dtype of the rewards.
+
+    Args:
+        rewards: Cumulative rewards of the walkers.
+        distances: Distances of the walkers, already relativized.
+        reward_scale: Exponent applied to the relativized rewards.
+        dist_scale: Exponent applied to the distances.
+        minimize: If ``True`` lower rewards will get a higher score.
+        processed_rewards: Buffer where the relativized rewards will be \
+                           written. If ``None`` a new array will be allocated.
+        virtual_rewards: Buffer where the virtual rewards will be written. \
+                         If ``None`` a new array will be allocated.
+        backend: "numpy" or "numba".
+
+    Returns:
+        Tuple containing the relativized rewards, the virtual rewards, the \
+        minimum entropy and the total entropy of the walkers.
+
+    """
+    dtype = rewards.dtype if numpy.issubdtype(rewards.dtype, numpy.floating) else numpy.float64
+    if processed_rewards is None:
+        processed_rewards = numpy.empty(rewards.shape, dtype=dtype)
+    if virtual_rewards is None:
+        virtual_rewards = numpy.empty(rewards.shape, dtype=dtype)
+    if backend == "numba":
+        min_entropy, total_entropy = _virtual_reward_numba(
+            rewards,
+            distances,
+            float(reward_scale),
+            float(dist_scale),
+            -1.0 if minimize else 1.0,
+            processed_rewards,
+            virtual_rewards,
+        )
+        return processed_rewards, virtual_rewards, min_entropy, total_entropy
+    return _virtual_reward_numpy(
+        rewards, distances, reward_scale, dist_scale, minimize, processed_rewards, virtual_rewards
+    )
+
+
+@jit(void(boolean[:, :], int64[:, :]), nopython=True, cache=True)
+def _flip_values_numba(values, flips):
+    """Negate the columns ``flips`` of each row of a 2D array of booleans."""
+    for i in range(flips.shape[0]):
+        for j in range(flips.shape[1]):
+            values[i, flips[i, j]] = not values[i, flips[i, j]]
+
+
+def flip_values(values: numpy.ndarray, flips: numpy.ndarray) -> numpy.ndarray:
+    """
+    Negate the target columns of each row of a boolean matrix.
+
+    Args:
+        values: Array of shape (n_walkers, n_values) that will be converted \
+                to booleans. If it is a contiguous array of booleans it will \
+                be modified in place.
+        flips: Array of integers of shape (n_walkers, n_flips) containing the \
+               indexes of the columns that will be negated in each row. If a \
+               column appears more than once in a row it is negated every time.
+
+    Returns:
+        Boolean array containing the flipped values.
+
+    """
+    values = numpy.ascontiguousarray(values, dtype=numpy.bool_)
+    _flip_values_numba(values, numpy.ascontiguousarray(flips, dtype=numpy.int64))
+    return values
+
+
+@jit(float64(float64[:, ::1], float64), nopython=True, cache=True)
+def _cluster_energy(atoms, cutoff2):
+    """Compute the Lennard-Jones energy of a cluster visiting each pair of atoms once."""
+    energy = 0.0
+    for i in range(atoms.shape[0]):
+        for j in range(i + 1, atoms.shape[0]):
+            r2 = 0.0
+            for dim in range(3):
+                diff = atoms[i, dim] - atoms[j, dim]
+                r2 += diff * diff
+            if r2 == 0.0:
+                return numpy.inf
+            elif r2 < cutoff2:
+                r6i = 1.0 / (r2 * r2 * r2)
+                energy += r6i * (r6i - 1.0)
+    return 4.0 * energy
+
+
+@jit(float64(float64[:, ::1], float64), nopython=True, cache=True)
+def _cluster_energy_cells(atoms, cutoff):
+    """
+    Compute the Lennard-Jones energy of a cluster ignoring the pairs of atoms \
+    further apart than ``cutoff``.
+
+    The atoms are binned in cubic cells of side ``cutoff``, and each atom is \
+    only compared with the atoms of its own cell and the 26 neighbouring ones.
+    """
+    n_atoms = atoms.shape[0]
+    low = numpy.empty(3)
+    n_cells = numpy.empty(3, dtype=numpy.int64)
+    for dim in range(3):
+        low[dim] = atoms[:, dim].min()
+        n_cells[dim] = int((atoms[:, dim].max() - low[dim]) / cutoff) + 1
+    if n_cells[0] * n_cells[1] * n_cells[2] > 8 * n_atoms:
+        # The atoms are spread over too many cells to make binning them worth it
+        return _cluster_energy(atoms, cutoff * cutoff)
+    cells = numpy.empty((n_atoms, 3), dtype=numpy.int64)
+    head = numpy.full(n_cells[0] * n_cells[1] * n_cells[2], -1, dtype=numpy.int64)
+    next_atom = numpy.empty(n_atoms, dtype=numpy.int64)
+    for i in range(n_atoms):
+        for dim in range(3):
+            cells[i, dim] = int((atoms[i, dim] - low[dim]) / cutoff)
+        cell = (cells[i, 0] * n_cells[1] + cells[i, 1]) * n_cells[2] + cells[i, 2]
+        next_atom[i] = head[cell]
+        head[cell] = i
+    cutoff2 = cutoff * cutoff
+    energy = 0.0
+    for i in range(n_atoms):
+        for dx in range(max(cells[i, 0] - 1, 0), min(cells[i, 0] + 2, n_cells[0])):
+            for dy in range(max(cells[i, 1] - 1, 0), min(cells[i, 1] + 2, n_cells[1])):
+                for dz in range(max(cells[i, 2] - 1, 0), min(cells[i, 2] + 2, n_cells[2])):
+                    j = head[(dx * n_cells[1] + dy) * n_cells[2] + dz]
+                    while j >= 0:
+                        # Only the pairs of the upper triangle are counted
+                        if j > i:
+                            r2 = 0.0
+                            for dim in range(3):
+                                diff = atoms[i, dim] - atoms[j, dim]
+                                r2 += diff * diff
+                            if r2 == 0.0:
+                                return numpy.inf
+                            elif r2 < cutoff2:
+                                r6i = 1.0 / (r2 * r2 * r2)
+                                energy += r6i * (r6i - 1.0)
+                        j = next_atom[j]
+    return 4.0 * energy
+
+
+# Compiled on the first call: compiling a parallel kernel starts the threads of numba,
+# and forking the process after that can deadlock.
+@jit(nopython=True, parallel=True, cache=True)
+def _lennard_jones_numba(points, cutoff, use_cells):
+    """Compute the Lennard-Jones energy of each cluster of a batch in parallel."""
+    energies = numpy.empty(points.shape[0])
+    for k in prange(points.shape[0]):
+        atoms = points[k].reshape(-1, 3)
+        if use_cells:
+            energies[k] = _cluster_energy_cells(atoms, cutoff)
+        else:
+            energies[k] = _cluster_energy(atoms, cutoff * cutoff)
+    return energies
+
+
+CELL_LIST_MIN_ATOMS = 64
+
+
+def lennard_jones_energy(
+    points: numpy.ndarray, cutoff: float = None, cell_list: bool = None
+) -> numpy.ndarray:
+    """
+    Compute the Lennard-Jones energy of a batch of atom clusters.
+
+    The clusters are evaluated in parallel, and each pair of atoms is visited \
+    once. The energy of a cluster with two atoms in the same position is \
+    infinite.
+
+    Args:
+        points: Array of shape (n_walkers, 3 * n_atoms) containing the \
+                flattened coordinates of the atoms of each cluster.
+        cutoff: If it is not ``None``, the pairs of atoms further apart than \
+                ``cutoff`` do not contribute to the energy.
+        cell_list: If ``True`` bin the atoms in cells of side ``cutoff`` to \
+                   skip the pairs of atoms that are too far apart. If ``None`` \
+                   it is used when there is a ``cutoff`` and the clusters \
+                   have at least ``CELL_LIST_MIN_ATOMS`` atoms.
+
+    Returns:
+        Array of float64 containing the energy of each cluster.
+
+    """
+    points = numpy.ascontiguousarray(points, dtype=numpy.float64)
+    points = points.reshape(points.shape[0], -1)
+    if cutoff is None:
+        if cell_list:
+            raise ValueError("A cutoff is needed to use a cell list")
+        return _lennard_jones_numba(points, numpy.inf, False)
+    if cell_list is None:
+        cell_list = points.shape[1] // 3 >= CELL_LIST_MIN_ATOMS
+    return _lennard_jones_numba(points, float(cutoff), bool(cell_list))
+
+
+WARMUP_DTYPES = (numpy.float32, numpy.float64, numpy.int64, numpy.bool_, numpy.uint8)
+
+
+def warmup_kernels(dtypes: Iterable = WARMUP_DTYPES) -> None:
+    """
+    Compile the numba kernels that are specialized on the dtype of the data.
+
+    Call it before running an algorithm with the "numba" backend, so the \
+    compilation does not happen during its first iteration. The kernels are \
+    cached, so it only takes a noticeable time the first time that it runs.
+
+    Args:
+        dtypes: dtypes of the data that will be cloned and scored.
+
+    Returns:
+        None.
+
+    """
+    clone_ix, source_ix = numpy.array([0]), numpy.array([1])
+    hash_rows(numpy.zeros((2, 8), dtype=numpy.uint8))
+    hash_rows(numpy.zeros((2, 3), dtype=numpy.uint8))
+    for dtype in {numpy.dtype(dtype) for dtype in dtypes}:
+        if dtype.kind not in "biuf":
+            continue
+        clone_rows(numpy.zeros((2, 1), dtype=dtype), clone_ix, source_ix, backend="numba")
+        if dtype.kind == "f":
+            values = numpy.ones(2, dtype=dtype)
+            virtual_reward(values, values, backend="numba")
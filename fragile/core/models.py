@@ -1,11 +1,11 @@
 from typing import Optional, Union
 
-from numba import jit
 import numpy as np
 
 from fragile.core.base_classes import BaseCritic, BaseModel
 from fragile.core.bounds import Bounds
 from fragile.core.env import DiscreteEnv
+from fragile.core.kernels import flip_values
 from fragile.core.states import StatesEnv, StatesModel, StatesWalkers
 from fragile.core.utils import float_type, StateDict
 
@@ -339,19 +339,11 @@ class BinarySwap(DiscreteModel):
 
         """
 
-        @jit(nopython=True)
-        def flip_values(actions, flips):
-            for i in range(flips.shape[0]):
-                for j in range(flips.shape[1]):
-                    actions[i, flips[i, j]] = np.logical_not(actions[i, flips[i, j]])
-            return actions
-
         actions = (
             env_states.observs.copy()
             if env_states is not None
             else np.zeros((batch_size, self.n_actions))
         )
-        actions = actions.astype(bool)
         flips = self.random_state.randint(0, self.n_actions, size=(batch_size, self.n_swaps))
         actions = flip_values(actions, flips).astype(int)
         return self.update_states_with_critic(
@@ -0,0 +1,636 @@
+"""Storage backends for the states of the nodes of a :class:`HistoryTree`."""
+import os
+import tempfile
+from typing import Generator
+
+import numpy
+
+from fragile.core.hash_table import HashTable
+
+
+class ArrayStore:
+    """
+    Store a full copy of the state of each node in a growable array indexed \
+    by node id.
+
+    It is the default storage of the :class:`HistoryTree`, and it supports \
+    states of any dtype, including objects.
+    """
+
+    def __init__(self):
+        """Initialize an :class:`ArrayStore`."""
+        self._data = None
+        self._capacity = 0
+
+    @property
+    def nbytes(self) -> int:
+        """Return the number of bytes used to store the states."""
+        return 0 if self._data is None else self._data.nbytes
+
+    def reset(self) -> None:
+        """Delete all the states stored."""
+        self._data = None
+
+    def resize(self, capacity: int) -> None:
+        """Make room for the states of ``capacity`` node ids."""
+        self._capacity = capacity
+        if self._data is not None:
+            data = numpy.zeros((capacity,) + self._data.shape[1:], dtype=self._data.dtype)
+            n_rows = min(capacity, len(self._data))
+            data[:n_rows] = self._data[:n_rows]
+            self._data = data
+
+    def write(
+        self, node_ids: numpy.ndarray, parent_ids: numpy.ndarray, states: numpy.ndarray
+    ) -> None:
+        """
+        Store the states of new nodes.
+
+        Args:
+            node_ids: Ids of the new nodes.
+            parent_ids: Ids of the parents of the new nodes. The parents that \
+                        do not have a state stored are represented as -1.
+            states: Array containing the state of each new node.
+
+        Returns:
+            None.
+
+        """
+        states = numpy.asarray(states)
+        if self._data is None:
+            shape = (self._capacity,) + states.shape[1:]
+            self._data = numpy.zeros(shape, dtype=states.dtype)
+        self._data[node_ids] = states
+
+    def read(self, node_ids: numpy.ndarray) -> numpy.ndarray:
+        """Return an array containing the states of the target nodes."""
+        return self._data[node_ids]
+
+    def iter_branch(self, node_ids: numpy.ndarray) -> Generator[numpy.ndarray, None, None]:
+        """Iterate over the states of a sequence of nodes, each one the parent of the next."""
+        for node_id in node_ids:
+            yield self._data[node_id]
+
+    def remove(self, node_ids: numpy.ndarray) -> None:
+        """
+        Delete the states of the target nodes.
+
+        Their rows will be reused by the new nodes that get the same ids, and \
+        the memory is returned when the tree compacts and shrinks its arrays. \
+        The references to states of object dtype are released immediately.
+        """
+        if self._data is not None and self._data.dtype == object:
+            self._data[node_ids] = None
+
+    def move(self, source_ids: numpy.ndarray, target_ids: numpy.ndarray, mapping: numpy.ndarray):
+        """
+        Move the states of the nodes ``source_ids`` to ``target_ids``.
+
+        Args:
+            source_ids: Current ids of the moved nodes.
+            target_ids: New ids of the moved nodes.
+            mapping: Array that maps the old id of every node to its new id.
+
+        Returns:
+            None.
+
+        """
+        if self._data is not None:
+            self._data[target_ids] = self._data[source_ids]
+
+
+class DeltaStore:
+    """
+    Store the state of each node as the sparse XOR difference with the state \
+    of its parent, with a full copy of the state (keyframe) every \
+    ``keyframe_interval`` levels of the tree.
+
+    All the encoded states are packed in a single byte pool. A delta with \
+    ``k`` different bytes takes ``5 * k`` bytes: the positions of the bytes \
+    as uint32 followed by their XOR values. When a delta is not smaller than \
+    the state, a keyframe is stored instead.
+
+    The most recently used states are kept decoded in a LRU cache, so the \
+    parents of the new nodes can usually be read without decoding any delta. \
+    Only states with a fixed size and a numeric dtype are supported.
+    """
+
+    def __init__(self, keyframe_interval: int = 32, cache_size: int = 1024):
+        """
+        Initialize a :class:`DeltaStore`.
+
+        Args:
+            keyframe_interval: Maximum number of deltas between two keyframes \
+                               in the same branch. It bounds the number of \
+                               deltas decoded to read a state not cached.
+            cache_size: Number of decoded states kept in the cache.
+        """
+        if keyframe_interval < 1:
+            raise ValueError("keyframe_interval must be positive, got %s" % keyframe_interval)
+        self.keyframe_interval = keyframe_interval
+        self.cache_size = cache_size
+        self._capacity = 0
+        self.reset()
+
+    @property
+    def nbytes(self) -> int:
+        """Return the number of bytes used to store the encoded states."""
+        return self._pool_size - self._garbage
+
+    def reset(self) -> None:
+        """Delete all the states stored."""
+        self._row_shape = None
+        self._dtype = None
+        self._row_bytes = 0
+        self._pool = numpy.zeros(0, dtype=numpy.uint8)
+        self._pool_size = 0
+        self._garbage = 0
+        self._parent = numpy.full(self._capacity, -1, dtype=numpy.int64)
+        self._offset = numpy.zeros(self._capacity, dtype=numpy.int64)
+        self._size = numpy.zeros(self._capacity, dtype=numpy.int64)
+        self._depth = numpy.zeros(self._capacity, dtype=numpy.int64)
+        self._is_keyframe = numpy.zeros(self._capacity, dtype=numpy.bool_)
+        self._clear_cache()
+
+    def _clear_cache(self) -> None:
+        """Remove all the states from the cache."""
+        self._cache_table = HashTable(capacity=2 * self.cache_size)
+        self._cache_rows = None
+        self._cache_nodes = numpy.full(self.cache_size, -1, dtype=numpy.int64)
+        self._cache_used = numpy.zeros(self.cache_size, dtype=numpy.int64)
+        self._clock = 0
+
+    def resize(self, capacity: int) -> None:
+        """Make room for the states of ``capacity`` node ids."""
+        n_rows = min(capacity, self._capacity)
+        for name in ("_parent", "_offset", "_size", "_depth", "_is_keyframe"):
+            old = getattr(self, name)
+            new = numpy.full(capacity, -1, dtype=old.dtype) if name == "_parent" else None
+            new = numpy.zeros(capacity, dtype=old.dtype) if new is None else new
+            new[:n_rows] = old[:n_rows]
+            setattr(self, name, new)
+        self._capacity = capacity
+
+    def _to_rows(self, states: numpy.ndarray) -> numpy.ndarray:
+        """Return a 2D uint8 view of the target states."""
+        states = numpy.ascontiguousarray(states)
+        if self._dtype is None:
+            if states.dtype == object:
+                raise TypeError("DeltaStore does not support states of object dtype")
+            self._row_shape, self._dtype = states.shape[1:], states.dtype
+            self._row_bytes = states[:1].nbytes
+        return states.reshape(len(states), -1).view(numpy.uint8)
+
+    def _from_rows(self, rows: numpy.ndarray) -> numpy.ndarray:
+        """Return the states represented by a 2D uint8 array."""
+        return rows.view(self._dtype).reshape((len(rows),) + self._row_shape)
+
+    def _cache_get(self, node_ids: numpy.ndarray) -> numpy.ndarray:
+        """Return the cache slot of each node, or -1 if it is not cached."""
+        slots = self._cache_table.get(node_ids)
+        self._clock += 1
+        self._cache_used[slots[slots >= 0]] = self._clock
+        return slots
+
+    def _cache_put(self, node_ids: numpy.ndarray, rows: numpy.ndarray) -> None:
+        """Add decoded states to the cache, evicting the least recently used ones."""
+        if self.cache_size == 0 or len(node_ids) == 0:
+            return
+        node_ids, rows = node_ids[-self.cache_size :], rows[-self.cache_size :]
+        if self._cache_rows is None:
+            self._cache_rows = numpy.zeros((self.cache_size, self._row_bytes), dtype=numpy.uint8)
+        n_new = len(node_ids)
+        slots = numpy.argpartition(self._cache_used, n_new - 1)[:n_new]
+        evicted = self._cache_nodes[slots]
+        self._cache_table.remove(evicted[evicted >= 0])
+        self._clock += 1
+        self._cache_nodes[slots] = node_ids
+        self._cache_used[slots] = self._clock
+        self._cache_rows[slots] = rows
+        self._cache_table.insert(node_ids, slots)
+
+    def _reserve_pool(self, n_bytes: int) -> None:
+        """Grow the byte pool to fit ``n_bytes`` more bytes."""
+        if self._pool_size + n_bytes <= len(self._pool):
+            return
+        pool = numpy.zeros(max(2 * len(self._pool), self._pool_size + n_bytes), dtype=numpy.uint8)
+        pool[: self._pool_size] = self._pool[: self._pool_size]
+        self._pool = pool
+
+    def _apply(self, row: numpy.ndarray, node_id: int) -> numpy.ndarray:
+        """Apply the encoded state of the target node to the state of its parent in place."""
+        start, size = self._offset[node_id], self._size[node_id]
+        if self._is_keyframe[node_id]:
+            row[:] = self._pool[start : start + size]
+            return row
+        n_diff = size // 5
+        positions = self._pool[start : start + 4 * n_diff].view(numpy.uint32)
+        row[positions] ^= self._pool[start + 4 * n_diff : start + size]
+        return row
+
+    def _decode(self, node_id: int) -> numpy.ndarray:
+        """Decode the state of a node walking up its branch to a cached state or a keyframe."""
+        chain = []
+        node = node_id
+        while True:
+            if node < 0:
+                raise KeyError("Node {} does not have a state stored".format(node_id))
+            slot = self._cache_get(numpy.array([node]))[0]
+            if slot >= 0:
+                row = self._cache_rows[slot].copy()
+                break
+            chain.append(node)
+            if self._is_keyframe[node]:
+                row = numpy.zeros(self._row_bytes, dtype=numpy.uint8)
+                break
+            node = self._parent[node]
+        for node in reversed(chain):
+            row = self._apply(row, node)
+        return row
+
+    def _read_rows(self, node_ids: numpy.ndarray) -> numpy.ndarray:
+        """Return a 2D uint8 array containing the decoded states of the target nodes."""
+        node_ids, inverse = numpy.unique(
+            numpy.asarray(node_ids, dtype=numpy.int64), return_inverse=True
+        )
+        rows = numpy.empty((len(node_ids), self._row_bytes), dtype=numpy.uint8)
+        slots = self._cache_get(node_ids)
+        hits = slots >= 0
+        if hits.any():
+            rows[hits] = self._cache_rows[slots[hits]]
+        misses = numpy.flatnonzero(~hits)
+        for i in misses:
+            rows[i] = self._decode(node_ids[i])
+        self._cache_put(node_ids[misses], rows[misses])
+        return rows[inverse]
+
+    def write(
+        self, node_ids: numpy.ndarray, parent_ids: numpy.ndarray, states: numpy.ndarray
+    ) -> None:
+        """
+        Encode and store the states of new nodes.
+
+        Args:
+            node_ids: Ids of the new nodes.
+            parent_ids: Ids of the parents of the new nodes. The parents that \
+                        do not have a state stored are represented as -1. \
+                        They can be other nodes of the same batch.
+            states: Array containing the state of each new node.
+
+        Returns:
+            None.
+
+        """
+        new_rows = self._to_rows(states)
+        node_ids = numpy.asarray(node_ids, dtype=numpy.int64)
+        parent_ids = numpy.asarray(parent_ids, dtype=numpy.int64)
+        # The nodes whose parent is written in the same batch wait for their parent
+        pending = numpy.ones(len(node_ids), dtype=numpy.bool_)
+        while pending.any():
+            ready = pending & ~numpy.isin(parent_ids, node_ids[pending])
+            if not ready.any():
+                raise ValueError("The parents of nodes {} form a cycle".format(node_ids[pending]))
+            self._write_rows(node_ids[ready], parent_ids[ready], new_rows[ready])
+            pending &= ~ready
+
+    def _write_rows(
+        self, node_ids: numpy.ndarray, parent_ids: numpy.ndarray, new_rows: numpy.ndarray
+    ) -> None:
+        """Encode and store new states whose parents are already stored."""
+        has_parent = parent_ids >= 0
+        parent_rows = numpy.zeros_like(new_rows)
+        if has_parent.any():
+            parent_rows[has_parent] = self._read_rows(parent_ids[has_parent])
+        diff = numpy.bitwise_xor(new_rows, parent_rows, out=parent_rows)
+        n_diff = numpy.count_nonzero(diff, axis=1)
+        depth = numpy.where(has_parent, self._depth[parent_ids] + 1, 0)
+        is_keyframe = (
+            ~has_parent | (depth >= self.keyframe_interval) | (5 * n_diff >= self._row_bytes)
+        )
+        depth[is_keyframe] = 0
+        sizes = numpy.where(is_keyframe, self._row_bytes, 5 * n_diff)
+        offsets = self._pool_size + numpy.cumsum(sizes) - sizes
+        self._reserve_pool(int(sizes.sum()))
+        self._write_keyframes(new_rows, offsets, is_keyframe)
+        self._write_deltas(diff, offsets, n_diff, ~is_keyframe)
+        self._pool_size += int(sizes.sum())
+        self._parent[node_ids] = parent_ids
+        self._offset[node_ids] = offsets
+        self._size[node_ids] = sizes
+        self._depth[node_ids] = depth
+        self._is_keyframe[node_ids] = is_keyframe
+        self._cache_put(node_ids, new_rows)
+
+    def _write_keyframes(self, rows, offsets, is_keyframe) -> None:
+        """Copy the full states of the keyframes to the byte pool."""
+        if not is_keyframe.any():
+            return
+        index = offsets[is_keyframe][:, numpy.newaxis] + numpy.arange(self._row_bytes)
+        self._pool[index] = rows[is_keyframe]
+
+    def _write_deltas(self, diff, offsets, n_diff, is_delta) -> None:
+        """Write the positions and the XOR values of the different bytes to the byte pool."""
+        diff, offsets, n_diff = diff[is_delta], offsets[is_delta], n_diff[is_delta]
+        rows, positions = numpy.nonzero(diff)
+        if len(rows) == 0:
+            return
+        # Rank of each different byte inside the delta of its row
+        starts = numpy.cumsum(n_diff) - n_diff
+        rank = numpy.arange(len(rows)) - starts[rows]
+        base = offsets[rows]
+        position_bytes = positions.astype(numpy.uint32).view(numpy.uint8).reshape(-1, 4)
+        self._pool[(base + 4 * rank)[:, numpy.newaxis] + numpy.arange(4)] = position_bytes
+        self._pool[base + 4 * n_diff[rows] + rank] = diff[rows, positions]
+
+    def read(self, node_ids: numpy.ndarray) -> numpy.ndarray:
+        """Return an array containing the states of the target nodes."""
+        return self._from_rows(self._read_rows(node_ids))
+
+    def iter_branch(self, node_ids: numpy.ndarray) -> Generator[numpy.ndarray, None, None]:
+        """
+        Iterate over the states of a sequence of nodes where each one is the \
+        parent of the next.
+
+        Only the first state is decoded from its keyframe, and the following \
+        ones are obtained applying the deltas in order.
+        """
+        row = None
+        for node_id in node_ids:
+            row = self._read_rows([node_id])[0] if row is None else self._apply(row, node_id)
+            yield self._from_rows(row[numpy.newaxis].copy())[0]
+
+    def remove(self, node_ids: numpy.ndarray) -> None:
+        """Delete the states of the target nodes, which cannot have children."""
+        node_ids = numpy.asarray(node_ids, dtype=numpy.int64)
+        self._garbage += int(self._size[node_ids].sum())
+        self._size[node_ids] = 0
+        slots = self._cache_table.get(node_ids)
+        self._cache_table.remove(node_ids)
+        self._cache_nodes[slots[slots >= 0]] = -1
+        self._cache_used[slots[slots >= 0]] = 0
+        if self._garbage > max(self._pool_size // 2, 1 << 12):
+            self._compact_pool()
+
+    def _compact_pool(self) -> None:
+        """Remove the encoded states of the deleted nodes from the byte pool."""
+        live = numpy.flatnonzero(self._size > 0)
+        sizes = self._size[live]
+        new_offsets = numpy.cumsum(sizes) - sizes
+        index = numpy.repeat(self._offset[live] - new_offsets, sizes) + numpy.arange(sizes.sum())
+        self._pool = self._pool[index]
+        self._offset[live] = new_offsets
+        self._pool_size = len(self._pool)
+        self._garbage = 0
+
+    def move(self, source_ids: numpy.ndarray, target_ids: numpy.ndarray, mapping: numpy.ndarray):
+        """
+        Move the states of the nodes ``source_ids`` to ``target_ids``.
+
+        Args:
+            source_ids: Current ids of the moved nodes.
+            target_ids: New ids of the moved nodes.
+            mapping: Array that maps the old id of every node to its new id.
+
+        Returns:
+            None.
+
+        """
+        for name in ("_parent", "_offset", "_size", "_depth", "_is_keyframe"):
+            column = getattr(self, name)
+            column[target_ids] = column[source_ids]
+        self._size[source_ids] = 0
+        n_nodes = len(mapping)
+        parents = self._parent[:n_nodes]
+        self._parent[:n_nodes] = numpy.where(parents >= 0, mapping[parents], -1)
+        self._clear_cache()
+
+
+class SegmentStore:
+    """
+    Store the states of the nodes in fixed-size segment files that are \
+    memory-mapped, so the states of long runs do not need to fit in RAM.
+
+    The states are appended to the last segment, and only a small index with \
+    the segment and the slot of each node is kept in memory. The operating \
+    system pages the states in and out of RAM as needed, and the states of a \
+    branch are returned as views of the mapped files without copying them.
+
+    Slots are never reused: the segments whose states have all been removed \
+    are deleted, and the segments that are mostly dead are compacted moving \
+    their live states to the last segment when nodes are removed. This way the \
+    files never take more than ``1 / compact_ratio`` times the size of the live \
+    states plus one segment. Only states with a fixed size and a numeric dtype \
+    are supported.
+    """
+
+    def __init__(
+        self, directory: str = None, segment_bytes: int = 1 << 26, compact_ratio: float = 0.5
+    ):
+        """
+        Initialize a :class:`SegmentStore`.
+
+        Args:
+            directory: Directory where the segment files will be written. If \
+                       ``None`` a temporary directory will be created, and it \
+                       will be deleted with the :class:`SegmentStore`.
+            segment_bytes: Approximate size in bytes of each segment file.
+            compact_ratio: A segment is compacted when the fraction of its \
+                           slots that contain live states is lower than this value.
+        """
+        if directory is None:
+            self._tmp_dir = tempfile.TemporaryDirectory(prefix="fragile_tree_")
+            directory = self._tmp_dir.name
+        else:
+            self._tmp_dir = None
+            os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.compact_ratio = compact_ratio
+        self._capacity = 0
+        self._segments = {}
+        self.reset()
+
+    @property
+    def nbytes(self) -> int:
+        """Return the number of bytes of the segment files."""
+        return sum(segment.nbytes for segment in self._segments.values())
+
+    @property
+    def n_segments(self) -> int:
+        """Return the number of segment files."""
+        return len(self._segments)
+
+    def _segment_path(self, segment_id: int) -> str:
+        """Return the path of the file of the target segment."""
+        return os.path.join(self.directory, "segment_{:06d}.bin".format(segment_id))
+
+    def reset(self) -> None:
+        """Delete all the states stored and their segment files."""
+        for segment_id in list(self._segments.keys()):
+            self._delete_segment(segment_id)
+        self._row_shape = None
+        self._dtype = None
+        self._segment_size = 0
+        self._segments = {}
+        # Node id stored in each slot of each segment, or -1 if the slot is dead
+        self._owners = {}
+        self._live = {}
+        self._next_segment = 0
+        self._active = -1
+        self._n_used = 0
+        self._segment = numpy.full(self._capacity, -1, dtype=numpy.int64)
+        self._slot = numpy.zeros(self._capacity, dtype=numpy.int64)
+
+    def close(self) -> None:
+        """Delete the segment files and the temporary directory if there is one."""
+        self.reset()
+        if self._tmp_dir is not None:
+            self._tmp_dir.cleanup()
+            self._tmp_dir = None
+
+    def flush(self) -> None:
+        """Write to disk the changes of all the segments."""
+        for segment in self._segments.values():
+            segment.flush()
+
+    def resize(self, capacity: int) -> None:
+        """Make room for the index of ``capacity`` node ids."""
+        n_rows = min(capacity, self._capacity)
+        segment = numpy.full(capacity, -1, dtype=numpy.int64)
+        slot = numpy.zeros(capacity, dtype=numpy.int64)
+        segment[:n_rows], slot[:n_rows] = self._segment[:n_rows], self._slot[:n_rows]
+        self._segment, self._slot = segment, slot
+        self._capacity = capacity
+
+    def _new_segment(self) -> None:
+        """Create a new segment file and make it the segment where new states are appended."""
+        segment_id = self._next_segment
+        self._next_segment += 1
+        shape = (self._segment_size,) + self._row_shape
+        self._segments[segment_id] = numpy.memmap(
+            self._segment_path(segment_id), dtype=self._dtype, mode="w+", shape=shape
+        )
+        self._owners[segment_id] = numpy.full(self._segment_size, -1, dtype=numpy.int64)
+        self._live[segment_id] = 0
+        self._active = segment_id
+        self._n_used = 0
+
+    def _delete_segment(self, segment_id: int) -> None:
+        """Close the target segment and delete its file."""
+        segment = self._segments.pop(segment_id)
+        del self._owners[segment_id], self._live[segment_id]
+        # Views of the segment returned before keep the mapping open until they are deleted
+        del segment
+        os.remove(self._segment_path(segment_id))
+        if segment_id == self._active:
+            self._active = -1
+
+    def write(
+        self, node_ids: numpy.ndarray, parent_ids: numpy.ndarray, states: numpy.ndarray
+    ) -> None:
+        """
+        Append the states of new nodes to the segment files.
+
+        Args:
+            node_ids: Ids of the new nodes.
+            parent_ids: Ignored. Only to implement interface.
+            states: Array containing the state of each new node.
+
+        Returns:
+            None.
+
+        """
+        states = numpy.asarray(states)
+        if self._dtype is None:
+            if states.dtype == object:
+                raise TypeError("SegmentStore does not support states of object dtype")
+            self._row_shape, self._dtype = states.shape[1:], states.dtype
+            self._segment_size = max(1, self.segment_bytes // max(1, states[:1].nbytes))
+        node_ids = numpy.asarray(node_ids, dtype=numpy.int64)
+        start = 0
+        while start < len(node_ids):
+            if self._active < 0 or self._n_used == self._segment_size:
+                self._new_segment()
+            end = min(len(node_ids), start + self._segment_size - self._n_used)
+            slots = numpy.arange(self._n_used, self._n_used + end - start)
+            self._segments[self._active][slots] = states[start:end]
+            self._owners[self._active][slots] = node_ids[start:end]
+            self._live[self._active] += end - start
+            self._segment[node_ids[start:end]] = self._active
+            self._slot[node_ids[start:end]] = slots
+            self._n_used += end - start
+            start = end
+
+    def read(self, node_ids: numpy.ndarray) -> numpy.ndarray:
+        """Return an array containing the states of the target nodes."""
+        node_ids = numpy.asarray(node_ids, dtype=numpy.int64)
+        segments = self._segment[node_ids]
+        if (segments < 0).any():
+            raise KeyError("Nodes {} do not have a state stored".format(node_ids[segments < 0]))
+        states = numpy.empty((len(node_ids),) + self._row_shape, dtype=self._dtype)
+        for segment_id in numpy.unique(segments):
+            rows = segments == segment_id
+            states[rows] = self._segments[segment_id][self._slot[node_ids[rows]]]
+        return states
+
+    def iter_branch(self, node_ids: numpy.ndarray) -> Generator[numpy.ndarray, None, None]:
+        """Iterate over views of the states of a sequence of nodes in the segment files."""
+        for node_id in node_ids:
+            yield self._segments[self._segment[node_id]][self._slot[node_id]]
+
+    def remove(self, node_ids: numpy.ndarray) -> None:
+        """
+        Delete the states of the target nodes, deleting the segments that \
+        become empty and compacting the segments that are mostly dead.
+        """
+        node_ids = numpy.asarray(node_ids, dtype=numpy.int64)
+        segments = self._segment[node_ids]
+        node_ids, segments = node_ids[segments >= 0], segments[segments >= 0]
+        for segment_id, n_removed in zip(*numpy.unique(segments, return_counts=True)):
+            self._owners[segment_id][self._slot[node_ids[segments == segment_id]]] = -1
+            self._live[segment_id] -= n_removed
+        self._segment[node_ids] = -1
+        self._collect_segments()
+
+    def _collect_segments(self) -> None:
+        """Delete the empty segments, and compact the segments with few live states."""
+        min_live = self.compact_ratio * self._segment_size
+        # Compacting a segment can fill the active segment, so the counts are read every time
+        for segment_id in list(self._live.keys()):
+            n_live = self._live[segment_id]
+            if segment_id == self._active:
+                continue
+            elif n_live == 0:
+                self._delete_segment(segment_id)
+            elif n_live < min_live:
+                self._compact_segment(segment_id)
+
+    def _compact_segment(self, segment_id: int) -> None:
+        """Move the live states of the target segment to the last one and delete it."""
+        owners = self._owners[segment_id]
+        slots = numpy.flatnonzero(owners >= 0)
+        self.write(owners[slots], None, numpy.array(self._segments[segment_id][slots]))
+        self._delete_segment(segment_id)
+
+    def move(self, source_ids: numpy.ndarray, target_ids: numpy.ndarray, mapping: numpy.ndarray):
+        """
+        Move the states of the nodes ``source_ids`` to ``target_ids``.
+
+        Only the index is updated, and the states stay in the same slots.
+
+        Args:
+            source_ids: Current ids of the moved nodes.
+            target_ids: New ids of the moved nodes.
+            mapping: Array that maps the old id of every node to its new id.
+
+        Returns:
+            None.
+
+        """
+        segments = self._segment[source_ids]
+        slots = self._slot[source_ids]
+        for segment_id in numpy.unique(segments[segments >= 0]):
+            rows = segments == segment_id
+            self._owners[segment_id][slots[rows]] = target_ids[rows]
+        self._segment[target_ids], self._slot[target_ids] = segments, slots
+        self._segment[source_ids] = -1
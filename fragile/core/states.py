@@ -3,6 +3,7 @@ from typing import Dict, Generator, List, Optional, Set, Tuple, Union
 
 import numpy as np
 
+from fragile.core.kernels import clone_indexes, clone_rows, hash_rows
 from fragile.core.utils import float_type, hash_numpy, Scalar, StateDict
 
 
@@ -27,26 +28,49 @@ class States:
     be accessed using the name_1 attribute of the class. If "size" is not defined \
     the attribute will be considered a vector of length `batch_size`.
 
+    If `use_arena` is ``True`` all the tensors defined in `state_dict` will be \
+    allocated as the fields of a single numpy structured array (the arena), and \
+    each attribute will be a view of its corresponding field. This allows to \
+    clone, copy and serialize all the fixed-shape data in one pass.
 
     Args:
         batch_size: The number of items in the first dimension of the tensors.
         state_dict: Dictionary defining the attributes of the tensors.
+        use_arena: Allocate the tensors defined in `state_dict` in a single \
+                   contiguous buffer.
         **kwargs: Data can be directly specified as keyword arguments.
     """
 
-    def __init__(self, batch_size: int, state_dict: Optional[StateDict] = None, **kwargs):
+    def __init__(
+        self,
+        batch_size: int,
+        state_dict: Optional[StateDict] = None,
+        use_arena: bool = False,
+        **kwargs
+    ):
         """
         Initialise a :class:`States`.
 
         Args:
              batch_size: The number of items in the first dimension of the tensors.
              state_dict: Dictionary defining the attributes of the tensors.
+             use_arena: Allocate the tensors defined in `state_dict` in a single \
+                        contiguous buffer.
              **kwargs: The name-tensor pairs can also be specified as kwargs.
 
         """
-        attr_dict = self.params_to_arrays(state_dict, batch_size) if state_dict is not None else {}
+        self._arena = None
+        self._arena_views = {}
+        if state_dict is not None and use_arena:
+            self._set_arena(self.params_to_arena(state_dict, batch_size))
+            attr_dict = {}
+        else:
+            attr_dict = (
+                self.params_to_arrays(state_dict, batch_size) if state_dict is not None else {}
+            )
         attr_dict.update(kwargs)
-        self._names = list(attr_dict.keys())
+        arena_names = list(self._arena_views.keys())
+        self._names = arena_names + [name for name in attr_dict.keys() if name not in arena_names]
         self._attr_dict = attr_dict
         self.update(**self._attr_dict)
         self._n_walkers = batch_size
@@ -98,6 +122,23 @@ class States:
             string += new_str
         return string
 
+    def __getstate__(self) -> dict:
+        """Serialize the arena only once instead of serializing each one of its views."""
+        state = self.__dict__.copy()
+        arena_fields = self._arena_fields()
+        for name in arena_fields:
+            del state[name]
+        state["_arena_views"] = {}
+        state["_arena_fields"] = arena_fields
+        return state
+
+    def __setstate__(self, state: dict):
+        """Restore the instance and bind the arena views to their attributes again."""
+        arena_fields = state.pop("_arena_fields", [])
+        self.__dict__.update(state)
+        if self._arena is not None:
+            self._set_arena(self._arena, names=arena_fields)
+
     def __hash__(self) -> int:
         _hash = hash(
             tuple([hash_numpy(x) if isinstance(x, np.ndarray) else hash(x) for x in self.vals()])
@@ -112,6 +153,8 @@ class States:
     def hash_values(self, name: str) -> List[int]:
         """Return a unique id for each walker attribute."""
         values = getattr(self, name)
+        if isinstance(values, np.ndarray) and values.dtype != object:
+            return hash_rows(values).tolist()
         hashes = [hash_numpy(val) if isinstance(val, np.ndarray) else hash(val) for val in values]
         return hashes
 
@@ -130,6 +173,14 @@ class States:
         s = cls(batch_size=n_walkers, **state_dict)
         return s
 
+    @property
+    def arena(self) -> Optional[np.ndarray]:
+        """
+        Return the structured array that holds the data of the arena-backed \
+        attributes, or ``None`` if the instance does not use an arena.
+        """
+        return self._arena
+
     @property
     def n(self) -> int:
         """Return the batch_size of the vectors, which is equivalent to the number of walkers."""
@@ -226,8 +277,52 @@ class States:
         if kwargs:
             update_or_set_attributes(kwargs)
 
+    def assign(self, other: "States" = None, take_ownership: bool = False, **kwargs):
+        """
+        Modify the data stored in the States instance without making intermediate copies.
+
+        It behaves like :meth:`update`, but the new values are written directly \
+        into the arrays that are already allocated instead of being deep copied \
+        first. If an attribute does not exist yet, or the new value cannot be \
+        written in place, it will be copied. When ``take_ownership`` is ``True`` \
+        the provided arrays are bound to the instance by reference, and no data \
+        is copied at all.
+
+        Args:
+            other: State class that will be assigned upon update.
+            take_ownership: If ``True`` the caller hands over the provided values, \
+                            and they will be stored without copying them. The \
+                            caller must not modify them afterwards.
+            **kwargs: It is possible to specify the update as key value attributes, \
+                     where key is the name of the attribute to be updated, and value \
+                      is the new value for the attribute.
+        """
+
+        def assign_or_set_attributes(attrs: Union[dict, States]):
+            for name, val in attrs.items():
+                target = getattr(self, name, None)
+                if target is val:
+                    continue
+                # Arena views are never rebound, so the arena remains the owner of the data
+                elif take_ownership and not self._is_arena_field(name):
+                    setattr(self, name, val)
+                    continue
+                try:
+                    target[:] = val
+                except (AttributeError, TypeError, KeyError, ValueError):
+                    setattr(self, name, copy.deepcopy(val))
+
+        if other is not None:
+            assign_or_set_attributes(other)
+        if kwargs:
+            assign_or_set_attributes(kwargs)
+
     def clone(
-        self, will_clone: np.ndarray, compas_ix: np.ndarray, ignore: Optional[Set[str]] = None
+        self,
+        will_clone: np.ndarray,
+        compas_ix: np.ndarray,
+        ignore: Optional[Set[str]] = None,
+        backend: str = "numpy",
     ):
         """
         Clone all the stored data according to the provided arrays.
@@ -239,25 +334,94 @@ class States:
                        indexes of the walkers that will be copied.
             ignore: set containing the names of the attributes that will not be \
                     cloned.
+            backend: Backend used to copy the data. It can be either "numpy" \
+                     or "numba".
 
         """
+        clone_ix, source_ix = clone_indexes(will_clone, compas_ix)
+        self.clone_rows(clone_ix=clone_ix, source_ix=source_ix, ignore=ignore, backend=backend)
+
+    def clone_rows(
+        self,
+        clone_ix: np.ndarray,
+        source_ix: np.ndarray,
+        ignore: Optional[Set[str]] = None,
+        backend: str = "numpy",
+    ):
+        """
+        Copy the data of the walkers ``source_ix`` over the walkers ``clone_ix``.
+
+        Only the rows of the walkers that clone are gathered, so the indexes can \
+        be computed once and shared by all the :class:`States` that need to be cloned.
+
+        Args:
+            clone_ix: Indexes of the walkers that will be overwritten.
+            source_ix: Indexes of the walkers that will be copied.
+            ignore: set containing the names of the attributes that will not be \
+                    cloned.
+            backend: Backend used to copy the data. It can be either "numpy" \
+                     or "numba".
+
+        """
+        if len(clone_ix) == 0:
+            return
         ignore = set() if ignore is None else ignore
-        for name in self.keys():
+        names = self.keys()
+        # Clone all the arena fields at once unless some of them need to be ignored
+        if self._arena is not None and not ignore.intersection(self._arena.dtype.names):
+            clone_rows(self._arena, clone_ix, source_ix)
+            arena_fields = self._arena_fields()
+            names = [name for name in names if name not in arena_fields]
+        for name in names:
             if isinstance(self[name], np.ndarray) and name not in ignore:
-                self[name][will_clone] = self[name][compas_ix][will_clone]
+                clone_rows(self[name], clone_ix, source_ix, backend=backend)
 
     def get_params_dict(self) -> StateDict:
         """Return a dictionary describing the data stored in the :class:`States`."""
         return {
             k: {"shape": v.shape, "dtype": v.dtype}
             for k, v in self.__dict__.items()
-            if isinstance(v, np.ndarray)
+            if isinstance(v, np.ndarray) and not k.startswith("_")
         }
 
     def copy(self) -> "States":
         """Crete a copy of the current instance."""
-        param_dict = {str(name): val.copy() for name, val in self.items()}
-        return States(batch_size=self.n, **param_dict)
+        if self._arena is None:
+            param_dict = {str(name): val.copy() for name, val in self.items()}
+            return States(batch_size=self.n, **param_dict)
+        arena_fields = self._arena_fields()
+        param_dict = {
+            str(name): copy.deepcopy(val) for name, val in self.items() if name not in arena_fields
+        }
+        new_states = States(batch_size=self.n, **param_dict)
+        new_states._set_arena(self._arena.copy(), names=arena_fields)
+        new_states._names = list(self._names)
+        return new_states
+
+    def _set_arena(self, arena: np.ndarray, names: Optional[List[str]] = None):
+        """
+        Use the provided structured array as the arena of the instance.
+
+        Args:
+            arena: Structured array of length `batch_size`.
+            names: Names of the fields that will be bound as attributes. If \
+                   ``None`` all the fields of the arena will be bound.
+
+        """
+        names = arena.dtype.names if names is None else names
+        self._arena = arena
+        self._arena_views = {name: arena[name] for name in names}
+        for name, view in self._arena_views.items():
+            setattr(self, name, view)
+
+    def _is_arena_field(self, name: str) -> bool:
+        """Return ``True`` if the target attribute is a view of the arena."""
+        view = self._arena_views.get(name)
+        return view is not None and getattr(self, name, None) is view
+
+    def _arena_fields(self) -> List[str]:
+        """Return the names of the attributes that are still backed by the arena."""
+        return [name for name in self._arena_views.keys() if self._is_arena_field(name)]
 
     @staticmethod
     def params_to_arrays(param_dict: StateDict, n_walkers: int) -> Dict[str, np.ndarray]:
@@ -275,13 +439,35 @@ class States:
         """
         tensor_dict = {}
         for key, val in param_dict.items():
-            val_size = val.get("size")
+            val = dict(val)  # Do not modify the param_dict provided by the caller
+            val_size = val.pop("size", None)
             sizes = n_walkers if val_size is None else tuple([n_walkers]) + val_size
-            if "size" in val:
-                del val["size"]
             tensor_dict[key] = np.zeros(sizes, **val)
         return tensor_dict
 
+    @staticmethod
+    def params_to_arena(param_dict: StateDict, n_walkers: int) -> np.ndarray:
+        """
+        Create a structured array containing a field for each tensor specified \
+        in param_dict.
+
+        Args:
+            param_dict: Dictionary defining the attributes of the tensors.
+            n_walkers: Number items in the first dimension of the data tensors.
+
+        Returns:
+            Structured array of length `n_walkers` with one aligned field for each \
+            key of `param_dict`. Each field has the dtype and the size defined in \
+            the corresponding `param_dict` value.
+
+        """
+        fields = []
+        for key, val in param_dict.items():
+            val_size = val.get("size")
+            shape = () if val_size is None else tuple(val_size)
+            fields.append((key, np.dtype(val.get("dtype", float)), shape))
+        return np.zeros(n_walkers, dtype=np.dtype(fields, align=True))
+
 
 class StatesEnv(States):
     """Keeps track of the data structures used by the :class:`Env`."""
@@ -409,13 +595,35 @@ class StatesWalkers(States):
         params.update(state_dict)
         return params
 
-    def clone(self, **kwargs) -> Tuple[np.ndarray, np.ndarray]:
+    def clone(self, backend: str = "numpy", **kwargs) -> Tuple[np.ndarray, np.ndarray]:
         """Perform the clone only on cum_rewards and id_walkers and reset the other arrays."""
         clone, compas = self.will_clone, self.compas_clone
-        self.cum_rewards[clone] = copy.deepcopy(self.cum_rewards[compas][clone])
-        self.id_walkers[clone] = copy.deepcopy(self.id_walkers[compas][clone])
+        clone_ix, source_ix = clone_indexes(clone, compas)
+        self.clone_rows(clone_ix=clone_ix, source_ix=source_ix, backend=backend)
         return clone, compas
 
+    def clone_rows(
+        self,
+        clone_ix: np.ndarray,
+        source_ix: np.ndarray,
+        ignore: Optional[Set[str]] = None,
+        backend: str = "numpy",
+    ):
+        """
+        Copy the cum_rewards and the id_walkers of the walkers ``source_ix`` \
+        over the walkers ``clone_ix``.
+
+        Args:
+            clone_ix: Indexes of the walkers that will be overwritten.
+            source_ix: Indexes of the walkers that will be copied.
+            ignore: Not used. The other arrays are recomputed at every iteration.
+            backend: Backend used to copy the data. It can be either "numpy" \
+                     or "numba".
+
+        """
+        clone_rows(self.cum_rewards, clone_ix, source_ix, backend=backend)
+        clone_rows(self.id_walkers, clone_ix, source_ix, backend=backend)
+
     def reset(self):
         """Clear the internal data of the class."""
         other_attrs = [name for name in self.keys() if name not in self.get_params_dict()]
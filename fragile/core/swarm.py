@@ -1,5 +1,6 @@
-import copy
-from typing import Callable, List
+from concurrent.futures import ThreadPoolExecutor
+import inspect
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 
 import numpy
 
@@ -10,6 +11,7 @@ from fragile.core.base_classes import (
     BaseStateTree,
     BaseSwarm,
 )
+from fragile.core.callbacks import PhaseTimer, SwarmCallback
 from fragile.core.states import StatesEnv, StatesModel
 from fragile.core.utils import clear_output, Scalar
 from fragile.core.walkers import StatesWalkers, Walkers
@@ -27,6 +29,9 @@ class Swarm(BaseSwarm):
         """Initialize a :class:`Swarm`."""
         self._use_tree = False
         self._prune_tree = False
+        self.callbacks = []
+        self._phase_timer = None
+        self._track_ids = True
         super(Swarm, self).__init__(walkers=walkers, *args, **kwargs)
 
     def __repr__(self):
@@ -68,6 +73,65 @@ class Swarm(BaseSwarm):
         """Return the :class:`Critic` of the walkers."""
         return self._walkers.critic
 
+    @property
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Return the values measured by the callbacks of the :class:`Swarm` that \
+        have a ``metrics`` attribute, such as :class:`SwarmMetrics`.
+        """
+        metrics = {}
+        for callback in self.callbacks:
+            metrics.update(getattr(callback, "metrics", {}))
+        return metrics
+
+    @property
+    def track_ids(self) -> bool:
+        """
+        Return ``True`` if the ids of the walkers are computed at every iteration.
+
+        The ids are only needed by the :class:`Tree`, the :class:`Critic` of \
+        the :class:`Walkers` and the callbacks that use them. When nothing \
+        consumes them the states of the walkers are not hashed.
+        """
+        return self._track_ids
+
+    @track_ids.setter
+    def track_ids(self, value: bool):
+        if value and not self._track_ids:
+            # The cached ids are stale after running without tracking them
+            self.walkers.update_ids()
+        self._track_ids = value
+        self.walkers.track_ids = value
+
+    def add_callback(self, callback: SwarmCallback) -> None:
+        """
+        Add a :class:`SwarmCallback` that will be notified of the different \
+        phases of the evolution loop.
+
+        The methods of the :class:`Swarm` are only instrumented after adding \
+        the first callback, so a :class:`Swarm` without callbacks runs at full speed.
+        """
+        self.callbacks.append(callback)
+        if getattr(callback, "uses_ids", False):
+            self.track_ids = True
+        if self._phase_timer is None:
+            self._phase_timer = PhaseTimer(self)
+            self._phase_timer.instrument()
+
+    def remove_callback(self, callback: SwarmCallback) -> None:
+        """
+        Remove a :class:`SwarmCallback` added with :meth:`add_callback`.
+
+        When the last callback is removed the original methods of the \
+        :class:`Swarm` and its components are restored, so it runs at full \
+        speed again. The ids of the walkers are still computed if they were \
+        enabled by a callback.
+        """
+        self.callbacks.remove(callback)
+        if not self.callbacks and self._phase_timer is not None:
+            self._phase_timer.restore()
+            self._phase_timer = None
+
     def init_swarm(
         self,
         env_callable: Callable,
@@ -78,6 +142,8 @@ class Swarm(BaseSwarm):
         dist_scale: float = 1.0,
         tree: Callable = None,
         prune_tree: bool = True,
+        callbacks: Iterable[SwarmCallback] = None,
+        track_ids: bool = None,
         *args,
         **kwargs
     ):
@@ -102,6 +168,12 @@ class Swarm(BaseSwarm):
                        store in the :class:`Tree` only the past history of alive \
                         walkers, and discard the branches with leaves that have \
                         no walkers.
+            callbacks: :class:`SwarmCallback` instances that will be notified \
+                       of the different phases of the evolution loop.
+            track_ids: If ``True`` compute the ids of the walkers at every \
+                       iteration. If ``None`` they will only be computed when \
+                       there is a ``tree``, the :class:`Walkers` have a \
+                       :class:`Critic`, or a callback uses them.
             args: Passed to ``walkers_callable``.
             kwargs: Passed to ``walkers_callable``.
 
@@ -126,7 +198,19 @@ class Swarm(BaseSwarm):
         self._use_tree = tree is not None
         self.tree: BaseStateTree = tree() if self._use_tree else None
         self._prune_tree = prune_tree
+        self._step_into_buffer = "out" in inspect.signature(self._env.step).parameters and hasattr(
+            self._walkers, "env_states_buffer"
+        )
+        self._reset_into_buffer = "out" in inspect.signature(
+            self._env.reset
+        ).parameters and hasattr(self._walkers, "env_states_buffer")
         self.epoch = 0
+        if track_ids is None:
+            track_ids = self._use_tree or getattr(self._walkers, "critic", None) is not None
+        self._track_ids = bool(track_ids)
+        self._walkers.track_ids = self._track_ids
+        for callback in callbacks if callbacks is not None else []:
+            self.add_callback(callback)
 
     def reset(
         self,
@@ -146,7 +230,16 @@ class Swarm(BaseSwarm):
             walkers_states: :class:`StatesWalkers` that define the internal \
                             states of the :class:`Walkers`.
         """
-        env_sates = self.env.reset(batch_size=self.walkers.n) if env_states is None else env_states
+        if env_states is not None:
+            env_sates = env_states
+        elif self._reset_into_buffer:
+            # Restarting the search samples the new states into the back buffer of the
+            # walkers, so no arrays are allocated when the swarm is reset many times.
+            env_sates = self.env.reset(
+                batch_size=self.walkers.n, out=self.walkers.env_states_buffer
+            )
+        else:
+            env_sates = self.env.reset(batch_size=self.walkers.n)
 
         model_states = (
             self.model.reset(batch_size=self.walkers.n, env_states=env_states)
@@ -156,7 +249,8 @@ class Swarm(BaseSwarm):
 
         model_states.update(init_actions=model_states.actions)
         self.walkers.reset(env_states=env_sates, model_states=model_states)
-        self.walkers.update_ids()
+        if self._track_ids:
+            self.walkers.update_ids()
         if self._use_tree:
             self.tree.reset(
                 env_states=self.walkers.env_states,
@@ -165,7 +259,6 @@ class Swarm(BaseSwarm):
             )
             self.update_tree([0] * self.walkers.n)
 
-    # @profile
     def run_swarm(
         self,
         model_states: StatesModel = None,
@@ -223,12 +316,16 @@ class Swarm(BaseSwarm):
         It also updates the :class:`Tree` data structure that takes care of \
         storing the visited states.
         """
-        # old_ids = set(self.walkers.states.id_walkers.copy())
         self.walkers.balance()
-        new_ids = set(self.walkers.states.id_walkers)
-        self.prune_tree(leaf_nodes=set(new_ids))
+        if self._prune_tree and self._use_tree:
+            leaf_nodes = set(self.walkers.states.id_walkers.tolist())
+            # fix_best writes the id of the best state back into the last walker,
+            # so its node has to be kept even if no walker is at that state now.
+            best_id = getattr(self.walkers.states, "best_id", None)
+            if best_id is not None:
+                leaf_nodes.add(int(best_id))
+            self.prune_tree(leaf_nodes=leaf_nodes)
 
-    # @profile
     def run_step(self) -> None:
         """
         Compute one iteration of the :class:`Swarm` evolution process and \
@@ -238,31 +335,68 @@ class Swarm(BaseSwarm):
         self.balance_and_prune()
         self.walkers.fix_best()
 
-    # @profile
     def step_walkers(self) -> None:
         """
         Make the walkers evolve to their next state sampling an action from the \
         :class:`Model` and applying it to the :class:`Environment`.
         """
-        self.walkers.n_iters += 1
-        model_states = self.walkers.model_states
-        env_states = self.walkers.env_states
+        model_states, states_ids = self.predict_actions()
+        env_states = self.step_env(model_states)
+        self.update_walkers(model_states, env_states, states_ids)
 
+    def predict_actions(self) -> Tuple[StatesModel, Optional[List[int]]]:
+        """
+        Sample the actions that the walkers will take in the next step.
+
+        Returns:
+            Tuple containing the :class:`StatesModel` with the new actions, and \
+            the ids of the current states of the walkers if there is a tree.
+        """
+        self.walkers.n_iters += 1
         states_ids = (
-            copy.deepcopy(self.walkers.states.id_walkers).astype(int).flatten().tolist()
-            if self._use_tree
-            else None
+            self.walkers.states.id_walkers.astype(int).tolist() if self._use_tree else None
         )
-
         model_states = self.model.predict(
-            env_states=env_states, model_states=model_states, walkers_states=self.walkers.states
+            env_states=self.walkers.env_states,
+            model_states=self.walkers.model_states,
+            walkers_states=self.walkers.states,
         )
-        env_states = self.env.step(model_states=model_states, env_states=env_states)
+        return model_states, states_ids
+
+    def step_env(self, model_states: StatesModel) -> StatesEnv:
+        """
+        Apply the actions sampled by :meth:`predict_actions` to the current \
+        states of the walkers.
+
+        It does not modify the walkers, so it can run while other walkers are \
+        being balanced.
+        """
+        if self._step_into_buffer:
+            # Write the new states into the back buffer of the walkers, which will
+            # be swapped with the current env_states without allocating new arrays.
+            return self.env.step(
+                model_states=model_states,
+                env_states=self.walkers.env_states,
+                out=self.walkers.env_states_buffer,
+            )
+        return self.env.step(model_states=model_states, env_states=self.walkers.env_states)
+
+    def update_walkers(
+        self, model_states: StatesModel, env_states: StatesEnv, states_ids: List[int] = None
+    ) -> None:
+        """Store the states returned by :meth:`step_env` in the walkers and the tree."""
+        # The states returned by the environment are not used anywhere else, so the
+        # walkers can store them without copying their data.
         self.walkers.update_states(
-            env_states=env_states, model_states=model_states, end_condition=env_states.ends
+            env_states=env_states,
+            model_states=model_states,
+            end_condition=env_states.ends,
+            take_ownership=True,
         )
-        self.walkers.update_ids()
-        self.update_tree(states_ids)
+        if self._track_ids:
+            self.walkers.update_ids()
+        if self._use_tree:
+            self.update_tree(states_ids)
 
     def update_tree(self, states_ids: List[int]) -> None:
         """
@@ -280,6 +414,19 @@ class Swarm(BaseSwarm):
                 n_iter=int(self.walkers.n_iters),
             )
 
+    def get_best_branch(self, chunk_size: int = 1024) -> Dict[str, numpy.ndarray]:
+        """
+        Return the branch of the tree that ends at the best state found as \
+        a dictionary of contiguous arrays.
+
+        It needs a tree that implements ``get_branch_arrays``, such as a \
+        :class:`HistoryTree`. See :meth:`HistoryTree.get_branch_arrays`.
+        """
+        if not self._use_tree:
+            raise ValueError("The Swarm needs a tree to keep track of the best branch")
+        best_id = int(self.walkers.states.best_id)
+        return self.tree.get_branch_arrays(best_id, from_hash=True, chunk_size=chunk_size)
+
     def prune_tree(self, leaf_nodes) -> None:
         """
         Remove all the branches that are do not have alive walkers at their leaf nodes.
@@ -302,3 +449,148 @@ class NoBalance(Swarm):
     def calculate_end_condition(self):
         """Finish after reaching the maximum number of epochs."""
         return self.epoch > self.walkers.max_iters
+
+
+class PipelinedSwarm:
+    """
+    Run several cohorts of walkers overlapping the :class:`Environment` step \
+    of each cohort with the balancing of the other ones.
+
+    Each cohort is an independent :class:`Swarm`. While the environment of a \
+    cohort is stepped in a thread pool, the main thread computes the distances, \
+    virtual rewards and cloning of the other cohorts. This pays off when the \
+    environment releases the GIL, for example because it runs in worker \
+    processes like a :class:`ParallelDiscreteEnv`.
+
+    The cohorts are always processed in the same order and the actions are \
+    sampled in the main thread, so a run is reproducible under a fixed seed \
+    as long as the environments do not use the random state.
+    """
+
+    def __init__(self, swarm: Callable[[], Swarm], n_cohorts: int = 2, share_best: bool = True):
+        """
+        Initialize a :class:`PipelinedSwarm`.
+
+        Args:
+            swarm: Callable that returns the :class:`Swarm` of a cohort. It is \
+                   called once for each cohort. If the cohorts share the same \
+                   :class:`Environment` instance its ``step`` needs to be thread safe.
+            n_cohorts: Number of cohorts.
+            share_best: If ``True`` the best state found by any cohort is \
+                        assigned to the last walker of the other cohorts. It \
+                        is ignored for the cohorts that use a tree.
+        """
+        self.cohorts: List[Swarm] = [swarm() for _ in range(n_cohorts)]
+        self.share_best = share_best
+        self.minimize = self.cohorts[0].walkers.minimize
+        self.epoch = 0
+        self._executor = ThreadPoolExecutor(max_workers=n_cohorts)
+        # Environment steps in flight: (model_states, states_ids, future) of each cohort
+        self._pending = {}
+
+    def __repr__(self):
+        return "{} with {} cohorts. Best reward found: {}".format(
+            self.__class__.__name__, len(self.cohorts), self.best_reward_found
+        )
+
+    @property
+    def best_cohort(self) -> Swarm:
+        """Return the cohort that has found the best state."""
+        rewards = [cohort.best_reward_found for cohort in self.cohorts]
+        return self.cohorts[int(numpy.argmin(rewards) if self.minimize else numpy.argmax(rewards))]
+
+    @property
+    def best_found(self) -> numpy.ndarray:
+        """Return the best observation found by any of the cohorts."""
+        return self.best_cohort.best_found
+
+    @property
+    def best_reward_found(self) -> Scalar:
+        """Return the best reward found by any of the cohorts."""
+        return self.best_cohort.best_reward_found
+
+    def reset(self) -> None:
+        """Reset all the cohorts and start the first environment step of each one."""
+        self._wait_pending()
+        for cohort in self.cohorts:
+            cohort.reset()
+        for ix in range(len(self.cohorts)):
+            self._submit_step(ix)
+
+    def run_swarm(self, print_every: int = 1e100) -> None:
+        """
+        Run a new search process until all the cohorts meet their end condition.
+
+        Args:
+            print_every: Display the algorithm progress every ``print_every`` epochs.
+
+        Returns:
+            None.
+
+        """
+        self.reset()
+        self.epoch = 0
+        while not self.calculate_end_condition():
+            try:
+                self.run_step()
+                if self.epoch % print_every == 0:
+                    print(self)
+                    clear_output(True)
+                self.epoch += 1
+            except KeyboardInterrupt:
+                self._wait_pending()
+                break
+
+    def calculate_end_condition(self) -> bool:
+        """Return ``True`` when no cohort has an environment step in flight."""
+        return not self._pending
+
+    def run_step(self) -> None:
+        """
+        Finish the environment step of each cohort, balance it, and start its \
+        next environment step while the following cohort is processed.
+        """
+        for ix, cohort in enumerate(self.cohorts):
+            if ix not in self._pending:
+                continue
+            model_states, states_ids, future = self._pending.pop(ix)
+            cohort.update_walkers(model_states, future.result(), states_ids)
+            cohort.balance_and_prune()
+            cohort.walkers.fix_best()
+            if self.share_best:
+                self._share_best(cohort)
+            if not cohort.calculate_end_condition():
+                self._submit_step(ix)
+
+    def _submit_step(self, ix: int) -> None:
+        """Sample the actions of a cohort and start stepping its environment."""
+        cohort = self.cohorts[ix]
+        cohort.walkers.update_best()
+        cohort.walkers.fix_best()
+        model_states, states_ids = cohort.predict_actions()
+        future = self._executor.submit(cohort.step_env, model_states)
+        self._pending[ix] = (model_states, states_ids, future)
+
+    def _share_best(self, cohort: Swarm) -> None:
+        """Assign the best state found by any cohort to the last walker of ``cohort``."""
+        best = self.best_cohort
+        if best is cohort or cohort._use_tree or best.walkers.states.best_state is None:
+            return
+        states = best.walkers.states
+        cohort.walkers.states.update(
+            best_reward=states.best_reward,
+            best_state=states.best_state.copy(),
+            best_obs=states.best_obs.copy(),
+        )
+        cohort.walkers.fix_best()
+
+    def _wait_pending(self) -> None:
+        """Wait for the environment steps in flight and discard them."""
+        for _, _, future in self._pending.values():
+            future.result()
+        self._pending = {}
+
+    def close(self) -> None:
+        """Wait for the pending environment steps and stop the thread pool."""
+        self._wait_pending()
+        self._executor.shutdown()
@@ -1,9 +1,15 @@
 import copy
-from typing import Any, List, Set
+from typing import Any, Dict, Generator, List, Set
+import zipfile
 
 import networkx as nx
+from numba import jit
+import numpy
+from numpy.lib import format as npy_format
 
 from fragile.core.base_classes import BaseStateTree
+from fragile.core.hash_table import HashTable
+from fragile.core.state_stores import ArrayStore
 from fragile.core.states import StatesEnv, StatesModel, StatesWalkers
 
 
@@ -136,9 +142,36 @@ class _BaseNetworkxTree(BaseStateTree):
         Returns:
             None
         """
-        for leaf in dead_leafs:
-            self.prune_branch(leaf, alive_leafs, from_hash=from_hash)
-        return
+        to_id = (lambda x: self.hash_to_ids[x]) if from_hash else (lambda x: x)
+        alive_leafs = {to_id(leaf) for leaf in alive_leafs}
+        self._prune_branches([to_id(leaf) for leaf in dead_leafs], alive_leafs)
+
+    def _prune_branches(self, leafs: List[int], alive_leafs: Set[int]) -> None:
+        """
+        Remove the target leaves and all their ancestors that become orphan \
+        leaves, without recursion.
+
+        Args:
+            leafs: Node ids of the leaves that will be removed.
+            alive_leafs: Node ids of the leaves that will not be removed.
+
+        Returns:
+            None
+
+        """
+        pending = list(leafs)
+        while pending:
+            leaf = pending.pop()
+            if leaf == self.ROOT_ID or leaf not in self.data.nodes:
+                continue
+            elif self.data.out_degree(leaf) > 0:
+                self.leafs.discard(leaf)
+                continue
+            elif leaf in alive_leafs:
+                continue
+            pending.extend(self.data.predecessors(leaf))
+            self.data.remove_node(leaf)
+            self.leafs.discard(leaf)
 
     def get_branch(self, leaf_id, from_hash: bool = False, root=ROOT_ID) -> tuple:
         """
@@ -171,7 +204,7 @@ class _BaseNetworkxTree(BaseStateTree):
 
     def prune_branch(self, leaf_id: int, alive_leafs: set, from_hash: bool = False):
         """
-        Recursively prunes a branch that ends in an orphan leaf.
+        Prune a branch that ends in an orphan leaf.
 
         Args:
             leaf_id: Id that identifies the leaf of the tree. \
@@ -187,21 +220,9 @@ class _BaseNetworkxTree(BaseStateTree):
             None
 
         """
-        leaf = self.hash_to_ids[leaf_id] if from_hash else leaf_id
-        is_not_a_leaf = len(self.data.out_edges([leaf])) > 0
-        if is_not_a_leaf and leaf != self.ROOT_ID:
-            self.leafs.discard(leaf)
-            return
-        elif leaf == self.ROOT_ID or leaf not in self.data.nodes:
-            return
-        alive_leafs = set([self.hash_to_ids[le] if from_hash else le for le in set(alive_leafs)])
-        if leaf in alive_leafs:
-            return
-        parents = set(self.data.in_edges([leaf]))
-        self.data.remove_node(leaf)
-        self.leafs.discard(leaf)
-        for parent, _ in parents:
-            return self.prune_branch(parent, alive_leafs)
+        to_id = (lambda x: self.hash_to_ids[x]) if from_hash else (lambda x: x)
+        alive_leafs = {to_id(leaf) for leaf in alive_leafs}
+        self._prune_branches([to_id(leaf_id)], alive_leafs)
 
     def get_parent(self, node_id) -> int:
         """Get the node id of the parent of the target node."""
@@ -216,7 +237,15 @@ class _BaseNetworkxTree(BaseStateTree):
         return leafs
 
 
-class HistoryTree(_BaseNetworkxTree):
+class NetworkxTree(_BaseNetworkxTree):
+    """
+    Keep track of the history of the visited states using a networkx DiGraph.
+
+    Every node stores a copy of its data in a dictionary of attributes, which \
+    makes it easy to plot and inspect, but slower and more memory hungry than \
+    :class:`HistoryTree`.
+    """
+
     def add_states(
         self,
         parent_ids: List[int],
@@ -279,6 +308,499 @@ class HistoryTree(_BaseNetworkxTree):
         """
         alive_leafs = set([self.hash_to_ids[le] if from_hash else le for le in set(alive_leafs)])
         dead_leafs = self.leafs - alive_leafs
-        super(HistoryTree, self).prune_tree(
+        super(NetworkxTree, self).prune_tree(
             dead_leafs=dead_leafs, alive_leafs=alive_leafs, from_hash=False
         )
+
+
+@jit(nopython=True)
+def _peel_dead_leaves(parent, n_children, is_node, alive_stamp, stamp, candidates, root_id):
+    """
+    Remove the candidate leaves that are not alive, and keep removing their \
+    ancestors while they become leaves that are not alive.
+
+    The nodes are marked as removed in ``is_node`` and detached from their \
+    parents. Only the removed nodes and their parents are visited.
+
+    Returns:
+        Tuple containing the ids of the removed nodes and the ids of the \
+        visited nodes that are leaves after the pruning.
+
+    """
+    pending = [numpy.int64(x) for x in range(0)]
+    for node in candidates:
+        pending.append(node)
+    removed = [numpy.int64(x) for x in range(0)]
+    leaves = [numpy.int64(x) for x in range(0)]
+    while len(pending) > 0:
+        node = pending.pop()
+        if not is_node[node] or n_children[node] > 0:
+            continue
+        if node == root_id or alive_stamp[node] == stamp:
+            leaves.append(node)
+            continue
+        is_node[node] = False
+        removed.append(node)
+        node_parent = parent[node]
+        parent[node] = -1
+        if node_parent >= 0:
+            n_children[node_parent] -= 1
+            if n_children[node_parent] == 0:
+                pending.append(node_parent)
+    return numpy.array(removed, dtype=numpy.int64), numpy.array(leaves, dtype=numpy.int64)
+
+
+class HistoryTree(BaseStateTree):
+    """
+    Keep track of the history of the states visited by the walkers.
+
+    The tree is stored in columns of growable numpy arrays indexed by node id: \
+    the parent of each node, the iteration when it was created, its rewards, \
+    and a payload with the action and the dt that lead to it. The states of \
+    the nodes are kept in a ``state_store``, which can store a full copy of \
+    each state (:class:`ArrayStore`) or only its difference with the state of \
+    its parent (:class:`DeltaStore`). The hashes of the states are mapped to \
+    node ids with a :class:`HashTable`, so a whole batch of walkers is added \
+    with vectorized operations.
+
+    The node ids of the pruned nodes are reused by the new nodes, and the \
+    arrays are compacted when more than half of their nodes have been pruned, \
+    so the node ids can change after calling :meth:`prune_tree`. The hashes \
+    of the states are stable identifiers.
+    """
+
+    ROOT_ID = 0
+    ROOT_HASH = 0
+
+    def __init__(self, capacity: int = 1024, state_store=None):
+        """
+        Initialize a :class:`HistoryTree`.
+
+        Args:
+            capacity: Initial number of nodes that the tree can store before \
+                      growing its arrays.
+            state_store: Object that stores the states of the nodes, such as \
+                         a :class:`DeltaStore`. If ``None`` an \
+                         :class:`ArrayStore` will be used.
+        """
+        self._initial_capacity = max(int(capacity), 2)
+        self.state_store = ArrayStore() if state_store is None else state_store
+        self._columns = {}
+        self._size = 0
+        self._free_ids = numpy.empty(0, dtype=numpy.int64)
+        # Nodes that can be leaves: the leaves that survived the last pruning and the new nodes
+        self._frontier = []
+        self._n_prunes = 0
+        self.hash_to_node = HashTable()
+        self.reset()
+
+    def __len__(self) -> int:
+        return self.n_nodes
+
+    @property
+    def n_nodes(self) -> int:
+        """Return the number of nodes currently stored in the tree."""
+        return self._size - len(self._free_ids)
+
+    @property
+    def capacity(self) -> int:
+        """Return the number of nodes that can be stored before growing the arrays."""
+        return len(self._columns["parent"])
+
+    @property
+    def leafs(self) -> Set[int]:
+        """Return a set containing the node ids of the leaves of the tree."""
+        return set(self.get_leaf_nodes())
+
+    def reset(
+        self,
+        env_states: StatesEnv = None,
+        model_states: StatesModel = None,
+        walkers_states: StatesWalkers = None,
+    ) -> None:
+        """
+        Delete all the data currently stored and reset the internal state of \
+        the tree.
+
+        Args:
+            env_states: Ignored. Only to implement interface.
+            model_states: Ignored. Only to implement interface.
+            walkers_states: Ignored. Only to implement interface.
+
+        Returns:
+            None.
+        """
+        capacity = self._initial_capacity
+        self._columns = {
+            "parent": numpy.full(capacity, -1, dtype=numpy.int64),
+            "n_iter": numpy.zeros(capacity, dtype=numpy.int64),
+            "reward": numpy.zeros(capacity, dtype=numpy.float64),
+            "cum_reward": numpy.zeros(capacity, dtype=numpy.float64),
+            "hash": numpy.zeros(capacity, dtype=numpy.int64),
+            "n_children": numpy.zeros(capacity, dtype=numpy.int64),
+            "is_node": numpy.zeros(capacity, dtype=numpy.bool_),
+            "alive_stamp": numpy.zeros(capacity, dtype=numpy.int64),
+        }
+        self._columns["n_iter"][self.ROOT_ID] = -1
+        self._columns["hash"][self.ROOT_ID] = self.ROOT_HASH
+        self._columns["is_node"][self.ROOT_ID] = True
+        self._size = 1
+        self._free_ids = numpy.empty(0, dtype=numpy.int64)
+        self._frontier = [numpy.array([self.ROOT_ID], dtype=numpy.int64)]
+        self._n_prunes = 0
+        self.hash_to_node.clear()
+        self.hash_to_node.insert([self.ROOT_HASH], [self.ROOT_ID])
+        self.state_store.reset()
+        self.state_store.resize(capacity)
+
+    def _resize(self, capacity: int) -> None:
+        """Change the size of all the columns to fit ``capacity`` nodes."""
+        for name, column in self._columns.items():
+            new_column = numpy.zeros((capacity,) + column.shape[1:], dtype=column.dtype)
+            new_column[: self._size] = column[: self._size]
+            if name == "parent":
+                new_column[self._size :] = -1
+            self._columns[name] = new_column
+        self.state_store.resize(capacity)
+
+    def _allocate(self, n_nodes: int) -> numpy.ndarray:
+        """Return the ids of ``n_nodes`` empty nodes, reusing the ids of the pruned nodes."""
+        reused = self._free_ids[:n_nodes]
+        self._free_ids = self._free_ids[n_nodes:]
+        n_appended = n_nodes - len(reused)
+        if self._size + n_appended > self.capacity:
+            self._resize(max(self._size + n_appended, 2 * self.capacity))
+        appended = numpy.arange(self._size, self._size + n_appended, dtype=numpy.int64)
+        self._size += n_appended
+        return numpy.concatenate([reused, appended])
+
+    def _write_payload(self, node_ids: numpy.ndarray, name: str, values: numpy.ndarray) -> None:
+        """Write the payload of the target nodes, creating its column if needed."""
+        values = numpy.asarray(values)
+        if name not in self._columns:
+            shape = (self.capacity,) + values.shape[1:]
+            self._columns[name] = numpy.zeros(shape, dtype=values.dtype)
+        self._columns[name][node_ids] = values
+
+    def add_states(
+        self,
+        parent_ids: List[int],
+        env_states: StatesEnv = None,
+        model_states: StatesModel = None,
+        walkers_states: StatesWalkers = None,
+        n_iter: int = None,
+    ):
+        """
+        Update the history of the tree adding the necessary data to recreate a \
+        the trajectories sampled by the :class:`Swarm`.
+
+        Only the walkers whose state is not already present in the tree are \
+        added, and all of them are written at once.
+
+        Args:
+            parent_ids: List of states hashes representing the parent nodes of \
+                        the current states.
+            env_states: :class:`StatesEnv` containing the data that will be \
+                        saved as new leaves in the tree.
+            model_states: :class:`StatesModel` containing the data that will be \
+                        saved as new leaves in the tree.
+            walkers_states: :class:`StatesWalkers` containing the data that will be \
+                        saved as new leaves in the tree.
+            n_iter: Number of iteration of the algorithm when the data was sampled.
+
+        Returns:
+            None
+
+        """
+        leaf_hashes = numpy.asarray(walkers_states.id_walkers, dtype=numpy.int64).reshape(-1)
+        parent_hashes = numpy.asarray(parent_ids, dtype=numpy.int64).reshape(-1)
+        # Add only the first occurrence of each state that is not in the tree yet
+        is_first = numpy.zeros(len(leaf_hashes), dtype=numpy.bool_)
+        is_first[numpy.unique(leaf_hashes, return_index=True)[1]] = True
+        rows = numpy.flatnonzero(is_first & (self.hash_to_node.get(leaf_hashes) < 0))
+        if len(rows) == 0:
+            return
+        parent_nodes = self.hash_to_node.get(parent_hashes[rows])
+        if (parent_nodes < 0).any():
+            missing = parent_hashes[rows][parent_nodes < 0]
+            raise KeyError("Parent hashes {} are not present in the tree".format(missing))
+        node_ids = self._allocate(len(rows))
+        columns = self._columns
+        columns["parent"][node_ids] = parent_nodes
+        columns["n_iter"][node_ids] = -1 if n_iter is None else n_iter
+        columns["reward"][node_ids] = numpy.asarray(env_states.rewards)[rows]
+        columns["cum_reward"][node_ids] = numpy.asarray(walkers_states.cum_rewards)[rows]
+        columns["hash"][node_ids] = leaf_hashes[rows]
+        columns["n_children"][node_ids] = 0
+        columns["is_node"][node_ids] = True
+        dts = model_states.get("dt")
+        dts = numpy.ones(model_states.n, dtype=numpy.int64) if dts is None else dts
+        # The root has no state, so its children are stored without a parent state
+        parent_states = numpy.where(parent_nodes == self.ROOT_ID, -1, parent_nodes)
+        self.state_store.write(node_ids, parent_states, numpy.asarray(env_states.states)[rows])
+        self._write_payload(node_ids, "action", numpy.asarray(model_states.actions)[rows])
+        self._write_payload(node_ids, "dt", numpy.asarray(dts)[rows])
+        columns["alive_stamp"][node_ids] = 0
+        numpy.add.at(columns["n_children"], parent_nodes, 1)
+        self.hash_to_node.insert(leaf_hashes[rows], node_ids)
+        self._frontier.append(node_ids)
+
+    def _to_node_ids(self, ids, from_hash: bool) -> numpy.ndarray:
+        """Return the node ids of the target ids, discarding the hashes not present in the tree."""
+        ids = numpy.fromiter(ids, dtype=numpy.int64) if isinstance(ids, (set, frozenset)) else ids
+        ids = numpy.asarray(ids, dtype=numpy.int64).reshape(-1)
+        if not from_hash:
+            return ids
+        nodes = self.hash_to_node.get(ids)
+        return nodes[nodes >= 0]
+
+    def prune_tree(self, alive_leafs: Set[int], from_hash: bool = False) -> None:
+        """
+        Remove the branches that do not have a walker in their leaves.
+
+        Only the leaves added or kept since the last call are checked, and the \
+        dead branches are removed from their leaves upwards until reaching a \
+        node with other children. The cost is proportional to the number of \
+        nodes removed, not to the size or the depth of the tree.
+
+        Args:
+            alive_leafs: Contains the ids  of the leaf nodes that are being \
+                         expanded by the walkers.
+            from_hash: from_hash: If ``True`` ``alive_leafs`` will be \
+                      considered a set of hashes of states. If ``False`` it \
+                      will be considered a set of node ids.
+
+        Returns:
+            None.
+        """
+        columns = self._columns
+        self._n_prunes += 1
+        columns["alive_stamp"][self._to_node_ids(alive_leafs, from_hash)] = self._n_prunes
+        if sum(len(nodes) for nodes in self._frontier) > self._size:
+            candidates = numpy.arange(self._size, dtype=numpy.int64)
+        else:
+            candidates = numpy.concatenate(self._frontier)
+        removed, leaves = _peel_dead_leaves(
+            columns["parent"],
+            columns["n_children"],
+            columns["is_node"],
+            columns["alive_stamp"],
+            self._n_prunes,
+            candidates,
+            self.ROOT_ID,
+        )
+        self._frontier = [numpy.unique(leaves)]
+        if len(removed) > 0:
+            self.hash_to_node.remove(columns["hash"][removed])
+            self.state_store.remove(removed)
+            self._free_ids = numpy.concatenate([self._free_ids, removed])
+        if len(self._free_ids) > max(self.n_nodes, self._initial_capacity):
+            self.compact()
+
+    def compact(self) -> None:
+        """
+        Move the nodes stored at the end of the arrays to the ids of the pruned \
+        nodes, and shrink the arrays if they are mostly empty.
+
+        It runs automatically after pruning when more than half of the ids are \
+        free, so its cost is amortized over the nodes removed. The node ids of \
+        the moved nodes change, but their hashes do not.
+        """
+        columns = self._columns
+        n_nodes = self.n_nodes
+        moved = numpy.flatnonzero(columns["is_node"][n_nodes : self._size]) + n_nodes
+        holes = numpy.flatnonzero(~columns["is_node"][:n_nodes])
+        for column in columns.values():
+            column[holes] = column[moved]
+        mapping = numpy.arange(self._size, dtype=numpy.int64)
+        mapping[moved] = holes
+        self.state_store.move(moved, holes, mapping)
+        parents = columns["parent"][:n_nodes]
+        columns["parent"][:n_nodes] = numpy.where(parents >= 0, mapping[parents], -1)
+        columns["is_node"][n_nodes : self._size] = False
+        columns["parent"][n_nodes : self._size] = -1
+        self.hash_to_node.insert(columns["hash"][holes], holes)
+        self._frontier = [mapping[nodes] for nodes in self._frontier]
+        self._size = n_nodes
+        self._free_ids = numpy.empty(0, dtype=numpy.int64)
+        if self.capacity > 4 * max(n_nodes, self._initial_capacity):
+            self._resize(2 * max(n_nodes, self._initial_capacity))
+
+    def get_path(
+        self, leaf_id: int, from_hash: bool = False, root: int = ROOT_ID
+    ) -> numpy.ndarray:
+        """Return an array with the node ids from ``root`` to the target leaf."""
+        leaf = self._to_node_ids([leaf_id], from_hash)
+        if len(leaf) == 0 or not self._columns["is_node"][leaf[0]]:
+            raise KeyError("Node {} is not present in the tree".format(leaf_id))
+        parent = self._columns["parent"]
+        path = [int(leaf[0])]
+        while path[-1] != root:
+            if parent[path[-1]] < 0:
+                raise KeyError("Node {} is not a descendant of {}".format(leaf_id, root))
+            path.append(int(parent[path[-1]]))
+        return numpy.array(path[::-1], dtype=numpy.int64)
+
+    def get_branch(self, leaf_id: int, from_hash: bool = False, root: int = ROOT_ID) -> tuple:
+        """
+        Get the data of the branch ended at leaf_id.
+
+        Args:
+            leaf_id: Id that identifies the leaf of the tree. \
+                     If ``leaf_id`` is the hash of a walker state ``from_hash`` \
+                     needs to be ``True``. Otherwise it refers to a node id of \
+                     the leaf node.
+            from_hash: If  ``True`` ``leaf_id`` is considered the hash of walker \
+                      state. If ``False`` it will be considered a node id.
+            root: Node id of the root node of the tree.
+
+        Returns:
+            tuple containing (states, actions, dts) that represent the history \
+            of a given branch of the tree.
+
+            ``states`` represent the :class:`StatesEnv`.states assigned to each node.
+            ``actions`` represent the :class:`StatesModel`.actions taken at each state.
+            ``dts`` the :class:`StatesModel`.dt of each state.
+
+        """
+        path = self.get_path(leaf_id, from_hash=from_hash, root=root)
+        if "action" not in self._columns:
+            return [None], [], []
+        # Stream the states from the root to the leaf, so a DeltaStore only
+        # needs to decode the first one
+        if root == self.ROOT_ID:
+            states = [None] + list(self.state_store.iter_branch(path[1:]))
+        else:
+            states = list(self.state_store.iter_branch(path))
+        actions = list(self._columns["action"][path[1:]])
+        dts = list(self._columns["dt"][path[1:]])
+        return states, actions, dts
+
+    def _branch_nodes(self, leaf_id: int, from_hash: bool, root: int) -> numpy.ndarray:
+        """Return the node ids of a branch that have a state, which excludes the root node."""
+        path = self.get_path(leaf_id, from_hash=from_hash, root=root)
+        return path[1:] if root == self.ROOT_ID else path
+
+    def iter_branch(
+        self, leaf_id: int, from_hash: bool = False, root: int = ROOT_ID, chunk_size: int = 1024,
+    ) -> Generator[Dict[str, numpy.ndarray], None, None]:
+        """
+        Iterate over the data of the branch ended at ``leaf_id`` in chunks of \
+        consecutive nodes, from the root to the leaf.
+
+        Only one chunk of states is held in memory at the same time, so it can \
+        be used to process branches that do not fit in memory.
+
+        Args:
+            leaf_id: Id that identifies the leaf of the tree. \
+                     If ``leaf_id`` is the hash of a walker state ``from_hash`` \
+                     needs to be ``True``. Otherwise it refers to a node id of \
+                     the leaf node.
+            from_hash: If  ``True`` ``leaf_id`` is considered the hash of walker \
+                      state. If ``False`` it will be considered a node id.
+            root: Node id of the root node of the tree.
+            chunk_size: Maximum number of nodes of each chunk.
+
+        Yields:
+            Dictionary containing the ``states``, ``actions``, ``dts`` and \
+            ``rewards`` of the nodes of the chunk as contiguous arrays. The \
+            action and the dt of a node are the ones that lead to its state \
+            from the state of its parent.
+
+        """
+        nodes = self._branch_nodes(leaf_id, from_hash=from_hash, root=root)
+        if "action" not in self._columns:
+            return
+        states = self.state_store.iter_branch(nodes)
+        for start in range(0, len(nodes), chunk_size):
+            chunk = nodes[start : start + chunk_size]
+            yield {
+                "states": numpy.stack([next(states) for _ in range(len(chunk))]),
+                "actions": self._columns["action"][chunk],
+                "dts": self._columns["dt"][chunk],
+                "rewards": self._columns["reward"][chunk],
+            }
+
+    def get_branch_arrays(
+        self, leaf_id: int, from_hash: bool = False, root: int = ROOT_ID, chunk_size: int = 1024
+    ) -> Dict[str, numpy.ndarray]:
+        """
+        Get the data of the branch ended at ``leaf_id`` as contiguous arrays.
+
+        It takes the same arguments as :meth:`iter_branch`, and returns a \
+        dictionary containing the ``states``, ``actions``, ``dts`` and \
+        ``rewards`` of all the nodes of the branch. Unlike :meth:`get_branch` \
+        the root node is not included, because it has no state.
+        """
+        n_nodes = len(self._branch_nodes(leaf_id, from_hash=from_hash, root=root))
+        branch, start = {}, 0
+        for chunk in self.iter_branch(leaf_id, from_hash, root, chunk_size):
+            for name, values in chunk.items():
+                if name not in branch:
+                    branch[name] = numpy.empty((n_nodes,) + values.shape[1:], values.dtype)
+                branch[name][start : start + len(values)] = values
+            start += len(chunk["states"])
+        return branch
+
+    def save_branch(
+        self,
+        path: str,
+        leaf_id: int,
+        from_hash: bool = False,
+        root: int = ROOT_ID,
+        chunk_size: int = 1024,
+        compress: bool = False,
+    ) -> None:
+        """
+        Write the data of the branch ended at ``leaf_id`` to an ``.npz`` file.
+
+        The states are written in chunks of ``chunk_size`` nodes, so the whole \
+        branch never needs to be in memory. The file can be read with \
+        :func:`numpy.load`, and it contains the same arrays as the dictionary \
+        returned by :meth:`get_branch_arrays`.
+
+        Args:
+            path: Path of the ``.npz`` file that will be written.
+            leaf_id: Id that identifies the leaf of the tree.
+            from_hash: If  ``True`` ``leaf_id`` is considered the hash of walker \
+                      state. If ``False`` it will be considered a node id.
+            root: Node id of the root node of the tree.
+            chunk_size: Maximum number of states that will be held in memory.
+            compress: If ``True`` compress the arrays written to the file.
+
+        Returns:
+            None.
+
+        """
+        nodes = self._branch_nodes(leaf_id, from_hash=from_hash, root=root)
+        if "action" not in self._columns or len(nodes) == 0:
+            raise ValueError("The branch of {} does not contain any state".format(leaf_id))
+        first_state = self.state_store.read(nodes[:1])
+        if first_state.dtype == object:
+            raise TypeError("States of object dtype cannot be written to a .npz file")
+        compression = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        with zipfile.ZipFile(path, mode="w", compression=compression, allowZip64=True) as file:
+            # The header of the states is written first, so they can be streamed
+            header = {
+                "descr": npy_format.dtype_to_descr(first_state.dtype),
+                "fortran_order": False,
+                "shape": (len(nodes),) + first_state.shape[1:],
+            }
+            with file.open("states.npy", mode="w", force_zip64=True) as states_file:
+                npy_format.write_array_header_2_0(states_file, header)
+                for chunk in self.iter_branch(leaf_id, from_hash, root, chunk_size):
+                    states_file.write(numpy.ascontiguousarray(chunk["states"]).tobytes())
+            columns = {"actions": "action", "dts": "dt", "rewards": "reward"}
+            for name, column in columns.items():
+                with file.open(name + ".npy", mode="w", force_zip64=True) as column_file:
+                    npy_format.write_array(column_file, self._columns[column][nodes])
+
+    def get_parent(self, node_id: int) -> int:
+        """Get the node id of the parent of the target node."""
+        return int(self._columns["parent"][node_id])
+
+    def get_leaf_nodes(self) -> List[int]:
+        """Return a list containing all the node ids of the leaves of the tree."""
+        size = self._size
+        is_leaf = self._columns["is_node"][:size] & (self._columns["n_children"][:size] == 0)
+        return numpy.flatnonzero(is_leaf).tolist()
@@ -45,14 +45,38 @@ def resize_frame(frame: np.ndarray, height: int, width: int, mode: str = "RGB")
     return np.array(frame)
 
 
-def relativize(x: np.ndarray) -> np.ndarray:
-    """Normalize the data using a custom smoothing technique."""
+def relativize(x: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+    """
+    Normalize the data using a custom smoothing technique.
+
+    Floating point inputs keep their dtype. The computation is performed in \
+    place over a single buffer, so no other full size arrays are allocated \
+    apart from a boolean mask.
+
+    Args:
+        x: Vector of values that will be normalized.
+        out: Array where the result will be written. If ``None`` a new array \
+             will be allocated.
+
+    Returns:
+        Array containing the normalized values of ``x``.
+
+    """
+    dtype = x.dtype if np.issubdtype(x.dtype, np.floating) else np.float64
     std = x.std()
     if float(std) == 0:
-        return np.ones(len(x), dtype=type(std))
-    standard = (x - x.mean()) / std
-    standard[standard > 0] = np.log(1.0 + standard[standard > 0]) + 1.0
-    standard[standard <= 0] = np.exp(standard[standard <= 0])
+        if out is None:
+            return np.ones(len(x), dtype=dtype)
+        out[:] = 1
+        return out
+    standard = np.empty(x.shape, dtype=dtype) if out is None else out
+    np.subtract(x, x.mean(), out=standard)
+    standard /= std
+    positive = standard > 0
+    np.log1p(standard, out=standard, where=positive)
+    np.add(standard, 1.0, out=standard, where=positive)
+    negative = np.logical_not(positive, out=positive)
+    np.exp(standard, out=standard, where=negative)
     return standard
 
 
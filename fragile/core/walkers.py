@@ -1,10 +1,17 @@
 import copy
-from typing import Callable, Dict, List, Optional, Set, Tuple
+from typing import Callable, Dict, Optional, Set, Tuple, Union
 
-# import line_profiler
 import numpy
 
 from fragile.core.base_classes import BaseCritic, BaseWalkers
+from fragile.core.distances import get_distance_function, pairwise_distances
+from fragile.core.kernels import (
+    BACKENDS,
+    clone_indexes,
+    hash_rows,
+    virtual_reward,
+    warmup_kernels,
+)
 from fragile.core.states import StatesEnv, StatesModel, StatesWalkers
 from fragile.core.utils import float_type, relativize, Scalar, StateDict, statistics_from_array
 
@@ -28,9 +35,13 @@ class SimpleWalkers(BaseWalkers):
         max_iters: int = None,
         accumulate_rewards: bool = True,
         distance_function: Optional[
-            Callable[[numpy.ndarray, numpy.ndarray], numpy.ndarray]
+            Union[str, Callable[[numpy.ndarray, numpy.ndarray], numpy.ndarray]]
         ] = None,
+        distance_embedding: Optional[Callable[[numpy.ndarray], numpy.ndarray]] = None,
         ignore_clone: Optional[Dict[str, Set[str]]] = None,
+        use_arena: bool = False,
+        backend: str = "numpy",
+        track_ids: bool = True,
         **kwargs
     ):
         """
@@ -54,15 +65,35 @@ class SimpleWalkers(BaseWalkers):
             distance_function: Function to compute the distances between two \
                                groups of walkers. It will be applied row-wise \
                                to the walkers observations and it will return a \
-                               vector of scalars. Defaults to l2 norm.
+                               vector of scalars. It can also be the name of one \
+                               of the distances defined in \
+                               :data:`fragile.core.distances.DISTANCE_FUNCTIONS`. \
+                               Defaults to l2 norm.
+            distance_embedding: Function that transforms a batch of observations \
+                                into a compact representation before calculating \
+                                the distances, such as :class:`RandomProjection` \
+                                or :class:`Downsample`. The embedding is computed \
+                                once every time the observations change, and it \
+                                can be accessed with :attr:`observs_embedding`.
             ignore_clone: Dictionary containing the attribute values that will \
                           not be cloned. Its keys can be be either "env", of \
                           "model", to reference the `env_states` and the \
                           `model_states`. Its values are a set of string with \
                           the names of the attributes that will not be cloned.
+            use_arena: If ``True`` the fixed-shape data of the walkers, the \
+                       environment and the model states will be stored in a \
+                       single contiguous buffer for each one of them.
+            backend: Backend of the kernels used to clone the walkers and to \
+                     calculate the virtual reward. It can be either "numpy" \
+                     or "numba".
+            track_ids: If ``False`` :meth:`balance` will not collect the ids \
+                       of the walkers. Set it to ``False`` when nothing \
+                       consumes the ids to skip hashing the states.
             kwargs: Additional attributes stored in the :class:`StatesWalkers`.
 
         """
+        if backend not in BACKENDS:
+            raise ValueError("backend must be one of {}, got {} instead".format(BACKENDS, backend))
         super(SimpleWalkers, self).__init__(
             n_walkers=n_walkers,
             env_state_params=env_state_params,
@@ -70,19 +101,33 @@ class SimpleWalkers(BaseWalkers):
             accumulate_rewards=accumulate_rewards,
         )
 
-        def l2_norm(x: numpy.ndarray, y: numpy.ndarray) -> numpy.ndarray:
-            return numpy.linalg.norm(x - y, axis=1)
-
-        self._model_states = StatesModel(state_dict=model_state_params, batch_size=n_walkers)
-        self._env_states = StatesEnv(state_dict=env_state_params, batch_size=n_walkers)
-        self._states = self.STATE_CLASS(batch_size=n_walkers, **kwargs)
-        self.distance_function = distance_function if distance_function is not None else l2_norm
+        self._model_states = StatesModel(
+            state_dict=model_state_params, batch_size=n_walkers, use_arena=use_arena
+        )
+        self._env_states = StatesEnv(
+            state_dict=env_state_params, batch_size=n_walkers, use_arena=use_arena
+        )
+        # Back buffer where the environment can write the next states before swapping them
+        self._env_states_buffer = StatesEnv(
+            state_dict=env_state_params, batch_size=n_walkers, use_arena=use_arena
+        )
+        self._states = self.STATE_CLASS(batch_size=n_walkers, use_arena=use_arena, **kwargs)
+        self.distance_function = get_distance_function(distance_function)
+        self.distance_embedding = distance_embedding
+        # Embedding of the current observations. It is None when it has to be recomputed
+        self._observs_embedding = None
         self.reward_scale = reward_scale
         self.dist_scale = dist_scale
         self.n_iters = 0
         self.max_iters = max_iters if max_iters is not None else 1e12
         self._id_counter = 0
         self.ignore_clone = ignore_clone if ignore_clone is not None else {}
+        self.backend = backend
+        self.track_ids = track_ids
+        if backend == "numba":
+            states = (self._env_states, self._model_states, self._states)
+            values = [value for state in states for value in state.vals()]
+            warmup_kernels({value.dtype for value in values if isinstance(value, numpy.ndarray)})
 
     def __repr__(self) -> str:
         """Print all the data involved in the current run of the algorithm."""
@@ -105,19 +150,57 @@ class SimpleWalkers(BaseWalkers):
         )
         return text
 
-    def ids(self) -> List[int]:
+    def ids(self, rows: Optional[numpy.ndarray] = None) -> numpy.ndarray:
         """
-        Return a list of unique ids for each walker state.
+        Return an array of unique ids for each walker state.
 
         The returned ids are integers representing the hash of the different states.
+
+        Args:
+            rows: Indexes of the walkers whose ids will be returned. If ``None`` \
+                  return the ids of all the walkers.
+
+        Returns:
+            Array of int64 containing the ids of the target walkers.
+
+        """
+        states = self.env_states.states
+        if isinstance(states, numpy.ndarray) and states.dtype != object:
+            return hash_rows(states, rows)
+        ids = numpy.array(self.env_states.hash_values("states"), dtype=numpy.int64)
+        return ids if rows is None else ids[rows]
+
+    def update_ids(self, changed: Optional[numpy.ndarray] = None):
+        """
+        Update the unique id of each walker and store it in the :class:`StatesWalkers`.
+
+        The ids stored in the :class:`StatesWalkers` work as a cache: they are \
+        copied along with the rest of the data when the walkers clone, so only \
+        the walkers whose state has changed need to be hashed again.
+
+        Args:
+            changed: Boolean mask or indexes of the walkers whose state has \
+                     changed. If ``None`` the ids of all the walkers will be updated.
+
         """
-        # ids = numpy.arange(self.n) + self._id_counter
-        # self._id_counter += self.n
-        return self.env_states.hash_values("states")
+        if changed is None:
+            self.states.assign(id_walkers=self.ids())
+            return
+        changed = numpy.asarray(changed)
+        rows = numpy.flatnonzero(changed) if changed.dtype == numpy.bool_ else changed
+        if len(rows) > 0:
+            self.states.id_walkers[rows] = self.ids(rows)
 
-    def update_ids(self):
-        """Update the unique id of each walker and store it in the :class:`StatesWalkers`."""
-        self.states.update(id_walkers=self.ids().copy())
+    @property
+    def env_states_buffer(self) -> StatesEnv:
+        """
+        Return the :class:`StatesEnv` that can be used as the output buffer of \
+        the next environment step.
+
+        When it is passed to :meth:`update_states` it becomes the current \
+        ``env_states``, and the previous ``env_states`` become the new buffer.
+        """
+        return self._env_states_buffer
 
     @property
     def states(self) -> StatesWalkers:
@@ -147,7 +230,6 @@ class SimpleWalkers(BaseWalkers):
         max_iters = self.n_iters >= self.max_iters
         return all_dead or max_iters
 
-    # @profile
     def calculate_distances(self) -> None:
         """Calculate the corresponding distance function for each observation with \
         respect to another observation chosen at random.
@@ -155,11 +237,39 @@ class SimpleWalkers(BaseWalkers):
         The internal :class:`StateWalkers` is updated with the relativized distance values.
         """
         compas_ix = numpy.random.permutation(numpy.arange(self.n))  # self.get_alive_compas()
-        obs = self.env_states.observs.reshape(self.n, -1)
-        distances = self.distance_function(obs, obs[compas_ix])
-        distances = relativize(distances.flatten())
+        obs = self.get_distance_observs()
+        distances = pairwise_distances(self.distance_function, obs, compas_ix)
+        distances = relativize(distances.flatten(), out=self._get_buffer("distances"))
         self.update_states(distances=distances, compas_dist=compas_ix)
 
+    @property
+    def observs_embedding(self) -> Optional[numpy.ndarray]:
+        """
+        Return the ``distance_embedding`` of the current observations, or \
+        ``None`` if there is no ``distance_embedding``.
+
+        It is computed the first time it is accessed after the observations \
+        change, which happens when the :class:`StatesEnv` is updated and when \
+        the walkers clone. It is not stored in the ``env_states``, so it is \
+        never copied when cloning.
+        """
+        if self.distance_embedding is None:
+            return None
+        if self._observs_embedding is None:
+            self._observs_embedding = self.distance_embedding(self.env_states.observs)
+        return self._observs_embedding
+
+    def get_distance_observs(self) -> numpy.ndarray:
+        """
+        Return the observations used to calculate the distances.
+
+        If a ``distance_embedding`` is defined, the :attr:`observs_embedding` \
+        will be returned instead of the observations.
+        """
+        if self.distance_embedding is None:
+            return self.env_states.observs
+        return self.observs_embedding
+
     def calculate_virtual_reward(self) -> None:
         """
         Calculate the virtual reward and update the internal state.
@@ -167,10 +277,31 @@ class SimpleWalkers(BaseWalkers):
         The cumulative_reward is transformed with the relativize function. \
         The distances stored in the :class:`StatesWalkers` are already transformed.
         """
-        processed_rewards = relativize(self.states.cum_rewards)
-        virt_rw = processed_rewards ** self.reward_scale * self.states.distances ** self.dist_scale
+        processed_rewards, virt_rw, _, _ = virtual_reward(
+            rewards=self.states.cum_rewards,
+            distances=self.states.distances,
+            reward_scale=self.reward_scale,
+            dist_scale=self.dist_scale,
+            processed_rewards=self._get_buffer("processed_rewards"),
+            virtual_rewards=self._get_buffer("virtual_rewards"),
+            backend=self.backend,
+        )
         self.update_states(virtual_rewards=virt_rw, processed_rewards=processed_rewards)
 
+    def _get_buffer(self, name: str) -> Optional[numpy.ndarray]:
+        """
+        Return the target attribute of the :class:`StatesWalkers` if it can be \
+        used as the output buffer of a kernel, otherwise return ``None``.
+        """
+        buffer = self.states.get(name)
+        is_valid = (
+            isinstance(buffer, numpy.ndarray)
+            and buffer.shape == (self.n,)
+            and buffer.dtype == float_type
+            and buffer.flags.writeable
+        )
+        return buffer if is_valid else None
+
     def get_alive_compas(self) -> numpy.ndarray:
         """
         Return the indexes of alive companions chosen at random.
@@ -210,8 +341,7 @@ class SimpleWalkers(BaseWalkers):
             # clone_probs = numpy.sqrt(numpy.clip(clone_probs, 0, 1.1))
         self.update_states(clone_probs=clone_probs, compas_clone=compas_ix)
 
-    # @profile
-    def balance(self) -> Tuple[set, set]:
+    def balance(self) -> Tuple[Optional[set], Optional[set]]:
         """
         Perform an iteration of the FractalAI algorithm for balancing the \
         walkers distribution.
@@ -222,18 +352,18 @@ class SimpleWalkers(BaseWalkers):
         Returns:
             A tuple containing two sets: The first one represent the unique ids \
             of the states for each walker at the start of the iteration. The second \
-            one contains the ids of the states after the cloning process.
+            one contains the ids of the states after the cloning process. Both \
+            sets are ``None`` if :attr:`track_ids` is ``False``.
 
         """
-        old_ids = set(self.states.id_walkers.copy())
+        old_ids = set(self.states.id_walkers.tolist()) if self.track_ids else None
         self.calculate_distances()
         self.calculate_virtual_reward()
         self.update_clone_probs()
         self.clone_walkers()
-        new_ids = set(self.states.id_walkers.copy())
+        new_ids = set(self.states.id_walkers.tolist()) if self.track_ids else None
         return old_ids, new_ids
 
-    # @profile
     def clone_walkers(self) -> None:
         """
         Sample the clone probability distribution and clone the walkers accordingly.
@@ -244,12 +374,22 @@ class SimpleWalkers(BaseWalkers):
         will_clone = self.states.clone_probs > self.random_state.random_sample(self.n)
         will_clone[self.states.end_condition] = True  # Dead walkers always clone
         self.update_states(will_clone=will_clone)
-        clone, compas = self.states.clone()
-        self._env_states.clone(
-            will_clone=clone, compas_ix=compas, ignore=self.ignore_clone.get("env")
+        # The indexes are computed once and shared by all the states
+        clone_ix, source_ix = clone_indexes(will_clone, self.states.compas_clone)
+        self.states.clone_rows(clone_ix=clone_ix, source_ix=source_ix, backend=self.backend)
+        if len(clone_ix) > 0:
+            self._observs_embedding = None
+        self._env_states.clone_rows(
+            clone_ix=clone_ix,
+            source_ix=source_ix,
+            ignore=self.ignore_clone.get("env"),
+            backend=self.backend,
         )
-        self._model_states.clone(
-            will_clone=clone, compas_ix=compas, ignore=self.ignore_clone.get("model")
+        self._model_states.clone_rows(
+            clone_ix=clone_ix,
+            source_ix=source_ix,
+            ignore=self.ignore_clone.get("model"),
+            backend=self.backend,
         )
 
     def reset(
@@ -268,18 +408,32 @@ class SimpleWalkers(BaseWalkers):
         else:
             self.states.reset()
         self.update_states(env_states=env_states, model_states=model_states)
+        self._observs_embedding = None
         self.n_iters = 0
 
     def update_states(
-        self, env_states: StatesEnv = None, model_states: StatesModel = None, **kwargs
+        self,
+        env_states: StatesEnv = None,
+        model_states: StatesModel = None,
+        take_ownership: bool = False,
+        **kwargs
     ):
         """
         Update the States variables that do not contain internal data and \
         accumulate the rewards in the internal states if applicable.
 
+        The data is written in place into the arrays that the :class:`States` \
+        already allocated, so no intermediate copies are made.
+
         Args:
-            env_states: States containing the data associated with the Environment.
+            env_states: States containing the data associated with the Environment. \
+                        If it is :attr:`env_states_buffer` it will be swapped \
+                        with the current ``env_states`` instead of being copied.
             model_states: States containing data associated with the Environment.
+            take_ownership: If ``True`` the arrays of ``env_states`` and \
+                            ``model_states`` will be stored by reference instead \
+                            of being copied. Only use it when they will not be \
+                            modified by the caller afterwards.
             **kwargs: Internal states will be updated via keyword arguments.
 
         """
@@ -287,13 +441,19 @@ class SimpleWalkers(BaseWalkers):
             if kwargs.get("rewards") is not None:
                 self._accumulate_and_update_rewards(kwargs["rewards"])
                 del kwargs["rewards"]
-            self.states.update(**kwargs)
-        if isinstance(env_states, StatesEnv):
-            self._env_states.update(env_states)
+            self.states.assign(**kwargs)
+        if env_states is not None:
+            self._observs_embedding = None
+        if env_states is not None and env_states is self._env_states_buffer:
+            # The data is already in the back buffer, so swapping is enough.
+            self._env_states, self._env_states_buffer = env_states, self._env_states
+            self._accumulate_and_update_rewards(env_states.rewards)
+        elif isinstance(env_states, StatesEnv):
+            self._env_states.assign(env_states, take_ownership=take_ownership)
             if hasattr(env_states, "rewards"):
                 self._accumulate_and_update_rewards(env_states.rewards)
         if isinstance(model_states, StatesModel):
-            self._model_states.update(model_states)
+            self._model_states.assign(model_states, take_ownership=take_ownership)
 
     def _accumulate_and_update_rewards(self, rewards: numpy.ndarray):
         """
@@ -377,18 +537,18 @@ class Walkers(SimpleWalkers):
         )
         return text + super(Walkers, self).__repr__()
 
-    # @profile
     def calculate_virtual_reward(self):
         """Apply the virtual reward formula to account for all the different goal scores."""
-        rewards = -1 * self.states.cum_rewards if self.minimize else self.states.cum_rewards
-        processed_rewards = relativize(rewards)
-        score_reward = processed_rewards ** self.reward_scale
-        score_dist = self.states.distances ** self.dist_scale
-        virt_rw = score_reward * score_dist
-        dist_prob = score_dist / score_dist.sum()
-        reward_prob = score_reward / score_reward.sum()
-        total_entropy = numpy.prod(2 - dist_prob ** reward_prob)
-        self._min_entropy = numpy.prod(2 - reward_prob ** reward_prob)
+        processed_rewards, virt_rw, self._min_entropy, total_entropy = virtual_reward(
+            rewards=self.states.cum_rewards,
+            distances=self.states.distances,
+            reward_scale=self.reward_scale,
+            dist_scale=self.dist_scale,
+            minimize=self.minimize,
+            processed_rewards=self._get_buffer("processed_rewards"),
+            virtual_rewards=self._get_buffer("virtual_rewards"),
+            backend=self.backend,
+        )
         self.efficiency = self._min_entropy / total_entropy
         self.update_states(virtual_rewards=virt_rw, processed_rewards=processed_rewards)
         if self.critic is not None:
@@ -403,7 +563,6 @@ class Walkers(SimpleWalkers):
             virt_rew = self.states.virtual_rewards
         self.states.update(virtual_rewards=virt_rew)
 
-    # @profile
     def balance(self):
         """Perform FAI iteration to clone the states."""
         self.update_best()
@@ -1,9 +1,10 @@
+import functools
 import math
 from typing import Callable
 
-from numba import jit
 import numpy as np
 
+from fragile.core.kernels import lennard_jones_energy
 from fragile.core.states import StatesEnv, StatesModel
 from fragile.optimize.env import Bounds, Function
 
@@ -36,54 +37,24 @@ def styblinski_tang(x) -> np.ndarray:
     return np.sum(x ** 4 - 16 * x ** 2 + 5 * x, 1) / 2.0
 
 
-@jit(nopython=True)
-def _lennard_fast(state):
-    state = state.reshape(-1, 3)
-    npart = len(state)
-    epot = 0.0
-    for i in range(npart):
-        for j in range(npart):
-            if i > j:
-                r2 = np.sum((state[j, :] - state[i, :]) ** 2)
-                r2i = 1.0 / r2
-                r6i = r2i * r2i * r2i
-                epot = epot + r6i * (r6i - 1.0)
-    epot = epot * 4
-    return epot
-
-
-def lennard_jones(x: np.ndarray) -> np.ndarray:
-    result = np.zeros(x.shape[0])
-    for i in range(x.shape[0]):
-        try:
-            result[i] = _lennard_fast(x[i])
-        except ZeroDivisionError:
-            result[i] = np.inf
-    return result
-
+def lennard_jones(x: np.ndarray, cutoff: float = None) -> np.ndarray:
+    return lennard_jones_energy(x, cutoff=cutoff)
 
-def _one_random_lennard(state):
-    state = state.reshape(-1, 3)
-    npart = len(state)
-    epot = 0.0
-    i, j = 0, 0
-    while i == j:
-        i, j = np.random.randint(0, npart, size=2).tolist()
-    r2 = np.sum((state[j, :] - state[i, :]) ** 2)
-    r2i = 1.0 / r2
-    r6i = r2i * r2i * r2i
-    epot = epot + r6i * (r6i - 1.0)
-    epot = epot * 4
-    return epot
 
-
-def random_lennard(x: np.ndarray):
-    result = np.zeros(x.shape[0])
-    for i in range(x.shape[0]):
-        try:
-            result[i] = _one_random_lennard(x[i])
-        except ZeroDivisionError:
-            result[i] = np.inf
+def random_lennard(x: np.ndarray) -> np.ndarray:
+    """Return the Lennard-Jones energy of a random pair of atoms of each cluster."""
+    atoms = x.reshape(x.shape[0], -1, 3)
+    n_walkers, n_atoms = atoms.shape[:2]
+    first = np.random.randint(0, n_atoms, size=n_walkers)
+    # Adding an offset between 1 and n_atoms - 1 guarantees two different atoms
+    second = (first + np.random.randint(1, n_atoms, size=n_walkers)) % n_atoms
+    walkers = np.arange(n_walkers)
+    r2 = np.sum((atoms[walkers, first] - atoms[walkers, second]) ** 2, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r6i = 1.0 / r2 ** 3
+        result = 4 * r6i * (r6i - 1.0)
+    result[r2 == 0] = np.inf
+    return result
 
 
 class OptimBenchmark(Function):
@@ -194,11 +165,14 @@ class LennardJones(OptimBenchmark):
 
     benchmark = None
 
-    def __init__(self, n_atoms: int = 10, *args, **kwargs):
+    def __init__(self, n_atoms: int = 10, cutoff: float = None, *args, **kwargs):
         self.n_atoms = n_atoms
+        self.cutoff = cutoff
         shape = (3 * n_atoms,)
         self.benchmark = [np.zeros(self.n_atoms * 3), self.minima.get(str(int(n_atoms)), 0)]
-        super(LennardJones, self).__init__(shape=shape, function=lennard_jones)
+        super(LennardJones, self).__init__(
+            shape=shape, function=functools.partial(lennard_jones, cutoff=cutoff)
+        )
 
     @staticmethod
     def get_bounds(shape):
@@ -211,7 +185,9 @@ class RandomLennard(LennardJones):
         super(RandomLennard, self).__init__(*args, **kwargs)
         self.random_lennard = random_lennard
 
-    def step(self, model_states: StatesModel, env_states: StatesEnv) -> StatesEnv:
+    def step(
+        self, model_states: StatesModel, env_states: StatesEnv, out: StatesEnv = None
+    ) -> StatesEnv:
         """
         Sets the environment to the target states by applying the specified actions an arbitrary
         number of time steps.
@@ -219,24 +195,30 @@ class RandomLennard(LennardJones):
         Args:
             model_states: States corresponding to the model data.
             env_states: States class containing the state data to be set on the Environment.
+            out: Preallocated :class:`StatesEnv` where the new data will be written.
 
         Returns:
             States containing the information that describes the new state of the Environment.
         """
-        new_points = model_states.actions + env_states.observs
+        new_points = np.add(
+            model_states.actions, env_states.observs, out=None if out is None else out.observs
+        )
 
         rewards = self.random_lennard(new_points).flatten()
         ends = self.calculate_end(points=new_points)
 
-        last_states = self.states_from_data(model_states.n, new_points, new_points, rewards, ends)
+        last_states = self.states_from_data(
+            model_states.n, new_points, new_points, rewards, ends, out=out
+        )
         return last_states
 
-    def reset(self, batch_size: int = 1, **kwargs) -> StatesEnv:
+    def reset(self, batch_size: int = 1, out: StatesEnv = None, **kwargs) -> StatesEnv:
         """
         Resets the environment to the start of a new episode and returns an
         States instance describing the state of the Environment.
         Args:
             batch_size: Number of walkers that the returned state will have.
+            out: Preallocated :class:`StatesEnv` where the new data will be written.
             **kwargs: Ignored. This environment resets without using any external data.
 
         Returns:
@@ -245,7 +227,11 @@ class RandomLennard(LennardJones):
             batch_size.
         """
         ends = np.zeros(batch_size, dtype=np.bool_)
-        new_points = self.sample_bounds(batch_size=batch_size)
+        new_points = self.sample_bounds(
+            batch_size=batch_size, out=None if out is None else out.observs
+        )
         rewards = self.random_lennard(new_points).flatten()
-        new_states = self.states_from_data(batch_size, new_points, new_points, rewards, ends)
+        new_states = self.states_from_data(
+            batch_size, new_points, new_points, rewards, ends, out=out
+        )
         return new_states
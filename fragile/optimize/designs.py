@@ -0,0 +1,135 @@
+"""Initial designs used to sample the starting points of the optimization environments."""
+from typing import Callable, Dict
+import warnings
+
+import numpy
+
+try:
+    from scipy.stats import qmc
+except ImportError:
+    qmc = None
+
+
+def uniform_design(n_points: int, n_dims: int, random_state) -> numpy.ndarray:
+    """
+    Sample points uniformly from the unit hypercube.
+
+    Args:
+        n_points: Number of points that will be sampled.
+        n_dims: Number of dimensions of each point.
+        random_state: ``numpy.random.RandomState`` used to sample the points.
+
+    Returns:
+        Array of shape (n_points, n_dims) containing values in [0, 1).
+    """
+    return random_state.uniform(0.0, 1.0, size=(n_points, n_dims))
+
+
+def latin_hypercube(n_points: int, n_dims: int, random_state) -> numpy.ndarray:
+    """
+    Sample a Latin hypercube design from the unit hypercube.
+
+    Each dimension is divided in ``n_points`` intervals of the same size, and \
+    every interval contains exactly one of the sampled points.
+
+    Args:
+        n_points: Number of points that will be sampled.
+        n_dims: Number of dimensions of each point.
+        random_state: ``numpy.random.RandomState`` used to sample the points.
+
+    Returns:
+        Array of shape (n_points, n_dims) containing values in [0, 1).
+    """
+    # Sorting a random matrix along the first axis gives an independent permutation per column
+    intervals = random_state.random_sample((n_points, n_dims)).argsort(axis=0)
+    return (intervals + random_state.random_sample((n_points, n_dims))) / n_points
+
+
+def _first_primes(n: int) -> numpy.ndarray:
+    """Return the first ``n`` prime numbers."""
+    primes = []
+    candidate = 2
+    while len(primes) < n:
+        if all(candidate % p for p in primes if p * p <= candidate):
+            primes.append(candidate)
+        candidate += 1
+    return numpy.array(primes, dtype=numpy.int64)
+
+
+def halton(n_points: int, n_dims: int, random_state) -> numpy.ndarray:
+    """
+    Sample a randomly shifted Halton sequence from the unit hypercube.
+
+    The radical inverse of the point indexes is computed for all the points \
+    at once, and a random shift modulo 1 is applied to each dimension so \
+    different calls return different designs.
+
+    Args:
+        n_points: Number of points that will be sampled.
+        n_dims: Number of dimensions of each point.
+        random_state: ``numpy.random.RandomState`` used to sample the shift.
+
+    Returns:
+        Array of shape (n_points, n_dims) containing values in [0, 1).
+    """
+    bases = _first_primes(n_dims)
+    indexes = numpy.repeat(numpy.arange(1, n_points + 1)[:, numpy.newaxis], n_dims, axis=1)
+    points = numpy.zeros((n_points, n_dims))
+    scale = numpy.ones(n_dims)
+    while indexes.any():
+        scale = scale / bases
+        indexes, digits = numpy.divmod(indexes, bases)
+        points += digits * scale
+    return numpy.mod(points + random_state.random_sample(n_dims), 1.0)
+
+
+def sobol(n_points: int, n_dims: int, random_state) -> numpy.ndarray:
+    """
+    Sample a scrambled Sobol sequence from the unit hypercube.
+
+    It requires ``scipy.stats.qmc`` (scipy >= 1.7).
+
+    Args:
+        n_points: Number of points that will be sampled. The sequence has \
+                  its best coverage when it is a power of 2.
+        n_dims: Number of dimensions of each point.
+        random_state: ``numpy.random.RandomState`` used to scramble the sequence.
+
+    Returns:
+        Array of shape (n_points, n_dims) containing values in [0, 1).
+    """
+    if qmc is None:
+        raise ImportError("The sobol design needs scipy.stats.qmc. Please install scipy>=1.7")
+    sampler = qmc.Sobol(d=n_dims, scramble=True, seed=random_state.randint(2 ** 31))
+    with warnings.catch_warnings():
+        # The balance warning for batch sizes that are not a power of 2 is expected
+        warnings.simplefilter("ignore", UserWarning)
+        return sampler.random(n_points)
+
+
+DESIGNS: Dict[str, Callable[[int, int, numpy.random.RandomState], numpy.ndarray]] = {
+    "uniform": uniform_design,
+    "lhs": latin_hypercube,
+    "halton": halton,
+    "sobol": sobol,
+}
+
+
+def sample_design(design: str, n_points: int, n_dims: int, random_state) -> numpy.ndarray:
+    """
+    Sample ``n_points`` from the unit hypercube using the target design.
+
+    Args:
+        design: Name of the design. One of "uniform", "lhs", "halton" or "sobol".
+        n_points: Number of points that will be sampled.
+        n_dims: Number of dimensions of each point.
+        random_state: ``numpy.random.RandomState`` used to sample the points.
+
+    Returns:
+        Array of shape (n_points, n_dims) containing values in [0, 1).
+    """
+    if design not in DESIGNS:
+        raise ValueError(
+            "Invalid design {}. Available designs are {}".format(design, list(DESIGNS))
+        )
+    return DESIGNS[design](n_points, n_dims, random_state)
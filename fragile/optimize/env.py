@@ -1,3 +1,8 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from multiprocessing import shared_memory
+import os
+import time
 from typing import Callable, Tuple, Union
 
 import numpy
@@ -8,6 +13,7 @@ from fragile.core.env import Environment
 from fragile.core.models import Bounds
 from fragile.core.states import StatesEnv, StatesModel
 from fragile.core.utils import Scalar
+from fragile.optimize.designs import DESIGNS, sample_design
 
 
 class Function(Environment):
@@ -17,7 +23,10 @@ class Function(Environment):
     """
 
     def __init__(
-        self, function: Callable[[numpy.ndarray], numpy.ndarray], bounds: Bounds,
+        self,
+        function: Callable[[numpy.ndarray], numpy.ndarray],
+        bounds: Bounds,
+        initial_design: str = "uniform",
     ):
         """
         Initialize a :class:`Function`.
@@ -28,10 +37,19 @@ class Function(Environment):
                       scalar. This function is applied to a batch of walker \
                       observations.
             bounds: :class:`Bounds` that defines the domain of the function.
+            initial_design: Design used to sample the points of a reset. One of \
+                            "uniform", "lhs" (Latin hypercube), "halton" or "sobol".
         """
         if not isinstance(bounds, Bounds):
             raise TypeError("Bounds needs to be an instance of Bounds, found {}".format(bounds))
+        if initial_design not in DESIGNS:
+            raise ValueError(
+                "Invalid initial_design {}. Available designs are {}".format(
+                    initial_design, list(DESIGNS)
+                )
+            )
         self.function = function
+        self.initial_design = initial_design
         self.bounds = bounds
         self.shape = self.bounds.shape
         super(Function, self).__init__(observs_shape=self.shape, states_shape=self.shape)
@@ -43,6 +61,7 @@ class Function(Environment):
         shape: tuple = None,
         high: Union[int, float, numpy.ndarray] = numpy.inf,
         low: Union[int, float, numpy.ndarray] = -numpy.inf,
+        initial_design: str = "uniform",
     ) -> "Function":
         """
         Initialize a function defining its shape and bounds without using a :class:`Bounds`.
@@ -62,6 +81,7 @@ class Function(Environment):
             low: Lower bound of the function domain. If it's an scalar it will \
                   be the same for all dimensions. If its a numpy array it will \
                   be the lower bound for each dimension.
+            initial_design: Design used to sample the points of a reset.
 
         Returns:
             :class:`Function` with its :class:`Bounds` created from the provided arguments.
@@ -73,7 +93,7 @@ class Function(Environment):
         ):
             raise TypeError("Need to specify shape or high or low must be a numpy array.")
         bounds = Bounds(high=high, low=low, shape=shape)
-        return Function(function=function, bounds=bounds)
+        return Function(function=function, bounds=bounds, initial_design=initial_design)
 
     def __repr__(self):
         text = "{} with function {}, obs shape {},".format(
@@ -81,7 +101,9 @@ class Function(Environment):
         )
         return text
 
-    def step(self, model_states: StatesModel, env_states: StatesEnv) -> StatesEnv:
+    def step(
+        self, model_states: StatesModel, env_states: StatesEnv, out: StatesEnv = None
+    ) -> StatesEnv:
         """
         Sets the :class:`Function` to the target states and sums the actions \
         provided by the :class:`StatesEnv`.
@@ -90,14 +112,19 @@ class Function(Environment):
             model_states: :class:`StatesModel` corresponding to the :class:`Model` data.
             env_states: :class:`StatesEnv` containing the data where the function \
              will be evaluated.
+            out: Preallocated :class:`StatesEnv` where the new data will be written. \
+                 The new points will be computed directly in its observations.
 
         Returns:
             :class:`StatesEnv` containing the information that describes the \
             new states sampled.
         """
-        new_points = model_states.actions + env_states.observs
+        new_points = numpy.add(
+            model_states.actions, env_states.observs, out=None if out is None else out.observs
+        )
         ends = self.calculate_end(points=new_points)
-        rewards = self.function(new_points).flatten()
+        # ravel does not copy the rewards when the function returns a contiguous array
+        rewards = self.function(new_points).ravel()
 
         updated_states = self.states_from_data(
             states=new_points,
@@ -105,16 +132,19 @@ class Function(Environment):
             rewards=rewards,
             ends=ends,
             batch_size=model_states.n,
+            out=out,
         )
         return updated_states
 
-    def reset(self, batch_size: int = 1, **kwargs) -> StatesEnv:
+    def reset(self, batch_size: int = 1, out: StatesEnv = None, **kwargs) -> StatesEnv:
         """
         Resets the :class:`Function` to the start of a new episode and returns an
         :class:`StatesEnv` instance describing its internal state.
 
         Args:
             batch_size: Number of walkers that the returned state will have.
+            out: Preallocated :class:`StatesEnv` where the new data will be written. \
+                 The new points will be sampled directly in its observations.
             **kwargs: Ignored. This environment resets without using any external data.
 
         Returns:
@@ -123,14 +153,17 @@ class Function(Environment):
             equal to batch_size.
         """
         ends = numpy.zeros(batch_size, dtype=numpy.bool_)
-        new_points = self.sample_bounds(batch_size=batch_size)
-        rewards = self.function(new_points).flatten()
+        new_points = self.sample_bounds(
+            batch_size=batch_size, out=None if out is None else out.observs
+        )
+        rewards = self.function(new_points).ravel()
         new_states = self.states_from_data(
             states=new_points,
             observs=new_points,
             rewards=rewards,
             ends=ends,
             batch_size=batch_size,
+            out=out,
         )
         return new_states
 
@@ -149,30 +182,49 @@ class Function(Environment):
         """
         return numpy.logical_not(self.bounds.points_in_bounds(points)).flatten()
 
-    def sample_bounds(self, batch_size: int) -> numpy.ndarray:
+    def sample_bounds(self, batch_size: int, out: numpy.ndarray = None) -> numpy.ndarray:
         """
-        Return a matrix of points sampled uniformly from the :class:`Function` \
-        domain.
+        Return a matrix of points sampled from the :class:`Function` domain \
+        using its ``initial_design``.
+
+        All the points are sampled at once from the unit hypercube, and then \
+        scaled to the :class:`Bounds` of the :class:`Function`.
 
         Args:
             batch_size: Number of points that will be sampled.
+            out: Preallocated array where the points will be written.
 
         Returns:
             Array containing ``batch_size`` points that lie inside the \
             :class:`Function` domain, stacked across the first dimension.
         """
-        new_points = numpy.zeros(tuple([batch_size]) + self.shape, dtype=numpy.float32)
-        for i in range(batch_size):
-            new_points[i, :] = self.random_state.uniform(
-                low=self.bounds.low, high=self.bounds.high, size=self.shape
-            )
-        return new_points
+        n_dims = int(numpy.prod(self.shape))
+        unit_points = sample_design(self.initial_design, batch_size, n_dims, self.random_state)
+        unit_points = unit_points.reshape((batch_size,) + self.shape)
+        if out is None:
+            out = numpy.empty((batch_size,) + self.shape, dtype=numpy.float32)
+        high, low = self.bounds.high, self.bounds.low
+        numpy.multiply(unit_points, high - low, out=unit_points)
+        numpy.add(unit_points, low, out=out, casting="unsafe")
+        return out
+
+
+class _BudgetExhausted(Exception):
+    """Stop a minimization when its time budget runs out."""
 
 
 class Minimizer:
     """Apply ``scipy.optimize.minimize`` to a :class:`Function`."""
 
-    def __init__(self, function: Function, bounds=None, *args, **kwargs):
+    def __init__(
+        self,
+        function: Function,
+        bounds=None,
+        max_iter: int = None,
+        max_time: float = None,
+        *args,
+        **kwargs
+    ):
         """
         Initialize a :class:`Minimizer`.
 
@@ -181,12 +233,18 @@ class Minimizer:
             bounds: :class:`Bounds` defining the domain of the minimization \
                     process. If it is ``None`` the :class:`Function` :class:`Bounds` \
                     will be used.
+            max_iter: Maximum number of iterations of the minimization of \
+                      each point. If ``None`` the scipy default will be used.
+            max_time: Maximum number of seconds spent minimizing each point. \
+                      When it runs out the best point evaluated is returned.
             *args: Passed to ``scipy.optimize.minimize``
             **kwargs: Passed to ``scipy.optimize.minimize``
         """
         self.env = function
         self.function = function.function
         self.bounds = self.env.bounds if bounds is None else bounds
+        self.max_iter = max_iter
+        self.max_time = max_time
         self.args = args
         self.kwargs = kwargs
 
@@ -198,22 +256,35 @@ class Minimizer:
             x: Array representing a single point of the function to be minimized.
 
         Returns:
-            Optimization result object returned by ``scipy.optimize.minimize``.
+            Optimization result object returned by ``scipy.optimize.minimize``. \
+            If the time budget runs out, a dictionary containing the best point \
+            evaluated as ``x`` and its value as ``fun``.
         """
+        deadline = None if self.max_time is None else time.perf_counter() + self.max_time
+        best = {"x": x, "fun": numpy.inf}
 
         def _optimize(_x):
             try:
-                _x = _x.reshape((1,) + _x.shape)
-                y = self.function(_x)
+                y = float(self.function(_x.reshape((1,) + _x.shape)))
             except (ZeroDivisionError, RuntimeError):
                 y = numpy.inf
+            if y < best["fun"]:
+                best["x"], best["fun"] = _x.copy(), y
+            if deadline is not None and time.perf_counter() > deadline:
+                raise _BudgetExhausted()
             return y
 
         bounds = ScipyBounds(
             ub=self.bounds.high if self.bounds is not None else None,
             lb=self.bounds.low if self.bounds is not None else None,
         )
-        return minimize(_optimize, x, bounds=bounds, *self.args, **self.kwargs)
+        kwargs = dict(self.kwargs)
+        if self.max_iter is not None:
+            kwargs["options"] = dict(kwargs.get("options", {}), maxiter=self.max_iter)
+        try:
+            return minimize(_optimize, x, bounds=bounds, *self.args, **kwargs)
+        except _BudgetExhausted:
+            return best
 
     def minimize_point(self, x: numpy.ndarray) -> Tuple[numpy.ndarray, Scalar]:
         """
@@ -252,23 +323,473 @@ class Minimizer:
         return result, rewards
 
 
+# Minimizer used by the processes of the pool of a ParallelMinimizer
+_worker_minimizer = None
+# Shared memory blocks attached by the current worker process
+_worker_blocks = {}
+
+
+def _init_worker(minimizer: Minimizer) -> None:
+    """Store the :class:`Minimizer` that the worker process will use."""
+    global _worker_minimizer
+    _worker_minimizer = minimizer
+
+
+def _attach_block(name: str) -> shared_memory.SharedMemory:
+    """Attach to a shared memory block, releasing the blocks that are not used anymore."""
+    if name not in _worker_blocks:
+        for block in _worker_blocks.values():
+            block.close()
+        _worker_blocks.clear()
+        _worker_blocks[name] = shared_memory.SharedMemory(name=name)
+    return _worker_blocks[name]
+
+
+def _minimize_chunk(name: str, n_points: int, n_dims: int, start: int, end: int) -> None:
+    """Minimize the points ``start:end`` of a shared block and write the results to it."""
+    points, results, rewards = _block_arrays(_attach_block(name).buf, n_points, n_dims)
+    for i in range(start, end):
+        results[i], rewards[i] = _worker_minimizer.minimize_point(points[i])
+
+
+def _block_arrays(buffer, n_points: int, n_dims: int) -> Tuple[numpy.ndarray, ...]:
+    """Return the points, results and rewards arrays stored in a shared memory buffer."""
+    size = n_points * n_dims
+    data = numpy.ndarray((2 * size + n_points,), dtype=numpy.float64, buffer=buffer)
+    points = data[:size].reshape(n_points, n_dims)
+    results = data[size : 2 * size].reshape(n_points, n_dims)
+    return points, results, data[2 * size :]
+
+
+class ParallelMinimizer(Minimizer):
+    """
+    :class:`Minimizer` that minimizes a batch of points in parallel using a \
+    persistent pool of worker processes.
+
+    The points are split in chunks that are dispatched to the workers. The \
+    points, the results and the rewards are stored in a block of shared \
+    memory, so only the position of each chunk is sent to the workers. The \
+    :class:`Function` is sent once to each worker when the pool starts. The \
+    workers are started with the "spawn" method, so it needs to be picklable.
+    """
+
+    def __init__(
+        self,
+        function: Function,
+        bounds=None,
+        max_iter: int = None,
+        max_time: float = None,
+        n_workers: int = None,
+        chunk_size: int = None,
+        *args,
+        **kwargs
+    ):
+        """
+        Initialize a :class:`ParallelMinimizer`.
+
+        Args:
+            function: :class:`Function` that will be minimized.
+            bounds: :class:`Bounds` defining the domain of the minimization \
+                    process. If it is ``None`` the :class:`Function` :class:`Bounds` \
+                    will be used.
+            max_iter: Maximum number of iterations of the minimization of \
+                      each point. If ``None`` the scipy default will be used.
+            max_time: Maximum number of seconds spent minimizing each point.
+            n_workers: Number of worker processes. If ``None`` it will be the \
+                       number of cpus of the machine.
+            chunk_size: Number of points sent to a worker at once. If ``None`` \
+                        each worker receives around four chunks per batch.
+            *args: Passed to ``scipy.optimize.minimize``
+            **kwargs: Passed to ``scipy.optimize.minimize``
+        """
+        super(ParallelMinimizer, self).__init__(
+            function, bounds, max_iter, max_time, *args, **kwargs
+        )
+        self.n_workers = n_workers if n_workers is not None else os.cpu_count()
+        self.chunk_size = chunk_size
+        self._pool = None
+        self._block = None
+
+    def __del__(self):
+        self.close()
+
+    def close(self) -> None:
+        """Stop the worker processes and release the shared memory."""
+        if getattr(self, "_pool", None) is not None:
+            self._pool.shutdown()
+            self._pool = None
+        if getattr(self, "_block", None) is not None:
+            self._block.close()
+            self._block.unlink()
+            self._block = None
+
+    def _start_pool(self) -> None:
+        """Start the worker processes, sending them a serial :class:`Minimizer`."""
+        minimizer = Minimizer(
+            self.env, self.bounds, self.max_iter, self.max_time, *self.args, **self.kwargs
+        )
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.n_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(minimizer,),
+        )
+
+    def _reserve_block(self, n_bytes: int) -> shared_memory.SharedMemory:
+        """Return a block of shared memory of at least ``n_bytes``, reusing the current one."""
+        if self._block is None or self._block.size < n_bytes:
+            if self._block is not None:
+                self._block.close()
+                self._block.unlink()
+            self._block = shared_memory.SharedMemory(create=True, size=n_bytes)
+        return self._block
+
+    def minimize_batch(self, x: numpy.ndarray) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Minimize a batch of points in parallel.
+
+        Args:
+            x: Array representing a batch of points to be optimized, stacked \
+               across the first dimension.
+
+        Returns:
+            Tuple of arrays containing the local optimum found for each point, \
+            and an array with the values assigned to each of the points found.
+        """
+        n_points, n_dims = x.shape[0], int(numpy.prod(x.shape[1:]))
+        if n_points == 0:
+            return numpy.zeros_like(x), numpy.zeros((0, 1))
+        if self._pool is None:
+            self._start_pool()
+        block = self._reserve_block(8 * (2 * n_points * n_dims + n_points))
+        points, results, rewards = _block_arrays(block.buf, n_points, n_dims)
+        points[:] = x.reshape(n_points, n_dims)
+        chunk_size = self.chunk_size or -(-n_points // (4 * self.n_workers))
+        futures = [
+            self._pool.submit(
+                _minimize_chunk,
+                block.name,
+                n_points,
+                n_dims,
+                start,
+                min(start + chunk_size, n_points),
+            )
+            for start in range(0, n_points, chunk_size)
+        ]
+        for future in futures:
+            future.result()
+        result = results.reshape(x.shape).astype(x.dtype)
+        return result, rewards.reshape(-1, 1).copy()
+
+
+class BatchedMinimizer:
+    """
+    Minimize all the points of a batch at the same time using a gradient \
+    based local search.
+
+    The function and its gradient are always evaluated over the whole batch \
+    of points that are still being minimized, so each iteration only needs a \
+    few calls to the vectorized function. The points are projected inside \
+    the bounds after every update.
+
+    The gradients are approximated with forward finite differences, evaluating \
+    all the shifted points in one call, unless an analytic ``gradient`` is \
+    provided. Three methods are available:
+
+    - "gd": Gradient descent with a step size adapted independently for each point.
+    - "adam": Adam optimizer. It returns the best point visited.
+    - "lbfgs": L-BFGS with a backtracking line search.
+    """
+
+    METHODS = ("gd", "adam", "lbfgs")
+    LEARNING_RATES = {"gd": 0.1, "adam": 0.01, "lbfgs": 1.0}
+
+    def __init__(
+        self,
+        function: Function,
+        bounds=None,
+        method: str = "lbfgs",
+        gradient: Callable[[numpy.ndarray], numpy.ndarray] = None,
+        max_iter: int = 100,
+        learning_rate: float = None,
+        epsilon: float = 1e-6,
+        tol: float = 1e-6,
+        memory: int = 10,
+        max_rows: int = 1 << 16,
+    ):
+        """
+        Initialize a :class:`BatchedMinimizer`.
+
+        Args:
+            function: :class:`Function` that will be minimized.
+            bounds: :class:`Bounds` defining the domain of the minimization \
+                    process. If it is ``None`` the :class:`Function` :class:`Bounds` \
+                    will be used.
+            method: "gd", "adam" or "lbfgs".
+            gradient: Callable that takes a batch of points and returns the \
+                      gradient of the function at each point. If ``None`` \
+                      the gradient is approximated with finite differences.
+            max_iter: Maximum number of iterations.
+            learning_rate: Initial step size. If ``None`` it depends on the method.
+            epsilon: Relative size of the finite differences steps.
+            tol: A point stops being minimized when the largest component \
+                 of its gradient, or the improvement of its value, is lower \
+                 than ``tol``.
+            memory: Number of updates used to approximate the hessian with "lbfgs".
+            max_rows: Maximum number of points evaluated in a single call when \
+                      computing the finite differences.
+        """
+        if method not in self.METHODS:
+            raise ValueError("method must be one of {}, got {}".format(self.METHODS, method))
+        self.env = function
+        self.function = function.function
+        self.bounds = self.env.bounds if bounds is None else bounds
+        self.method = method
+        self.gradient_function = gradient
+        self.max_iter = max_iter
+        self.learning_rate = (
+            learning_rate if learning_rate is not None else self.LEARNING_RATES[method]
+        )
+        self.epsilon = epsilon
+        self.tol = tol
+        self.memory = memory
+        self.max_rows = max_rows
+
+    def evaluate(self, x: numpy.ndarray) -> numpy.ndarray:
+        """Evaluate the function on a batch of points, considering ``nan`` values as ``inf``."""
+        if len(x) == 0:
+            return numpy.zeros(0)
+        values = numpy.asarray(self.function(x), dtype=numpy.float64).reshape(len(x))
+        return numpy.where(numpy.isnan(values), numpy.inf, values)
+
+    def gradient(self, x: numpy.ndarray, values: numpy.ndarray) -> numpy.ndarray:
+        """
+        Compute the gradient of the function at a batch of points.
+
+        Args:
+            x: Array of shape (n_points, n_dims) containing the points.
+            values: Values of the function at ``x``.
+
+        Returns:
+            Array of shape (n_points, n_dims). The gradient of the points with \
+            non finite values or gradients is zero.
+        """
+        if self.gradient_function is not None:
+            grads = numpy.asarray(self.gradient_function(x), dtype=numpy.float64)
+            grads = grads.reshape(x.shape)
+        else:
+            grads = self._finite_differences(x, values)
+        grads[~numpy.isfinite(values)] = 0
+        return numpy.where(numpy.isfinite(grads), grads, 0.0)
+
+    def _finite_differences(self, x: numpy.ndarray, values: numpy.ndarray) -> numpy.ndarray:
+        """Approximate the gradient with forward differences, shifting all the points at once."""
+        n_points, n_dims = x.shape
+        steps = self.epsilon * numpy.maximum(1.0, numpy.abs(x))
+        grads = numpy.empty_like(x)
+        dims_per_call = max(1, self.max_rows // max(n_points, 1))
+        for start in range(0, n_dims, dims_per_call):
+            dims = numpy.arange(start, min(start + dims_per_call, n_dims))
+            shifted = numpy.repeat(x[:, numpy.newaxis], len(dims), axis=1)
+            shifted[:, numpy.arange(len(dims)), dims] += steps[:, dims]
+            shifted_values = self.evaluate(shifted.reshape(-1, n_dims)).reshape(n_points, -1)
+            grads[:, dims] = (shifted_values - values[:, numpy.newaxis]) / steps[:, dims]
+        return grads
+
+    def project(self, x: numpy.ndarray) -> numpy.ndarray:
+        """Clip the points to lie inside the bounds."""
+        return x if self.bounds is None else self.bounds.clip(x)
+
+    def minimize_batch(self, x: numpy.ndarray) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Minimize a batch of points.
+
+        Args:
+            x: Array representing a batch of points to be optimized, stacked \
+               across the first dimension.
+
+        Returns:
+            Tuple of arrays containing the local optimum found for each point, \
+            and an array with the values assigned to each of the points found.
+        """
+        points = self.project(numpy.asarray(x, dtype=numpy.float64).reshape(len(x), -1))
+        values = self.evaluate(points)
+        if self.method == "gd":
+            points, values = self._gradient_descent(points, values)
+        elif self.method == "adam":
+            points, values = self._adam(points, values)
+        else:
+            points, values = self._lbfgs(points, values)
+        return points.reshape(x.shape).astype(x.dtype), values.reshape(-1, 1)
+
+    def _gradient_descent(self, x, values):
+        """Run gradient descent adapting the step size of each point to its progress."""
+        rates = numpy.full(len(x), self.learning_rate)
+        active = numpy.isfinite(values)
+        for _ in range(self.max_iter):
+            ix = numpy.flatnonzero(active)
+            if len(ix) == 0:
+                break
+            grads = self.gradient(x[ix], values[ix])
+            new_x = self.project(x[ix] - rates[ix, numpy.newaxis] * grads)
+            new_values = self.evaluate(new_x)
+            improved = new_values < values[ix]
+            improvement = values[ix] - new_values
+            x[ix[improved]], values[ix[improved]] = new_x[improved], new_values[improved]
+            rates[ix] *= numpy.where(improved, 1.2, 0.5)
+            converged = (numpy.abs(grads).max(axis=1) < self.tol) | (rates[ix] < 1e-12)
+            active[ix] = ~converged & ~(improved & (improvement < self.tol))
+        return x, values
+
+    def _adam(self, x, values, beta_1: float = 0.9, beta_2: float = 0.999):
+        """Run Adam on all the points, keeping track of the best point visited by each one."""
+        best_x, best_values = x.copy(), values.copy()
+        first_moment, second_moment = numpy.zeros_like(x), numpy.zeros_like(x)
+        active = numpy.isfinite(values)
+        for i in range(1, self.max_iter + 1):
+            ix = numpy.flatnonzero(active)
+            if len(ix) == 0:
+                break
+            grads = self.gradient(x[ix], values[ix])
+            first_moment[ix] = beta_1 * first_moment[ix] + (1 - beta_1) * grads
+            second_moment[ix] = beta_2 * second_moment[ix] + (1 - beta_2) * grads ** 2
+            step = (first_moment[ix] / (1 - beta_1 ** i)) / (
+                numpy.sqrt(second_moment[ix] / (1 - beta_2 ** i)) + 1e-8
+            )
+            new_x = self.project(x[ix] - self.learning_rate * step)
+            moved = numpy.abs(new_x - x[ix]).max(axis=1)
+            x[ix], values[ix] = new_x, self.evaluate(new_x)
+            improved = values[ix] < best_values[ix]
+            best_x[ix[improved]], best_values[ix[improved]] = x[ix[improved]], values[ix[improved]]
+            active[ix] = (moved >= self.tol) & numpy.isfinite(values[ix])
+        return best_x, best_values
+
+    def _lbfgs(self, x, values, c_1: float = 1e-4, max_line_search: int = 20):
+        """Run L-BFGS on all the points, storing the curvature pairs of each point in arrays."""
+        n_points, n_dims = x.shape
+        s_hist = numpy.zeros((n_points, self.memory, n_dims))
+        y_hist = numpy.zeros((n_points, self.memory, n_dims))
+        rho_hist = numpy.zeros((n_points, self.memory))
+        grads = self.gradient(x, values)
+        # Until there are curvature pairs the first step has the length of the learning rate
+        gamma = 1.0 / numpy.maximum(numpy.linalg.norm(grads, axis=1), 1e-12)
+        active = numpy.isfinite(values) & (numpy.abs(grads).max(axis=1) >= self.tol)
+        for i in range(self.max_iter):
+            ix = numpy.flatnonzero(active)
+            if len(ix) == 0:
+                break
+            # Two loop recursion over the stored pairs, from the newest to the oldest
+            q = grads[ix].copy()
+            slots = [(i - 1 - j) % self.memory for j in range(min(i, self.memory))]
+            alphas = []
+            for slot in slots:
+                alpha = rho_hist[ix, slot] * numpy.einsum("ij,ij->i", s_hist[ix, slot], q)
+                q -= alpha[:, numpy.newaxis] * y_hist[ix, slot]
+                alphas.append(alpha)
+            q *= gamma[ix, numpy.newaxis]
+            for slot, alpha in zip(reversed(slots), reversed(alphas)):
+                beta = rho_hist[ix, slot] * numpy.einsum("ij,ij->i", y_hist[ix, slot], q)
+                q += (alpha - beta)[:, numpy.newaxis] * s_hist[ix, slot]
+            direction = -q
+            not_descent = numpy.einsum("ij,ij->i", direction, grads[ix]) >= 0
+            direction[not_descent] = -grads[ix][not_descent]
+            # Backtracking line search on the points that have not found a valid step yet
+            new_x, new_values = x[ix].copy(), values[ix].copy()
+            step = numpy.full(len(ix), self.learning_rate)
+            pending = numpy.ones(len(ix), dtype=bool)
+            for _ in range(max_line_search):
+                rows = numpy.flatnonzero(pending)
+                if len(rows) == 0:
+                    break
+                candidates = self.project(
+                    x[ix[rows]] + step[rows, numpy.newaxis] * direction[rows]
+                )
+                candidate_values = self.evaluate(candidates)
+                decrease = numpy.einsum("ij,ij->i", grads[ix[rows]], candidates - x[ix[rows]])
+                accepted = candidate_values <= values[ix[rows]] + c_1 * decrease
+                new_x[rows[accepted]] = candidates[accepted]
+                new_values[rows[accepted]] = candidate_values[accepted]
+                pending[rows[accepted]] = False
+                step[rows[~accepted]] *= 0.5
+            moved = ~pending
+            slot = i % self.memory
+            rho_hist[ix, slot] = 0
+            if moved.any():
+                rows = ix[moved]
+                new_grads = self.gradient(new_x[moved], new_values[moved])
+                s, y = new_x[moved] - x[rows], new_grads - grads[rows]
+                curvature = numpy.einsum("ij,ij->i", s, y)
+                valid = curvature > 1e-10
+                s_hist[rows, slot], y_hist[rows, slot] = s, y
+                rho_hist[rows[valid], slot] = 1.0 / curvature[valid]
+                gamma[rows[valid]] = curvature[valid] / numpy.einsum("ij,ij->i", y, y)[valid]
+                improvement = values[rows] - new_values[moved]
+                x[rows], values[rows], grads[rows] = new_x[moved], new_values[moved], new_grads
+                active[rows] = (numpy.abs(new_grads).max(axis=1) >= self.tol) & (
+                    improvement >= self.tol * (1 + numpy.abs(values[rows]))
+                )
+            active[ix[~moved]] = False
+        return x, values
+
+
 class MinimizerWrapper(Function):
     """
     Wrapper that applies a local minimization process to the observations \
     returned by a :class:`Function`.
     """
 
-    def __init__(self, function: Function, *args, **kwargs):
+    def __init__(
+        self,
+        function: Function,
+        n_workers: int = 1,
+        n_refine: int = None,
+        refine: str = "best",
+        batched: bool = False,
+        *args,
+        **kwargs
+    ):
         """
         Initialize a :class:`MinimizerWrapper`.
 
         Args:
             function: :class:`Function` to be minimized after each step.
-            *args: Passed to the internal :class:`Optimizer`.
-            **kwargs: Passed to the internal :class:`Optimizer`.
+            n_workers: Number of processes used to minimize the points. If it \
+                       is 1 the points are minimized in the current process, \
+                       and if it is ``None`` one process per cpu will be used.
+            n_refine: Number of walkers minimized after each step. If ``None`` \
+                      all the walkers will be minimized.
+            refine: How to choose the walkers that are minimized when \
+                    ``n_refine`` is not ``None``. "best" chooses the walkers \
+                    with the lowest values of the function, and "random" \
+                    samples them uniformly.
+            batched: If ``True`` use a :class:`BatchedMinimizer` that minimizes \
+                     all the points together in the current process. \
+                     ``n_workers`` is ignored in that case.
+            *args: Passed to the internal :class:`Minimizer`.
+            **kwargs: Passed to the internal :class:`Minimizer`.
         """
+        if refine not in ("best", "random"):
+            raise ValueError("refine must be 'best' or 'random', got {}".format(refine))
         self.env = function
-        self.minimizer = Minimizer(function=self.env, *args, **kwargs)
+        self.n_refine = n_refine
+        self.refine = refine
+        if batched:
+            self.minimizer = BatchedMinimizer(function=self.env, *args, **kwargs)
+        elif n_workers == 1:
+            self.minimizer = Minimizer(function=self.env, *args, **kwargs)
+        else:
+            self.minimizer = ParallelMinimizer(
+                function=self.env, n_workers=n_workers, *args, **kwargs
+            )
+
+    def _refined_indexes(self, rewards: numpy.ndarray) -> numpy.ndarray:
+        """Return the indexes of the walkers that will be minimized."""
+        n_walkers = len(rewards)
+        if self.n_refine is None or self.n_refine >= n_walkers:
+            return numpy.arange(n_walkers)
+        elif self.refine == "best":
+            return numpy.argpartition(rewards, self.n_refine - 1)[: self.n_refine]
+        return self.random_state.choice(n_walkers, size=self.n_refine, replace=False)
 
     def __getattr__(self, item):
         return getattr(self.env, item)
@@ -276,7 +797,9 @@ class MinimizerWrapper(Function):
     def __repr__(self):
         return self.env.__repr__()
 
-    def step(self, model_states: StatesModel, env_states: StatesEnv) -> StatesEnv:
+    def step(
+        self, model_states: StatesModel, env_states: StatesEnv, out: StatesEnv = None
+    ) -> StatesEnv:
         """
         Perform a local optimization process to the observations returned after \
         calling ``step`` on the wrapped :class:`Function`.
@@ -285,15 +808,21 @@ class MinimizerWrapper(Function):
             model_states: :class:`StatesModel` corresponding to the :class:`Model` data.
             env_states: :class:`StatesEnv` containing the data where the function \
              will be evaluated.
+            out: Preallocated :class:`StatesEnv` where the new data will be written.
 
         Returns:
             States containing the information that describes the new state of \
             the :class:`Function`.
         """
         env_states = super(MinimizerWrapper, self).step(
-            model_states=model_states, env_states=env_states
+            model_states=model_states, env_states=env_states, out=out
         )
-        new_points, rewards = self.minimizer.minimize_batch(env_states.observs)
+        refined = self._refined_indexes(env_states.rewards)
+        new_points = numpy.array(env_states.observs)
+        rewards = numpy.array(env_states.rewards, dtype=numpy.float64)
+        refined_points, refined_rewards = self.minimizer.minimize_batch(new_points[refined])
+        new_points[refined] = refined_points
+        rewards[refined] = refined_rewards.ravel()
         ends = numpy.logical_not(self.bounds.points_in_bounds(new_points)).flatten()
         updated_states = self.states_from_data(
             states=new_points,
@@ -301,5 +830,6 @@ class MinimizerWrapper(Function):
             rewards=rewards.flatten(),
             ends=ends,
             batch_size=model_states.n,
+            out=out,
         )
         return updated_states
@@ -1,15 +1,24 @@
 import atexit
+import itertools
+import os
 import warnings
 
 warnings.filterwarnings("ignore")
 import multiprocessing
+from multiprocessing import connection, resource_tracker, shared_memory
 import sys
+import time
 import traceback
-from typing import Callable
+from typing import Any, Callable, List, Tuple
 
 import numpy as np
-import ray
 
+try:
+    import ray
+except ImportError:
+    ray = None
+
+from fragile.core.env import DiscreteEnv
 from fragile.core.states import States
 from fragile.optimize.env import Function as SequentialFunction
 
@@ -20,13 +29,135 @@ def split_similar_chunks(vector: list, n_chunks: int):
         yield vector[i : i + chunk_size]
 
 
-@ray.remote
-class RemoteFunction:
-    def __init__(self, env_callable: Callable):
-        self.function = env_callable().function
+if ray is not None:
+
+    @ray.remote
+    class RemoteFunction:
+        def __init__(self, env_callable: Callable):
+            self.function = env_callable().function
+
+        def function(self, points: np.ndarray):
+            return self.function(points)
+
 
-    def function(self, points: np.ndarray):
-        return self.function(points)
+class AdaptiveChunks:
+    """
+    Choose the number of items of each task that a :class:`BatchEnv` sends \
+    to its workers.
+
+    The chunks get smaller as the batch runs out of items, so the slow tasks \
+    at the end of a batch can be balanced across the idle workers. When the \
+    time needed to process an item is known, the chunks are also limited to \
+    take around ``target_time`` seconds, and the batch is split evenly across \
+    the workers if each of them would need less than ``target_time`` to finish.
+    """
+
+    def __init__(
+        self,
+        n_workers: int,
+        target_time: float = 0.05,
+        tasks_per_worker: int = 4,
+        smoothing: float = 0.3,
+    ):
+        """
+        Initialize a :class:`AdaptiveChunks`.
+
+        Args:
+            n_workers: Number of workers that process the tasks.
+            target_time: Number of seconds that each task should take.
+            tasks_per_worker: Minimum number of tasks per worker that the \
+                              remaining items will be divided in.
+            smoothing: Weight of the last measurement in the moving average \
+                       of the time needed to process an item.
+        """
+        self.n_workers = n_workers
+        self.target_time = target_time
+        self.tasks_per_worker = tasks_per_worker
+        self.smoothing = smoothing
+        self.latency = None
+
+    def chunk_size(self, n_remaining: int, n_items: int = None) -> int:
+        """
+        Return the number of items of the next task.
+
+        Args:
+            n_remaining: Number of items of the batch that have not been assigned.
+            n_items: Total number of items of the batch. Defaults to ``n_remaining``.
+
+        Returns:
+            Number of items of the next task.
+        """
+        n_items = n_remaining if n_items is None else n_items
+        even = int(np.ceil(n_items / self.n_workers))
+        if self.latency is not None and even * self.latency <= self.target_time:
+            # Splitting the items further would cost more than the time it balances
+            return max(even, 1)
+        guided = int(np.ceil(n_remaining / (self.tasks_per_worker * self.n_workers)))
+        if self.latency:
+            guided = min(guided, int(self.target_time / self.latency))
+        return max(guided, 1)
+
+    def update(self, n_items: int, elapsed: float) -> None:
+        """Update the time needed to process an item with the time that a task took."""
+        latency = elapsed / n_items
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self.smoothing * (latency - self.latency)
+
+
+class SharedBatch:
+    """
+    Batch of points and their rewards stored in a shared memory block.
+
+    The worker processes attach to the block by its name, so the points and \
+    the rewards are exchanged without pickling them.
+    """
+
+    def __init__(self, n_points: int, point_shape: tuple, dtype):
+        """
+        Initialize a :class:`SharedBatch`.
+
+        Args:
+            n_points: Maximum number of points that the batch can store.
+            point_shape: Shape of each point.
+            dtype: Data type of the points.
+        """
+        self.n_points = n_points
+        self.point_shape = tuple(point_shape)
+        self.dtype = np.dtype(dtype)
+        points_size = n_points * int(np.prod(self.point_shape)) * self.dtype.itemsize
+        self.memory = shared_memory.SharedMemory(
+            create=True, size=max(points_size + 8 * n_points, 1)
+        )
+        self.points, self.rewards = self.arrays(self.memory.buf, *self.spec[1:])
+
+    @property
+    def spec(self) -> Tuple:
+        """Return the data needed to attach to the batch from another process."""
+        return self.memory.name, self.n_points, self.point_shape, self.dtype.str
+
+    @staticmethod
+    def arrays(buffer, n_points: int, point_shape: tuple, dtype) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the points and rewards arrays stored in a shared memory buffer."""
+        points = np.ndarray((n_points,) + tuple(point_shape), dtype=dtype, buffer=buffer)
+        rewards = np.ndarray((n_points,), dtype=np.float64, buffer=buffer, offset=points.nbytes)
+        return points, rewards
+
+    def fits(self, points: np.ndarray) -> bool:
+        """Return ``True`` if the batch can store the target points."""
+        return (
+            len(points) <= self.n_points
+            and points.shape[1:] == self.point_shape
+            and points.dtype == self.dtype
+        )
+
+    def close(self):
+        """Release the shared memory block."""
+        # The block cannot be closed while there are arrays pointing to it
+        self.points, self.rewards = None, None
+        self.memory.close()
+        self.memory.unlink()
 
 
 class ExternalProcess(object):
@@ -57,9 +188,13 @@ class ExternalProcess(object):
     _RESULT = 3
     _EXCEPTION = 4
     _CLOSE = 5
+    _SHARED_CALL = 6
 
     def __init__(self, constructor):
 
+        # Share the resource tracker of this process with the worker, so the shared
+        # memory blocks that it attaches to are not reported as leaked when it exits.
+        resource_tracker.ensure_running()
         self._conn, conn = multiprocessing.Pipe()
         self._process = multiprocessing.Process(target=self._worker, args=(constructor, conn))
         atexit.register(self.close)
@@ -106,6 +241,34 @@ class ExternalProcess(object):
             pass
         self._process.join()
 
+    @property
+    def connection(self):
+        """Connection used to receive the results of the worker process."""
+        return self._conn
+
+    def step_shared(self, spec: Tuple, start: int, stop: int, blocking: bool = False):
+        """
+        Evaluate the points ``start:stop`` of a :class:`SharedBatch` and write \
+        their rewards in it.
+
+        Only the specification of the batch and the slice cross the pipe.
+
+        Args:
+            spec: :attr:`SharedBatch.spec` of the target batch.
+            start: Index of the first point that will be evaluated.
+            stop: Index after the last point that will be evaluated.
+            blocking: If True, wait until the rewards are written.
+
+        Returns:
+            ``None`` if blocking is True, otherwise a promise that blocks until \
+            the rewards are written.
+        """
+        self._conn.send((self._SHARED_CALL, (spec, start, stop)))
+        if blocking:
+            return self._receive()
+        else:
+            return self._receive
+
     def step_batch(self, points: np.ndarray, blocking: bool = False):
         """
         Vectorized version of the `step` method. It allows to step a vector of
@@ -153,16 +316,28 @@ class ExternalProcess(object):
         Raises:
           KeyError: When receiving a message of unknown type.
         """
+        # Shared memory blocks attached by the worker, indexed by name
+        blocks = {}
         try:
             env = constructor()
             while True:
                 try:
-                    # Only block for short times to have keyboard exceptions be raised.
-                    if not conn.poll(0.1):
-                        continue
                     message, payload = conn.recv()
                 except (EOFError, KeyboardInterrupt):
                     break
+                if message == self._SHARED_CALL:
+                    spec, start, stop = payload
+                    name = spec[0]
+                    if name not in blocks:
+                        # A new block means that the previous ones are not used anymore
+                        for block in blocks.values():
+                            block.close()
+                        blocks = {name: shared_memory.SharedMemory(name=name)}
+                    points, rewards = SharedBatch.arrays(blocks[name].buf, *spec[1:])
+                    rewards[start:stop] = np.ravel(env.function(points[start:stop]))
+                    del points, rewards
+                    conn.send((self._RESULT, None))
+                    continue
                 if message == self._ACCESS:
                     name = payload
                     result = getattr(env, name)
@@ -181,6 +356,8 @@ class ExternalProcess(object):
             stacktrace = "".join(traceback.format_exception(*sys.exc_info()))
             conn.send((self._EXCEPTION, stacktrace))
             conn.close()
+        for block in blocks.values():
+            block.close()
 
 
 class BatchEnv(object):
@@ -193,17 +370,32 @@ class BatchEnv(object):
         `blocking=False` argument to their step and reset functions that makes them
         return callables instead to receive the result at a later time.
 
+    The batch is split in small tasks that are sent to the environments as \
+    soon as they are idle, so a slow chunk of the batch does not stall the \
+    other environments. The environments can be :class:`ExternalProcess` \
+    instances or ray actors.
+
     Args:
       envs: List of environments.
       blocking: Step environments after another rather than in parallel.
+      use_shared_memory: Exchange the points and rewards with the environments \
+        through a :class:`SharedBatch`. The environments need to be \
+        :class:`ExternalProcess` instances.
+      chunks: :class:`AdaptiveChunks` that chooses the size of the tasks.
 
     Raises:
       ValueError: Environments have different observation or action spaces.
     """
 
-    def __init__(self, envs, blocking):
+    def __init__(
+        self, envs, blocking, use_shared_memory: bool = False, chunks: AdaptiveChunks = None
+    ):
         self._envs = envs
         self._blocking = blocking
+        self._use_shared_memory = use_shared_memory
+        self._batch: SharedBatch = None
+        self._use_ray = ray is not None and isinstance(envs[0], ray.actor.ActorHandle)
+        self.chunks = AdaptiveChunks(n_workers=len(envs)) if chunks is None else chunks
 
     def __len__(self):
         """Number of combined environments."""
@@ -224,89 +416,177 @@ class BatchEnv(object):
         """
         return getattr(self._envs[0], name)
 
-    def _make_transitions(self, points):
-        chunks = len(self._envs)
-        states_chunk = split_similar_chunks(points, n_chunks=chunks)
-        results = [
-            env.step_batch(states_batch) for env, states_batch in zip(self._envs, states_chunk)
-        ]
-        rewards = [result if self._blocking else result() for result in results]
-        return rewards
+    def _wait(self, running: dict) -> List[int]:
+        """Wait until at least one of the running tasks finishes and return its workers."""
+        if self._use_ray:
+            workers = {task[-1]: ix for ix, task in running.items()}
+            ready, _ = ray.wait(list(workers), num_returns=1)
+        else:
+            workers = {self._envs[ix].connection: ix for ix in running}
+            ready = connection.wait(list(workers))
+        return [workers[handle] for handle in ready]
+
+    def run_tasks(self, n_items: int, submit: Callable[[Any, int, int], Any]) -> List[Tuple]:
+        """
+        Process a batch of items splitting it in tasks that are assigned to \
+        the environments as soon as they are idle.
 
-    def step_batch(self, points):
-        """Forward a batch of actions to the wrapped environments.
         Args:
-          actions: Batched action to apply to the environment.
-          states: States to be stepped. If None, act on current state.
-          n_repeat_action: Number of consecutive times the action will be applied.
+            n_items: Number of items of the batch.
+            submit: Callable that receives an environment and the start and \
+                    stop indexes of a task, and starts processing it. It \
+                    returns a promise that blocks until the result is ready, \
+                    or a ray object reference.
 
-        Raises:
-          ValueError: Invalid actions.
+        Returns:
+            List of tuples (start, stop, result) containing the result of each \
+            task, sorted by the index of its first item.
+        """
+        results, running, idle = [], {}, list(range(len(self._envs)))[::-1]
+        start = 0
+        while start < n_items or running:
+            # Only one environment works at a time in blocking mode
+            while idle and start < n_items and not (self._blocking and running):
+                ix = idle.pop()
+                chunk_size = self.chunks.chunk_size(n_items - start, n_items)
+                stop = min(start + chunk_size, n_items)
+                running[ix] = (
+                    start,
+                    stop,
+                    time.perf_counter(),
+                    submit(self._envs[ix], start, stop),
+                )
+                start = stop
+            for ix in self._wait(running):
+                task_start, task_stop, init_time, handle = running.pop(ix)
+                result = ray.get(handle) if self._use_ray else handle()
+                self.chunks.update(task_stop - task_start, time.perf_counter() - init_time)
+                results.append((task_start, task_stop, result))
+                idle.append(ix)
+        return sorted(results, key=lambda x: x[0])
+
+    def _shared_transitions(self, points: np.ndarray) -> np.ndarray:
+        """Evaluate the points writing them and their rewards in a :class:`SharedBatch`."""
+        if self._batch is None or not self._batch.fits(points):
+            if self._batch is not None:
+                self._batch.close()
+            self._batch = SharedBatch(len(points), points.shape[1:], points.dtype)
+        n_points = len(points)
+        self._batch.points[:n_points] = points
+        spec = self._batch.spec
+        self.run_tasks(n_points, lambda env, start, stop: env.step_shared(spec, start, stop))
+        # The batch is overwritten in the next call
+        return self._batch.rewards[:n_points].copy()
+
+    def step_batch(self, points):
+        """
+        Evaluate a batch of points in the wrapped environments.
+
+        Args:
+          points: Points that will be evaluated, stacked across the first dimension.
 
         Returns:
-          Batch of observations, rewards, and done flags.
+          Array containing the reward of each point.
         """
-        rewards = self._make_transitions(points)
-        try:
-            rewards = np.stack(rewards)
-        except BaseException as e:  # Lets be overconfident for once TODO: remove this.
-            for obs in rewards:
-                print(obs.shape)
-        return np.concatenate([r.flatten() for r in rewards])
+        if self._use_shared_memory:
+            return self._shared_transitions(points)
+        if self._use_ray:
+
+            def submit(env, start, stop):
+                return env.function.remote(points[start:stop])
+
+        else:
+
+            def submit(env, start, stop):
+                return env.step_batch(points[start:stop])
+
+        rewards = np.empty(len(points))
+        for start, stop, result in self.run_tasks(len(points), submit):
+            rewards[start:stop] = np.ravel(result)
+        return rewards
 
     def close(self):
         """Send close messages to the external process and join them."""
         for env in self._envs:
             if hasattr(env, "close"):
                 env.close()
+        if self._batch is not None:
+            self._batch.close()
+            self._batch = None
 
 
 class ParallelFunction:
     """
     Wrap any environment to be stepped in parallel when step_batch is called.
 
+    By default the points and the rewards are exchanged with the workers \
+    through shared memory, and only small control messages are sent to them. \
+    If ``use_ray`` is ``True`` the workers are ray actors instead of local processes.
     """
 
-    def __init__(self, env_callable, n_workers: int = 8, blocking: bool = False):
+    def __init__(
+        self,
+        env_callable,
+        n_workers: int = 8,
+        blocking: bool = False,
+        use_shared_memory: bool = True,
+        use_ray: bool = False,
+    ):
         self._env = env_callable()
-        envs = [ExternalProcess(constructor=env_callable) for _ in range(n_workers)]
-        self._batch_env = BatchEnv(envs, blocking)
+        if use_ray:
+            if ray is None:
+                raise ImportError("ray needs to be installed to use ray workers")
+            envs = [RemoteFunction.remote(env_callable) for _ in range(n_workers)]
+            use_shared_memory = False
+        else:
+            envs = [ExternalProcess(constructor=env_callable) for _ in range(n_workers)]
+        self._batch_env = BatchEnv(envs, blocking, use_shared_memory=use_shared_memory)
 
     def __getattr__(self, item):
         return getattr(self._env, item)
 
     def step_batch(self, points: np.ndarray):
         """
-        Vectorized version of the `step` method. It allows to step a vector of
-        states and actions. The signature and behaviour is the same as `step`,
-        but taking a list of states, actions and n_repeat_actions as input.
+        Evaluate the function on a batch of points using the worker processes.
 
         Args:
-            actions: Iterable containing the different actions to be applied.
-            states: Iterable containing the different states to be set.
-            n_repeat_action: int or array containing the frameskips that will be applied.
+            points: Points that will be evaluated, stacked across the first dimension.
 
         Returns:
-            if states is None returns (observs, rewards, ends, infos) else (new_states,
-            observs, rewards, ends, infos)
+            Array containing the value of the function at each point.
 
         """
-        return self._batch_env.step_batch(points=points.copy())
+        return self._batch_env.step_batch(points=points)
+
+    def close(self):
+        """Stop the worker processes and release the shared memory."""
+        self._batch_env.close()
 
 
 class Function(SequentialFunction):
-    def __init__(self, env_callable: Callable, n_workers: int = 1, blocking: bool = False):
+    def __init__(
+        self,
+        env_callable: Callable,
+        n_workers: int = 1,
+        blocking: bool = False,
+        use_shared_memory: bool = True,
+        use_ray: bool = False,
+    ):
         self.n_workers = n_workers
         self.blocking = blocking
         self.parallel_function = ParallelFunction(
-            env_callable=env_callable, n_workers=n_workers, blocking=blocking
+            env_callable=env_callable,
+            n_workers=n_workers,
+            blocking=blocking,
+            use_shared_memory=use_shared_memory,
+            use_ray=use_ray,
         )
         self.local_function = env_callable()
 
     def __getattr__(self, item):
         return getattr(self.local_function, item)
 
-    def step(self, model_states: States, env_states: States) -> States:
+    def step(self, model_states: States, env_states: States, out: States = None) -> States:
         """
         Sets the environment to the target states by applying the specified actions an arbitrary
         number of time steps.
@@ -314,6 +594,7 @@ class Function(SequentialFunction):
         Args:
             model_states: States corresponding to the model data.
             env_states: States class containing the state data to be set on the Environment.
+            out: Preallocated States where the new data will be written.
 
         Returns:
             States containing the information that describes the new state of the Environment.
@@ -326,7 +607,9 @@ class Function(SequentialFunction):
         ends = self.calculate_end(points=new_points)
         rewards = self.parallel_function.step_batch(new_points)
 
-        last_states = self._get_new_states(new_points, rewards, ends, model_states.n)
+        last_states = self.states_from_data(
+            model_states.n, new_points, new_points, rewards, ends, out=out
+        )
         return last_states
 
     def __parallel_function(self, points):
@@ -338,3 +621,106 @@ class Function(SequentialFunction):
         # rewards = self.pool.map(self.local_function.function,
         #                        split_similar_chunks(points, self.n_workers))
         return np.concatenate([r.flatten() for r in rewards])
+
+
+class ParallelPlangymEnv:
+    """
+    Step a ``plangym`` environment in a pool of local worker processes.
+
+    The workers keep their own copy of the environment alive between calls, \
+    and :meth:`step_batch` shards the actions, states and repeated actions \
+    of a batch across them using a :class:`BatchEnv`. The other attributes \
+    are forwarded to a copy of the environment that lives in this process.
+    """
+
+    def __init__(self, env_callable: Callable, n_workers: int = None):
+        """
+        Initialize a :class:`ParallelPlangymEnv`.
+
+        Args:
+            env_callable: Callable that returns an instance of the ``plangym`` \
+                          environment. It is called once in each worker.
+            n_workers: Number of worker processes. Defaults to the number of cores.
+        """
+        self.n_workers = os.cpu_count() if n_workers is None else n_workers
+        self._env = env_callable()
+        envs = [ExternalProcess(constructor=env_callable) for _ in range(self.n_workers)]
+        self._batch_env = BatchEnv(envs, blocking=False)
+        self._reset_workers()
+
+    def __getattr__(self, item):
+        return getattr(self._env, item)
+
+    def _reset_workers(self):
+        """Reset the environments of all the workers in parallel."""
+        for promise in [env.call("reset") for env in self._batch_env]:
+            promise()
+
+    def reset(self, *args, **kwargs):
+        """Reset the environments of the workers and return the reset of the local one."""
+        self._reset_workers()
+        return self._env.reset(*args, **kwargs)
+
+    def step_batch(self, actions, states=None, n_repeat_action=None) -> tuple:
+        """
+        Step a batch of states applying the target actions in the worker processes.
+
+        Args:
+            actions: Actions that will be applied to each state.
+            states: States that will be set in the environment before acting.
+            n_repeat_action: Number of times each action will be applied. It \
+                             can be an array containing a value for each state.
+
+        Returns:
+            Tuple (new_states, observs, rewards, ends, infos) in the same order \
+            as the actions. If ``states`` is ``None`` the ``new_states`` are not returned.
+        """
+
+        def submit(env, start, stop):
+            dts = n_repeat_action
+            if isinstance(dts, np.ndarray):
+                dts = dts[start:stop]
+            chunk_states = None if states is None else states[start:stop]
+            return env.call(
+                "step_batch",
+                actions=actions[start:stop],
+                states=chunk_states,
+                n_repeat_action=dts,
+            )
+
+        results = self._batch_env.run_tasks(len(actions), submit)
+        # Join the values of each field returned by the tasks
+        return tuple(
+            list(itertools.chain.from_iterable(values))
+            for values in zip(*[result for _, _, result in results])
+        )
+
+    def close(self):
+        """Stop the worker processes."""
+        self._batch_env.close()
+
+
+class ParallelDiscreteEnv(DiscreteEnv):
+    """
+    :class:`DiscreteEnv` that steps its walkers in a pool of local worker processes.
+
+    It does not need ray. An :class:`AtariEnv` can be stepped in parallel the \
+    same way passing it a :class:`ParallelPlangymEnv` as environment.
+    """
+
+    def __init__(self, env_callable: Callable, n_workers: int = None):
+        """
+        Initialize a :class:`ParallelDiscreteEnv`.
+
+        Args:
+            env_callable: Callable that returns an instance of the ``plangym`` \
+                          environment. It is called once in each worker.
+            n_workers: Number of worker processes. Defaults to the number of cores.
+        """
+        super(ParallelDiscreteEnv, self).__init__(
+            env=ParallelPlangymEnv(env_callable=env_callable, n_workers=n_workers)
+        )
+
+    def close(self):
+        """Stop the worker processes."""
+        self._env.close()
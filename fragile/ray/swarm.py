@@ -1,26 +1,43 @@
 from collections import deque
 import copy
-from typing import Callable
+import multiprocessing
+from multiprocessing import connection, resource_tracker, shared_memory
+from typing import Callable, Tuple
 import warnings
 
 warnings.filterwarnings("ignore")
 
-import holoviews as hv
-from holoviews.streams import Pipe
-import hvplot.pandas
-import hvplot.streamz
 import numpy as np
-import pandas as pd
-import ray
-from streamz import Stream
-from streamz.dataframe import DataFrame
+
+try:
+    import holoviews as hv
+    from holoviews.streams import Pipe
+    import hvplot.pandas
+    import hvplot.streamz
+    import pandas as pd
+    from streamz import Stream
+    from streamz.dataframe import DataFrame
+except ImportError:
+    hv = None
+    Pipe = None
+
+try:
+    import ray
+except ImportError:
+    ray = None
 
 from fragile.core.swarm import Swarm
-from fragile.core.utils import float_type, relativize
+from fragile.core.utils import float_type, random_state, relativize
+
 
+class IslandSwarm:
+    """
+    Swarm that exchanges walkers with the other islands of a distributed swarm.
+
+    It is run as a Ray actor by :class:`DistributedSwarm` (``RemoteSwarm``), \
+    and inside a local process by :class:`LocalDistributedSwarm`.
+    """
 
-@ray.remote
-class RemoteSwarm:
     def __init__(self, swarm: Callable, n_comp_add: int = 2, minimize: bool = False):
         self.minimize = minimize
         self._swarm_callable = swarm
@@ -144,8 +161,9 @@ class RemoteSwarm:
             raise e
 
 
-@ray.remote
 class ParamServer:
+    """Buffer of walkers sent by the islands that keeps track of the best walker found."""
+
     def __init__(self, maxlen: int = 20, minimize: bool = False):
         self._maxlen = maxlen
         self.minimize = minimize
@@ -185,20 +203,212 @@ class ParamServer:
             self.best = copy.deepcopy((state, obs, reward))
 
 
-class DistributedSwarm:
+if ray is not None:
+    RemoteSwarm = ray.remote(IslandSwarm)
+    RemoteParamServer = ray.remote(ParamServer)
+
+
+class SharedParamServer:
+    """
+    :class:`ParamServer` that stores its buffer of walkers in a shared memory block.
+
+    The block contains a slot for the best walker found, a ring buffer of \\
+    ``maxlen`` walkers, and the number of iterations run by each island. Other \\
+    local processes access it calling :meth:`attach` with its :attr:`spec` \\
+    and its lock, so the walkers are exchanged without pickling them.
+    """
+
+    def __init__(
+        self,
+        state_shape: tuple,
+        state_dtype,
+        obs_shape: tuple,
+        obs_dtype,
+        maxlen: int = 20,
+        minimize: bool = False,
+        n_swarms: int = 1,
+        lock=None,
+        name: str = None,
+    ):
+        """
+        Initialize a :class:`SharedParamServer`.
+
+        Args:
+            state_shape: Shape of the state of a walker.
+            state_dtype: Data type of the states.
+            obs_shape: Shape of the observation of a walker.
+            obs_dtype: Data type of the observations.
+            maxlen: Maximum number of walkers stored in the buffer.
+            minimize: If ``True`` the best walker is the one with the lowest reward.
+            n_swarms: Number of islands that exchange walkers with the param server.
+            lock: ``multiprocessing.Lock`` used to synchronize the accesses \\
+                  to the buffer. If ``None`` a new lock will be created.
+            name: Name of the shared memory block. If ``None`` a new block \\
+                  will be created, otherwise the param server attaches to it.
+        """
+        self.state_shape = tuple(state_shape)
+        self.state_dtype = np.dtype(state_dtype)
+        self.obs_shape = tuple(obs_shape)
+        self.obs_dtype = np.dtype(obs_dtype)
+        if self.state_dtype.hasobject or self.obs_dtype.hasobject:
+            raise TypeError(
+                "SharedParamServer cannot store states of dtype {} and observations of "
+                "dtype {}. Please use DistributedSwarm instead".format(
+                    self.state_dtype, self.obs_dtype
+                )
+            )
+        self.maxlen = maxlen
+        self.minimize = minimize
+        self.n_swarms = n_swarms
+        self.lock = multiprocessing.Lock() if lock is None else lock
+        self._owner = name is None
+        if self._owner:
+            self.memory = shared_memory.SharedMemory(create=True, size=self._block_size())
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.rewards, self.counters, self.iterations, self.states, self.observs = self._arrays()
+
+    @classmethod
+    def attach(cls, spec: Tuple, lock) -> "SharedParamServer":
+        """Attach to the shared memory block of a param server created in another process."""
+        name, *params = spec
+        return cls(*params, lock=lock, name=name)
+
+    @property
+    def spec(self) -> Tuple:
+        """Return the data needed to attach to the param server from another process."""
+        return (
+            self.memory.name,
+            self.state_shape,
+            self.state_dtype.str,
+            self.obs_shape,
+            self.obs_dtype.str,
+            self.maxlen,
+            self.minimize,
+            self.n_swarms,
+        )
+
+    @property
+    def n_stored(self) -> int:
+        """Return the number of walkers stored in the buffer."""
+        return int(self.counters[0])
+
+    def _block_size(self) -> int:
+        n_slots = self.maxlen + 1
+        state_size = int(np.prod(self.state_shape)) * self.state_dtype.itemsize
+        obs_size = int(np.prod(self.obs_shape)) * self.obs_dtype.itemsize
+        return 8 * (n_slots + 3 + self.n_swarms) + n_slots * (state_size + obs_size)
+
+    def _arrays(self) -> Tuple[np.ndarray, ...]:
+        # The 8 bytes arrays go first to keep all the arrays aligned
+        n_slots, buffer = self.maxlen + 1, self.memory.buf
+        rewards = np.ndarray((n_slots,), dtype=np.float64, buffer=buffer)
+        offset = rewards.nbytes
+        # Number of walkers stored, next slot of the ring buffer, and best walker available
+        counters = np.ndarray((3,), dtype=np.int64, buffer=buffer, offset=offset)
+        offset += counters.nbytes
+        iterations = np.ndarray((self.n_swarms,), dtype=np.int64, buffer=buffer, offset=offset)
+        offset += iterations.nbytes
+        states = np.ndarray(
+            (n_slots,) + self.state_shape, dtype=self.state_dtype, buffer=buffer, offset=offset
+        )
+        offset += states.nbytes
+        observs = np.ndarray(
+            (n_slots,) + self.obs_shape, dtype=self.obs_dtype, buffer=buffer, offset=offset
+        )
+        return rewards, counters, iterations, states, observs
+
+    def _empty_walker(self):
+        return None, None, np.inf if self.minimize else -np.inf
+
+    def _read_walker(self, ix: int):
+        return self.states[ix].copy(), self.observs[ix].copy(), float(self.rewards[ix])
+
+    def _write_walker(self, ix: int, walker):
+        state, obs, reward = walker
+        self.states[ix] = state
+        self.observs[ix] = obs
+        self.rewards[ix] = reward
+
+    def get_best(self):
+        with self.lock:
+            return self._read_walker(0) if self.counters[2] else self._empty_walker()
+
+    def reset(self):
+        with self.lock:
+            self.counters[:] = 0
+            self.iterations[:] = 0
+
+    def exchange_walker(self, walker):
+        with self.lock:
+            if walker is not None and walker[0] is not None:
+                self._append_walker(walker)
+            return self._get_walker()
+
+    def append_walker(self, walker):
+        with self.lock:
+            self._append_walker(walker)
+
+    def get_walker(self):
+        with self.lock:
+            return self._get_walker()
+
+    def _append_walker(self, walker):
+        # Slot 0 is reserved for the best walker
+        self._write_walker(1 + self.counters[1], walker)
+        self.counters[1] = (self.counters[1] + 1) % self.maxlen
+        self.counters[0] = min(self.counters[0] + 1, self.maxlen)
+        reward, best_reward = walker[2], self.rewards[0]
+        is_best = reward <= best_reward if self.minimize else reward >= best_reward
+        if not self.counters[2] or is_best:
+            self._write_walker(0, walker)
+            self.counters[2] = 1
+
+    def _get_walker(self):
+        if self.counters[0] == 0:
+            return self._empty_walker(), self._empty_walker()
+        ix = 1 + np.random.randint(self.counters[0])
+        return self._read_walker(0), self._read_walker(ix)
+
+    def close(self):
+        """Release the shared memory block. It is destroyed if this instance created it."""
+        # The block cannot be closed while there are arrays pointing to it
+        self.rewards, self.counters, self.iterations, self.states, self.observs = [None] * 5
+        self.memory.close()
+        if self._owner:
+            self.memory.unlink()
+
+
+class BaseDistributedSwarm:
+    """Keep track of the progress of the islands of a distributed swarm and plot it."""
+
     def __init__(
         self,
-        swarm: Callable,
         n_swarms: int,
-        n_param_servers: int,
-        max_iters_ray: int = 10,
         log_every: int = 100,
-        n_comp_add: int = 5,
         minimize: bool = False,
-        ps_maxlen: int = 100,
         init_reward: float = None,
         log_reward: bool = False,
+        plot: bool = None,
     ):
+        """
+        Initialize a :class:`BaseDistributedSwarm`.
+
+        Args:
+            n_swarms: Number of swarms (islands) that will be run.
+            log_every: Number of iterations of every swarm between updates \\
+                       of the best walker found.
+            minimize: If ``True`` the best walker is the one with the lowest reward.
+            init_reward: Value used to clip the plotted rewards.
+            log_reward: Plot the logarithm of the reward.
+            plot: Stream the best walker found to holoviews plots. If ``None`` \\
+                  the plots will be created only if holoviews is installed.
+        """
+        if plot and hv is None:
+            raise ImportError(
+                "Plotting the progress needs holoviews, hvplot, pandas and streamz. "
+                "Please install them or set plot=False"
+            )
         self.n_swarms = n_swarms
         self.minimize = minimize
         self.log = log_reward
@@ -206,20 +416,14 @@ class DistributedSwarm:
             init_reward if init_reward is not None else (np.inf if minimize else -np.inf)
         )
         self.log_every = log_every
-        self.param_servers = [
-            ParamServer.remote(minimize=minimize, maxlen=ps_maxlen) for _ in range(n_param_servers)
-        ]
-        self.swarms = [
-            RemoteSwarm.remote(copy.copy(swarm), int(n_comp_add), minimize=minimize)
-            for _ in range(self.n_swarms)
-        ]
-        self.max_iters_ray = max_iters_ray
+        self.plot_progress = hv is not None if plot is None else plot
         self.frame_pipe: Pipe = None
         self.stream = None
         self.buffer_df = None
         self.score_dmap = None
         self.frame_dmap = None
-        self.init_plot()
+        if self.plot_progress:
+            self.init_plot()
         self.n_iters = 0
         self.best = (None, None, None)
 
@@ -245,6 +449,56 @@ class DistributedSwarm:
         obs = observation.reshape((210, 160, 3)).astype(np.uint8)
         self.frame_pipe.send(obs)
 
+    def update_best(self, state, best_obs, best_reward):
+        """Store the best walker found and stream it to the plots."""
+        self.best = (state, best_obs, float(best_reward))
+        if not self.plot_progress:
+            return
+        if (best_reward > self.init_reward) if self.minimize else (best_reward < self.init_reward):
+            best_reward = self.init_reward
+        best_reward = np.log(best_reward) if self.log else best_reward
+        self.stream_progress(state, best_obs, best_reward)
+
+
+class DistributedSwarm(BaseDistributedSwarm):
+    """Island model that runs each swarm and param server as a Ray actor."""
+
+    def __init__(
+        self,
+        swarm: Callable,
+        n_swarms: int,
+        n_param_servers: int,
+        max_iters_ray: int = 10,
+        log_every: int = 100,
+        n_comp_add: int = 5,
+        minimize: bool = False,
+        ps_maxlen: int = 100,
+        init_reward: float = None,
+        log_reward: bool = False,
+        plot: bool = None,
+    ):
+        if ray is None:
+            raise ImportError(
+                "DistributedSwarm needs ray. Please install it or use LocalDistributedSwarm"
+            )
+        super(DistributedSwarm, self).__init__(
+            n_swarms=n_swarms,
+            log_every=log_every,
+            minimize=minimize,
+            init_reward=init_reward,
+            log_reward=log_reward,
+            plot=plot,
+        )
+        self.param_servers = [
+            RemoteParamServer.remote(minimize=minimize, maxlen=ps_maxlen)
+            for _ in range(n_param_servers)
+        ]
+        self.swarms = [
+            RemoteSwarm.remote(copy.copy(swarm), int(n_comp_add), minimize=minimize)
+            for _ in range(self.n_swarms)
+        ]
+        self.max_iters_ray = max_iters_ray
+
     def run_swarm(self):
         self.n_iters = 0
         best_ids = [s.reset.remote() for s in self.swarms]
@@ -274,14 +528,166 @@ class DistributedSwarm:
                 id_, _ = ray.wait([param_servers[-1].get_best.remote()])
                 (state, best_obs, best_reward) = ray.get(id_)[0]
                 if state is not None:
-                    self.best = (state, best_obs, float(best_reward))
-                    if (
-                        (best_reward > self.init_reward)
-                        if self.minimize
-                        else (best_reward < self.init_reward)
-                    ):
-                        best_reward = self.init_reward
-                    best_reward = np.log(best_reward) if self.log else best_reward
-                    self.stream_progress(state, best_obs, best_reward)
+                    self.update_best(state, best_obs, best_reward)
                 else:
                     print("skipping, not ready")
+
+
+def _run_island(
+    swarm: Callable,
+    spec: Tuple,
+    lock,
+    index: int,
+    max_iters: int,
+    n_comp_add: int,
+    minimize: bool,
+    seed: int,
+):
+    """Run one island of a :class:`LocalDistributedSwarm` in the current process."""
+    # The forked processes inherit the random state of the parent
+    random_state.seed(seed)
+    np.random.seed(seed)
+    param_server = SharedParamServer.attach(spec, lock)
+    try:
+        island = IslandSwarm(swarm, n_comp_add=n_comp_add, minimize=minimize)
+        walkers = island.reset()
+        for _ in range(max_iters):
+            best = island.make_iteration(walkers)
+            walkers = param_server.exchange_walker(best)
+            param_server.iterations[index] += 1
+    finally:
+        param_server.close()
+
+
+class LocalDistributedSwarm(BaseDistributedSwarm):
+    """
+    Island model that runs each swarm in a local process.
+
+    It follows the same semantics as :class:`DistributedSwarm`, but the \\
+    islands exchange their walkers through a :class:`SharedParamServer`, so \\
+    it does not need Ray and it can use all the cores of one machine.
+    """
+
+    def __init__(
+        self,
+        swarm: Callable,
+        n_swarms: int = None,
+        max_iters: int = 10,
+        log_every: int = 100,
+        n_comp_add: int = 5,
+        minimize: bool = False,
+        ps_maxlen: int = 100,
+        init_reward: float = None,
+        log_reward: bool = False,
+        plot: bool = None,
+        seed: int = None,
+        poll_interval: float = 0.1,
+    ):
+        """
+        Initialize a :class:`LocalDistributedSwarm`.
+
+        Args:
+            swarm: Callable that returns the :class:`Swarm` run in each island.
+            n_swarms: Number of islands. If ``None`` it will be the number of cpus.
+            max_iters: Number of iterations run by each island.
+            log_every: Number of iterations of every swarm between updates \\
+                       of the best walker found.
+            n_comp_add: Number of walkers that are compared to the walkers \\
+                        received from the param server.
+            minimize: If ``True`` the best walker is the one with the lowest reward.
+            ps_maxlen: Maximum number of walkers stored in the param server.
+            init_reward: Value used to clip the plotted rewards.
+            log_reward: Plot the logarithm of the reward.
+            plot: Stream the best walker found to holoviews plots. If ``None`` \\
+                  the plots will be created only if holoviews is installed.
+            seed: Seed of the first island. The islands are seeded with \\
+                  consecutive values. If ``None`` the seeds will be sampled \\
+                  from ``fragile.core.utils.random_state``.
+            poll_interval: Seconds between updates of the progress of the islands.
+        """
+        n_swarms = multiprocessing.cpu_count() if n_swarms is None else n_swarms
+        super(LocalDistributedSwarm, self).__init__(
+            n_swarms=n_swarms,
+            log_every=log_every,
+            minimize=minimize,
+            init_reward=init_reward,
+            log_reward=log_reward,
+            plot=plot,
+        )
+        self.swarm_callable = swarm
+        self.max_iters = max_iters
+        self.n_comp_add = int(n_comp_add)
+        self.seed = seed
+        self.poll_interval = poll_interval
+        # Build one swarm to know the size of the walkers stored in the param server
+        probe = swarm()
+        probe.reset()
+        states, observs = probe.walkers.env_states.states, probe.walkers.env_states.observs
+        self.param_server = SharedParamServer(
+            state_shape=states.shape[1:],
+            state_dtype=states.dtype,
+            obs_shape=observs.shape[1:],
+            obs_dtype=observs.dtype,
+            maxlen=ps_maxlen,
+            minimize=minimize,
+            n_swarms=self.n_swarms,
+        )
+
+    def run_swarm(self):
+        self.n_iters = 0
+        self.param_server.reset()
+        seeds = (
+            random_state.randint(0, 2 ** 31, size=self.n_swarms)
+            if self.seed is None
+            else self.seed + np.arange(self.n_swarms)
+        )
+        # Share the resource tracker with the islands, so the shared memory
+        # block is not reported as leaked when they exit.
+        resource_tracker.ensure_running()
+        processes = [
+            multiprocessing.Process(
+                target=_run_island,
+                args=(
+                    self.swarm_callable,
+                    self.param_server.spec,
+                    self.param_server.lock,
+                    index,
+                    self.max_iters,
+                    self.n_comp_add,
+                    self.minimize,
+                    int(seed),
+                ),
+            )
+            for index, seed in enumerate(seeds)
+        ]
+        try:
+            for process in processes:
+                process.start()
+            logged = -1
+            running = [process.sentinel for process in processes]
+            while running:
+                ready = connection.wait(running, timeout=self.poll_interval)
+                running = [sentinel for sentinel in running if sentinel not in ready]
+                self.n_iters = int(self.param_server.iterations.sum())
+                if self.n_iters // (self.log_every * self.n_swarms) > logged:
+                    logged = self.n_iters // (self.log_every * self.n_swarms)
+                    self._update_best_from_server()
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+                if process.pid is not None:
+                    process.join()
+        failed = [index for index, process in enumerate(processes) if process.exitcode != 0]
+        if failed:
+            raise RuntimeError("The islands {} exited with errors".format(failed))
+        self._update_best_from_server()
+
+    def _update_best_from_server(self):
+        state, best_obs, best_reward = self.param_server.get_best()
+        if state is not None:
+            self.update_best(state, best_obs, best_reward)
+
+    def close(self):
+        """Release the shared memory of the param server."""
+        self.param_server.close()
@@ -0,0 +1,5 @@
+import os
+
+# The tests of fragile.ray fork worker processes after the numba kernels have run. Forking
+# once the TBB threading layer of numba is running makes the test process hang at exit.
+os.environ.setdefault("NUMBA_THREADING_LAYER", "workqueue")
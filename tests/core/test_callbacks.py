@@ -0,0 +1,101 @@
+import numpy
+import pytest
+
+from fragile.core.callbacks import PHASES, SwarmCallback, SwarmMetrics
+from fragile.core.tree import HistoryTree
+from fragile.optimize.benchmarks import Rastrigin
+from fragile.optimize.swarm import FunctionMapper
+
+
+class RecordCallback(SwarmCallback):
+    def __init__(self):
+        self.events = []
+
+    def on_reset(self, swarm):
+        self.events.append("reset")
+
+    def on_step_start(self, swarm):
+        self.events.append("step_start")
+
+    def on_phase_end(self, swarm, phase, elapsed):
+        assert elapsed >= 0
+        self.events.append(phase)
+
+    def on_step_end(self, swarm, elapsed):
+        self.events.append("step_end")
+
+
+def create_swarm(**kwargs):
+    return FunctionMapper(
+        env=lambda: Rastrigin(shape=(2,)), n_walkers=10, max_iters=5, tree=HistoryTree, **kwargs
+    )
+
+
+@pytest.fixture()
+def swarm():
+    return create_swarm()
+
+
+class TestSwarmCallbacks:
+    def test_no_callbacks_no_instrumentation(self, swarm):
+        assert swarm.callbacks == []
+        assert "run_step" not in swarm.__dict__
+        assert "calculate_distances" not in swarm.walkers.__dict__
+        assert swarm.metrics == {}
+
+    def test_phases_are_notified(self):
+        callback = RecordCallback()
+        swarm = create_swarm(callbacks=[callback])
+        swarm.reset()
+        assert callback.events[-1] == "reset"
+        callback.events = []
+        swarm.run_step()
+        assert callback.events[0] == "step_start"
+        assert callback.events[-1] == "step_end"
+        for phase in PHASES:
+            assert phase in callback.events, phase
+
+    def test_remove_callback(self, swarm):
+        methods = {"run_step": swarm.run_step, "distances": swarm.walkers.calculate_distances}
+        callback = RecordCallback()
+        swarm.add_callback(callback)
+        assert "run_step" in swarm.__dict__
+        swarm.remove_callback(callback)
+        assert swarm.callbacks == []
+        assert "run_step" not in swarm.__dict__
+        assert "calculate_distances" not in swarm.walkers.__dict__
+        assert swarm.run_step == methods["run_step"]
+        assert swarm.walkers.calculate_distances == methods["distances"]
+        swarm.run_swarm()
+        assert callback.events == []
+        # The Swarm can be instrumented again
+        swarm.add_callback(callback)
+        swarm.run_step()
+        assert callback.events[-1] == "step_end"
+
+    def test_metrics(self, swarm):
+        metrics = SwarmMetrics(track_allocations=True)
+        swarm.add_callback(metrics)
+        swarm.run_swarm()
+        values = swarm.metrics
+        assert values["steps"] == swarm.epoch
+        assert values["step_time"] > 0
+        assert values["walkers_cloned"] > 0
+        assert values["bytes_copied"] >= values["walkers_cloned"]
+        assert values["hash_collisions"] == 0
+        assert values["allocated_bytes"] > 0
+        assert set(values["phase_times"].keys()) == set(PHASES.keys())
+        assert sum(values["phase_times"].values()) <= values["step_time"]
+
+    def test_count_collisions(self, swarm):
+        swarm.reset()
+        walkers = swarm.walkers
+        walkers.env_states.states[:] = numpy.arange(walkers.n).reshape(-1, 1)
+        walkers.env_states.states[3] = walkers.env_states.states[2]
+        walkers.states.id_walkers[:] = numpy.arange(walkers.n)
+        assert SwarmMetrics.count_collisions(walkers) == 0
+        # Same id and same state is not a collision
+        walkers.states.id_walkers[3] = walkers.states.id_walkers[2]
+        assert SwarmMetrics.count_collisions(walkers) == 0
+        walkers.states.id_walkers[1] = walkers.states.id_walkers[0]
+        assert SwarmMetrics.count_collisions(walkers) == 1
@@ -0,0 +1,97 @@
+import numpy
+import pytest
+
+from fragile.core.distances import (
+    Downsample,
+    get_distance_function,
+    hamming_distance,
+    l1_distance,
+    l2_distance,
+    pairwise_distances,
+    RandomProjection,
+)
+from fragile.core.walkers import Walkers
+
+
+def reference_distances(x, y):
+    diff = x.reshape(len(x), -1).astype(numpy.float64) - y.reshape(len(y), -1)
+    return {
+        l2_distance: numpy.linalg.norm(diff, axis=1),
+        l1_distance: numpy.abs(diff).sum(axis=1),
+        hamming_distance: (diff != 0).sum(axis=1),
+    }
+
+
+distance_functions = [l2_distance, l1_distance, hamming_distance]
+
+
+class TestDistances:
+    @pytest.mark.parametrize("distance", distance_functions)
+    @pytest.mark.parametrize("dtype", [numpy.float32, numpy.uint8, numpy.int8, numpy.int64])
+    def test_matches_reference(self, distance, dtype):
+        random_state = numpy.random.RandomState(160290)
+        x = (random_state.random_sample((20, 4, 4, 3)) * 255).astype(dtype)
+        y = (random_state.random_sample((20, 4, 4, 3)) * 255).astype(dtype)
+        target = reference_distances(x, y)[distance]
+        # A small chunk size forces the rows to be processed in several chunks
+        result = distance(x, y, chunk_bytes=256)
+        assert result.shape == (20,)
+        assert numpy.allclose(result, target, rtol=1e-5)
+
+    @pytest.mark.parametrize("distance", distance_functions + [lambda x, y: (x - y).sum(1)])
+    def test_pairwise_distances(self, distance):
+        random_state = numpy.random.RandomState(160290)
+        observs = random_state.random_sample((10, 3)).astype(numpy.float32)
+        compas_ix = random_state.permutation(10)
+        target = distance(observs, observs[compas_ix])
+        assert numpy.allclose(pairwise_distances(distance, observs, compas_ix), target)
+
+    def test_get_distance_function(self):
+        assert get_distance_function(None) is l2_distance
+        assert get_distance_function("hamming") is hamming_distance
+        assert get_distance_function(l1_distance) is l1_distance
+        with pytest.raises(ValueError):
+            get_distance_function("cosine")
+
+
+class TestEmbeddings:
+    def test_random_projection(self):
+        observs = numpy.random.randint(0, 255, (10, 8, 8, 3)).astype(numpy.uint8)
+        projection = RandomProjection(n_components=16, seed=1)
+        embedding = projection(observs)
+        assert embedding.shape == (10, 16)
+        assert embedding.dtype == numpy.float32
+        assert (projection(observs) == embedding).all()
+
+    def test_downsample(self):
+        observs = numpy.random.randint(0, 255, (10, 8, 8, 3)).astype(numpy.uint8)
+        embedding = Downsample(factor=2)(observs)
+        assert embedding.dtype == numpy.uint8
+        assert (embedding == observs[:, ::2, ::2].reshape(10, -1)).all()
+
+    def test_walkers_cache_embedding(self):
+        env_params = {
+            "states": {"size": (3,), "dtype": numpy.int64},
+            "observs": {"size": (8, 8, 3), "dtype": numpy.uint8},
+            "rewards": {"dtype": numpy.float32},
+            "ends": {"dtype": numpy.bool_},
+        }
+        walkers = Walkers(
+            n_walkers=10,
+            env_state_params=env_params,
+            model_state_params={"actions": {"dtype": numpy.int64}},
+            distance_function="l1",
+            distance_embedding=Downsample(factor=4),
+        )
+        walkers.reset()
+        walkers.env_states.observs[:] = numpy.random.randint(0, 255, (10, 8, 8, 3))
+        walkers.calculate_distances()
+        embedding = walkers.observs_embedding
+        assert embedding.shape == (10, 12)
+        assert "observs_embedding" not in walkers.env_states.keys()
+        assert walkers.states.distances.shape == (10,)
+        # The embedding is reused until the observations change
+        walkers.calculate_distances()
+        assert walkers.observs_embedding is embedding
+        walkers.update_states(env_states=walkers.env_states.copy())
+        assert walkers.observs_embedding is not embedding
@@ -0,0 +1,194 @@
+import numpy
+import pytest
+
+from fragile.core.kernels import (
+    _clone_rows_numba,
+    clone_indexes,
+    clone_rows,
+    flip_values,
+    hash_rows,
+    lennard_jones_energy,
+    virtual_reward,
+    warmup_kernels,
+)
+from fragile.core.utils import relativize
+
+shapes = [(10,), (10, 3), (10, 4, 4, 3)]
+dtypes = [numpy.float32, numpy.int64, numpy.bool_, numpy.uint8]
+
+
+class TestCloneRows:
+    @pytest.mark.parametrize("backend", ["numpy", "numba"])
+    @pytest.mark.parametrize("dtype", dtypes)
+    @pytest.mark.parametrize("shape", shapes)
+    def test_matches_masked_clone(self, backend, dtype, shape):
+        random_state = numpy.random.RandomState(160290)
+        array = (random_state.random_sample(shape) * 100).astype(dtype)
+        will_clone = random_state.random_sample(shape[0]) > 0.5
+        # Companions overlap with the cloning walkers, so the kernel has to stage them.
+        compas_ix = random_state.permutation(shape[0])
+        target = array.copy()
+        target[will_clone] = target[compas_ix][will_clone]
+        clone_ix, source_ix = clone_indexes(will_clone, compas_ix)
+        clone_rows(array, clone_ix, source_ix, backend=backend)
+        assert (array == target).all()
+
+    def test_clone_indexes(self):
+        will_clone = numpy.array([False, True, False, True])
+        compas_ix = numpy.array([3, 2, 1, 0])
+        clone_ix, source_ix = clone_indexes(will_clone, compas_ix)
+        assert (clone_ix == numpy.array([1, 3])).all()
+        assert (source_ix == numpy.array([2, 0])).all()
+
+    @pytest.mark.parametrize("backend", ["numpy", "numba"])
+    def test_no_clones(self, backend):
+        array = numpy.arange(5)
+        clone_ix, source_ix = clone_indexes(numpy.zeros(5, dtype=bool), numpy.zeros(5, int))
+        clone_rows(array, clone_ix, source_ix, backend=backend)
+        assert (array == numpy.arange(5)).all()
+
+    def test_non_contiguous_numba(self):
+        array = numpy.arange(20).reshape(10, 2)[:, 0]
+        clone_ix, source_ix = numpy.array([0, 1]), numpy.array([9, 8])
+        clone_rows(array, clone_ix, source_ix, backend="numba")
+        assert array[0] == 18 and array[1] == 16
+
+
+class TestHashRows:
+    @pytest.mark.parametrize("dtype", dtypes)
+    @pytest.mark.parametrize("shape", shapes)
+    def test_equal_rows_equal_hashes(self, dtype, shape):
+        random_state = numpy.random.RandomState(160290)
+        array = (random_state.random_sample(shape) * 100).astype(dtype)
+        array[3] = array[1]
+        hashes = hash_rows(array)
+        assert hashes.dtype == numpy.int64
+        assert hashes.shape == (shape[0],)
+        assert hashes[1] == hashes[3]
+
+    def test_different_rows_different_hashes(self):
+        array = numpy.arange(300).reshape(100, 3).astype(numpy.float32)
+        assert len(set(hash_rows(array).tolist())) == 100
+        # The position of the values inside a row is taken into account
+        assert (
+            hash_rows(numpy.array([[1, 2], [2, 1]]))[0]
+            != hash_rows(numpy.array([[1, 2], [2, 1]]))[1]
+        )
+
+    def test_selected_rows(self):
+        array = numpy.arange(30).reshape(10, 3)
+        rows = numpy.array([7, 2])
+        assert (hash_rows(array, rows) == hash_rows(array)[rows]).all()
+
+    def test_non_contiguous(self):
+        array = numpy.arange(40).reshape(10, 4)
+        assert (hash_rows(array[:, ::2]) == hash_rows(array[:, ::2].copy())).all()
+        rows = numpy.array([9, 1])
+        assert (hash_rows(array[:, ::2], rows) == hash_rows(array[:, ::2])[rows]).all()
+
+    def test_rows_not_multiple_of_word(self):
+        array = numpy.arange(33, dtype=numpy.uint8).reshape(3, 11)
+        padded = numpy.zeros((3, 16), dtype=numpy.uint8)
+        padded[:, :11] = array
+        assert (hash_rows(array) == hash_rows(padded)).all()
+        assert (hash_rows(array, [2]) == hash_rows(array)[2]).all()
+
+
+def reference_virtual_reward(rewards, distances, reward_scale, dist_scale, minimize):
+    processed_rewards = relativize(-1 * rewards if minimize else rewards)
+    score_reward = processed_rewards ** reward_scale
+    score_dist = distances ** dist_scale
+    virt_rw = score_reward * score_dist
+    dist_prob = score_dist / score_dist.sum()
+    reward_prob = score_reward / score_reward.sum()
+    total_entropy = numpy.prod(2 - dist_prob ** reward_prob)
+    min_entropy = numpy.prod(2 - reward_prob ** reward_prob)
+    return processed_rewards, virt_rw, min_entropy, total_entropy
+
+
+class TestVirtualReward:
+    @pytest.mark.parametrize("backend", ["numpy", "numba"])
+    @pytest.mark.parametrize("minimize", [False, True])
+    @pytest.mark.parametrize("scales", [(1.0, 1.0), (2.0, 0.5)])
+    def test_matches_reference(self, backend, minimize, scales):
+        random_state = numpy.random.RandomState(160290)
+        rewards = random_state.standard_normal(50).astype(numpy.float32)
+        distances = relativize(random_state.random_sample(50).astype(numpy.float32))
+        target = reference_virtual_reward(rewards, distances, *scales, minimize)
+        result = virtual_reward(rewards, distances, *scales, minimize=minimize, backend=backend)
+        assert result[0].dtype == result[1].dtype == numpy.float32
+        for res, targ in zip(result, target):
+            assert numpy.allclose(res, targ, rtol=1e-4)
+
+    @pytest.mark.parametrize("backend", ["numpy", "numba"])
+    def test_out_buffers(self, backend):
+        rewards = numpy.ones(10, dtype=numpy.float32)
+        distances = numpy.ones(10, dtype=numpy.float32)
+        processed = numpy.zeros(10, dtype=numpy.float32)
+        virtual = numpy.zeros(10, dtype=numpy.float32)
+        result = virtual_reward(
+            rewards,
+            distances,
+            processed_rewards=processed,
+            virtual_rewards=virtual,
+            backend=backend,
+        )
+        assert result[0] is processed and result[1] is virtual
+        assert (processed == 1).all() and (virtual == 1).all()
+
+
+class TestFlipValues:
+    def test_flip_values(self):
+        values = numpy.zeros((3, 4), dtype=int)
+        flips = numpy.array([[0, 1], [2, 2], [3, 0]])
+        flipped = flip_values(values, flips)
+        assert flipped.dtype == numpy.bool_
+        target = [[1, 1, 0, 0], [0, 0, 0, 0], [1, 0, 0, 1]]
+        assert (flipped == numpy.array(target, dtype=bool)).all()
+        # Contiguous boolean arrays are flipped in place
+        assert flip_values(flipped, flips) is flipped
+        assert not flipped.any()
+
+
+def reference_lennard_jones(points):
+    energies = []
+    for cluster in points.reshape(len(points), -1, 3):
+        diff = cluster[:, numpy.newaxis] - cluster[numpy.newaxis]
+        r2 = (diff ** 2).sum(-1)[numpy.triu_indices(len(cluster), k=1)]
+        energies.append(4 * (r2 ** -6 - r2 ** -3).sum())
+    return numpy.array(energies)
+
+
+class TestLennardJones:
+    @pytest.mark.parametrize("dtype", [numpy.float32, numpy.float64])
+    def test_matches_reference(self, dtype):
+        points = numpy.random.RandomState(160290).uniform(-2, 2, (10, 3 * 13)).astype(dtype)
+        target = reference_lennard_jones(points.astype(numpy.float64))
+        assert numpy.allclose(lennard_jones_energy(points), target)
+
+    @pytest.mark.parametrize("cell_list", [False, True])
+    def test_cutoff(self, cell_list):
+        points = numpy.random.RandomState(160290).uniform(-4, 4, (6, 3 * 80))
+        cutoff = 2.5
+        energies = lennard_jones_energy(points, cutoff=cutoff, cell_list=cell_list)
+        target = []
+        for cluster in points.reshape(len(points), -1, 3):
+            diff = cluster[:, numpy.newaxis] - cluster[numpy.newaxis]
+            r2 = (diff ** 2).sum(-1)[numpy.triu_indices(len(cluster), k=1)]
+            r2 = r2[r2 < cutoff ** 2]
+            target.append(4 * (r2 ** -6 - r2 ** -3).sum())
+        assert numpy.allclose(energies, target)
+        with pytest.raises(ValueError):
+            lennard_jones_energy(points, cell_list=True)
+
+    @pytest.mark.parametrize("cell_list", [False, True])
+    def test_overlapping_atoms(self, cell_list):
+        points = numpy.ones((2, 9))
+        points[1, :3] = 0
+        energies = lennard_jones_energy(points, cutoff=2.0, cell_list=cell_list)
+        assert numpy.isinf(energies).all()
+
+
+def test_warmup_kernels():
+    warmup_kernels([numpy.int16, object])
+    assert any(str(signature[0].dtype) == "int16" for signature in _clone_rows_numba.signatures)
@@ -0,0 +1,206 @@
+import os
+import weakref
+
+import numpy
+import pytest
+
+from fragile.core.state_stores import ArrayStore, DeltaStore, SegmentStore
+from fragile.core.states import StatesEnv, StatesModel, StatesWalkers
+from fragile.core.tree import HistoryTree
+
+
+def sparse_step(tree, parent_hashes, parent_states, n_iter, random_state):
+    """Add a batch of states that differ from the state of their parents in a few bytes."""
+    n_walkers, n_bytes = parent_states.shape
+    states = parent_states.copy()
+    changed = random_state.randint(0, n_bytes, size=(n_walkers, 3))
+    states[numpy.arange(n_walkers)[:, numpy.newaxis], changed] += 1
+    hashes = numpy.arange(n_walkers) + 1 + n_walkers * n_iter
+    env_states = StatesEnv(batch_size=n_walkers, states=states, rewards=numpy.ones(n_walkers))
+    model_states = StatesModel(
+        batch_size=n_walkers, actions=changed[:, 0], dt=numpy.ones(n_walkers, dtype=int)
+    )
+    walkers_states = StatesWalkers(batch_size=n_walkers)
+    walkers_states.update(id_walkers=hashes, cum_rewards=numpy.ones(n_walkers))
+    tree.add_states(
+        parent_ids=list(parent_hashes),
+        env_states=env_states,
+        model_states=model_states,
+        walkers_states=walkers_states,
+        n_iter=n_iter,
+    )
+    return hashes, states
+
+
+def run_trees(trees, n_walkers=20, n_bytes=256, n_iters=40, seed=160290):
+    """Run the same sequence of steps in all the trees, and return the final leaf hashes."""
+    random_state = numpy.random.RandomState(seed)
+    parents = numpy.zeros(n_walkers, dtype=int)
+    parent_states = numpy.zeros((n_walkers, n_bytes), dtype=numpy.uint8)
+    for n_iter in range(1, n_iters):
+        state = random_state.get_state()
+        for tree in trees:
+            random_state.set_state(state)
+            hashes, states = sparse_step(tree, parents, parent_states, n_iter, random_state)
+        # Clone some of the walkers and prune the dead branches
+        compas = random_state.randint(0, n_walkers, size=n_walkers)
+        parents, parent_states = hashes[compas], states[compas]
+        for tree in trees:
+            tree.prune_tree(set(parents.tolist()), from_hash=True)
+    return parents
+
+
+class Payload:
+    pass
+
+
+class TestArrayStore:
+    def test_remove_releases_objects(self):
+        store = ArrayStore()
+        store.resize(4)
+        states = numpy.empty(3, dtype=object)
+        for i in range(3):
+            states[i] = Payload()
+        refs = [weakref.ref(state) for state in states]
+        store.write(numpy.arange(3), numpy.full(3, -1), states)
+        del states
+        store.remove(numpy.array([0, 2]))
+        assert refs[0]() is None and refs[2]() is None
+        assert refs[1]() is not None
+
+    @pytest.mark.parametrize("state_store", [ArrayStore, DeltaStore])
+    def test_memory_reclaimed_after_pruning(self, state_store):
+        tree = HistoryTree(capacity=4, state_store=state_store())
+        leafs = run_trees([tree])
+        nbytes = tree.state_store.nbytes
+        survivor = int(leafs[0])
+        states, _, _ = tree.get_branch(survivor, from_hash=True)
+        tree.prune_tree({survivor}, from_hash=True)
+        assert tree.state_store.nbytes < nbytes / 2
+        if state_store is DeltaStore:
+            # The byte pool is compacted once more than half of it is garbage
+            assert len(tree.state_store._pool) < 2 * tree.state_store.nbytes
+        new_states, _, _ = tree.get_branch(survivor, from_hash=True)
+        assert numpy.array_equal(numpy.array(states[1:]), numpy.array(new_states[1:]))
+
+
+class TestDeltaStore:
+    def test_read_write(self):
+        store = DeltaStore(keyframe_interval=4)
+        store.resize(16)
+        states = numpy.zeros((10, 100), dtype=numpy.int32)
+        for i in range(1, 10):
+            states[i] = states[i - 1]
+            states[i, i] = i
+        store.write(numpy.arange(10), numpy.arange(-1, 9), states)
+        assert numpy.array_equal(store.read(numpy.arange(10)), states)
+        assert numpy.array_equal(numpy.array(list(store.iter_branch(numpy.arange(10)))), states)
+        # Keyframes at depths 0, 4 and 8, and deltas of 5 bytes for the other nodes
+        assert store._is_keyframe[:10].tolist() == [i % 4 == 0 for i in range(10)]
+        assert store.nbytes == 3 * states[0].nbytes + 7 * 5
+
+    def test_decode_without_cache(self):
+        store = DeltaStore(keyframe_interval=8, cache_size=0)
+        store.resize(4)
+        states = numpy.arange(12, dtype=numpy.float64).reshape(4, 3)
+        states[1:] = states[0]
+        states[2, 1] = -1
+        states[3, 2] = -2
+        store.write(numpy.array([0, 1]), numpy.array([-1, 0]), states[:2])
+        store.write(numpy.array([2, 3]), numpy.array([1, 1]), states[2:])
+        assert numpy.array_equal(store.read(numpy.array([3, 2, 3])), states[[3, 2, 3]])
+
+    def test_parents_in_same_batch(self):
+        store = DeltaStore()
+        store.resize(4)
+        states = numpy.arange(12).reshape(4, 3)
+        # Node 3 is the child of node 1, which is the child of node 2
+        store.write(numpy.array([3, 1, 2]), numpy.array([1, 2, -1]), states[[3, 1, 2]])
+        assert numpy.array_equal(store.read(numpy.array([1, 2, 3])), states[1:])
+        with pytest.raises(KeyError):
+            store.read(numpy.array([0]))
+
+    def test_object_states_not_supported(self):
+        store = DeltaStore()
+        store.resize(4)
+        with pytest.raises(TypeError):
+            store.write(numpy.array([0]), numpy.array([-1]), numpy.array([None], dtype=object))
+
+    @pytest.mark.parametrize("cache_size", [0, 8, 1024])
+    def test_same_as_array_store(self, cache_size):
+        array_tree = HistoryTree(capacity=4)
+        delta_tree = HistoryTree(
+            capacity=4, state_store=DeltaStore(keyframe_interval=16, cache_size=cache_size)
+        )
+        assert isinstance(array_tree.state_store, ArrayStore)
+        leafs = run_trees([array_tree, delta_tree])
+        assert delta_tree.n_nodes == array_tree.n_nodes
+        assert delta_tree.state_store.nbytes < array_tree.state_store.nbytes / 10
+        for leaf_hash in leafs:
+            states, actions, _ = array_tree.get_branch(int(leaf_hash), from_hash=True)
+            delta_states, delta_actions, _ = delta_tree.get_branch(int(leaf_hash), from_hash=True)
+            assert delta_states[0] is None
+            assert numpy.array_equal(numpy.array(states[1:]), numpy.array(delta_states[1:]))
+            assert list(actions) == list(delta_actions)
+
+
+class TestSegmentStore:
+    def test_read_write(self, tmp_path):
+        store = SegmentStore(directory=str(tmp_path), segment_bytes=4 * 160)
+        store.resize(16)
+        states = numpy.arange(200, dtype=numpy.float64).reshape(10, 20)
+        store.write(numpy.arange(10), numpy.arange(-1, 9), states)
+        assert store.n_segments == 3
+        assert len(os.listdir(str(tmp_path))) == 3
+        assert numpy.array_equal(store.read(numpy.array([9, 0, 4])), states[[9, 0, 4]])
+        branch = list(store.iter_branch(numpy.arange(10)))
+        assert isinstance(branch[0], numpy.memmap)
+        assert numpy.array_equal(numpy.array(branch), states)
+        store.reset()
+        assert os.listdir(str(tmp_path)) == []
+
+    def test_remove_deletes_segments(self, tmp_path):
+        store = SegmentStore(directory=str(tmp_path), segment_bytes=4 * 160)
+        store.resize(16)
+        states = numpy.arange(200, dtype=numpy.float64).reshape(10, 20)
+        store.write(numpy.arange(10), numpy.full(10, -1), states)
+        # The first segment is deleted, and the only live state of the second one is moved
+        store.remove(numpy.array([0, 1, 2, 3, 5, 6, 7]))
+        assert store.n_segments == 1
+        assert numpy.array_equal(store.read(numpy.array([4, 8, 9])), states[[4, 8, 9]])
+        with pytest.raises(KeyError):
+            store.read(numpy.array([0]))
+
+    def test_temporary_directory(self):
+        store = SegmentStore()
+        store.resize(4)
+        store.write(numpy.arange(2), numpy.full(2, -1), numpy.ones((2, 3)))
+        directory = store.directory
+        assert len(os.listdir(directory)) == 1
+        store.close()
+        assert not os.path.exists(directory)
+
+    def test_object_states_not_supported(self, tmp_path):
+        store = SegmentStore(directory=str(tmp_path))
+        store.resize(4)
+        with pytest.raises(TypeError):
+            store.write(numpy.array([0]), numpy.array([-1]), numpy.array([None], dtype=object))
+
+    def test_same_as_array_store(self, tmp_path):
+        array_tree = HistoryTree(capacity=4)
+        # Segments of 16 states, so the states are spread over many segments
+        segment_tree = HistoryTree(
+            capacity=4, state_store=SegmentStore(str(tmp_path), segment_bytes=16 * 256)
+        )
+        leafs = run_trees([array_tree, segment_tree])
+        assert segment_tree.state_store.n_segments > 1
+        # Every segment but the last one has at least half of its states alive
+        assert segment_tree.state_store.nbytes <= (2 * array_tree.n_nodes + 16) * 256
+        for leaf_hash in leafs:
+            states, actions, _ = array_tree.get_branch(int(leaf_hash), from_hash=True)
+            seg_states, seg_actions, _ = segment_tree.get_branch(int(leaf_hash), from_hash=True)
+            assert numpy.array_equal(numpy.array(states[1:]), numpy.array(seg_states[1:]))
+            assert list(actions) == list(seg_actions)
+        survivor = int(leafs[0])
+        segment_tree.prune_tree({survivor}, from_hash=True)
+        assert len(os.listdir(str(tmp_path))) == segment_tree.state_store.n_segments
@@ -1,3 +1,5 @@
+import pickle
+
 import numpy
 import pytest  # noqa: F401
 
@@ -91,3 +93,82 @@ class TestStates:
         target_1 = numpy.arange(10)
 
         assert numpy.all(target_1 == states.miau), (target_1 - states.miau, states_class)
+
+    @pytest.mark.parametrize("states_class", state_classes)
+    def test_assign_writes_in_place(self, states_class):
+        state_dict = {"name_1": {"size": tuple([3]), "dtype": numpy.float32}}
+        new_states = states_class(state_dict=state_dict, batch_size=2)
+        buffer = new_states.name_1
+        value = numpy.ones((2, 3), dtype=numpy.float64)
+        new_states.assign(name_1=value)
+        assert new_states.name_1 is buffer
+        assert new_states.name_1.dtype == numpy.float32
+        assert (new_states.name_1 == 1).all()
+        value[0, 0] = 5
+        assert new_states.name_1[0, 0] == 1
+
+    @pytest.mark.parametrize("states_class", state_classes)
+    def test_assign_take_ownership(self, states_class):
+        state_dict = {"name_1": {"size": tuple([3]), "dtype": numpy.float32}}
+        new_states = states_class(state_dict=state_dict, batch_size=2)
+        other = States(batch_size=2, name_1=numpy.ones((2, 3)), miau="miau")
+        new_states.assign(other, take_ownership=True)
+        assert new_states.name_1 is other.name_1
+        assert new_states.miau == "miau"
+        new_states.assign(name_2=numpy.arange(2))
+        assert (new_states.name_2 == numpy.arange(2)).all()
+
+    @pytest.mark.parametrize("states_class", state_classes)
+    def test_arena_views(self, states_class):
+        state_dict = {
+            "name_1": {"size": tuple([3]), "dtype": numpy.float32},
+            "name_2": {"dtype": numpy.int64},
+        }
+        new_states = states_class(state_dict=state_dict, batch_size=4, use_arena=True)
+        assert new_states.arena is not None
+        assert len(new_states.arena) == 4
+        assert new_states.name_1.shape == (4, 3)
+        assert new_states.name_1.dtype == numpy.float32
+        new_states.update(name_1=numpy.ones((4, 3)), name_2=numpy.arange(4))
+        assert (new_states.arena["name_1"] == 1).all()
+        assert (new_states.arena["name_2"] == numpy.arange(4)).all()
+        assert states_class(batch_size=4).arena is None
+
+    @pytest.mark.parametrize("states_class", [States, StatesEnv, StatesModel])
+    def test_arena_clone(self, states_class):
+        state_dict = {"name_1": {"size": tuple([2]), "dtype": numpy.float32}}
+        states = states_class(state_dict=state_dict, batch_size=10, use_arena=True)
+        states.update(name_1=numpy.arange(20).reshape(10, 2))
+        states["miau"] = numpy.arange(states.n)
+        will_clone = numpy.zeros(states.n, dtype=numpy.bool_)
+        will_clone[3:6] = True
+        compas_ix = numpy.arange(states.n)[::-1]
+        states.clone(will_clone=will_clone, compas_ix=compas_ix)
+        target = numpy.arange(10)
+        target[3:6] = compas_ix[3:6]
+        assert (states.miau == target).all()
+        assert (states.name_1[:, 0] == target * 2).all()
+        states.clone(will_clone=will_clone, compas_ix=numpy.arange(states.n), ignore={"name_1"})
+        assert (states.name_1[:, 0] == target * 2).all()
+
+    @pytest.mark.parametrize("states_class", state_classes)
+    def test_arena_copy_and_pickle(self, states_class):
+        state_dict = {"name_1": {"size": tuple([2]), "dtype": numpy.float32}}
+        states = states_class(state_dict=state_dict, batch_size=3, use_arena=True)
+        states.update(name_1=numpy.ones((3, 2)))
+        states["miau"] = "miau"
+        for new_states in (states.copy(), pickle.loads(pickle.dumps(states))):
+            assert new_states.arena is not states.arena
+            assert new_states.miau == "miau"
+            new_states.name_1[:] = 2
+            assert (new_states.arena["name_1"] == 2).all()
+            assert (states.name_1 == 1).all()
+
+    @pytest.mark.parametrize("states_class", state_classes)
+    def test_arena_take_ownership(self, states_class):
+        state_dict = {"name_1": {"size": tuple([3]), "dtype": numpy.float32}}
+        new_states = states_class(state_dict=state_dict, batch_size=2, use_arena=True)
+        buffer = new_states.name_1
+        new_states.assign(name_1=numpy.ones((2, 3)), take_ownership=True)
+        assert new_states.name_1 is buffer
+        assert (new_states.arena["name_1"] == 1).all()
@@ -1,3 +1,7 @@
+import threading
+import time
+
+import numpy
 from plangym import AtariEnvironment, ParallelEnvironment
 from plangym.minimal import ClassicControl
 import pytest
@@ -5,9 +9,11 @@ import pytest
 from fragile.core.dt_sampler import GaussianDt
 from fragile.core.env import BaseEnvironment, DiscreteEnv
 from fragile.core.models import BaseModel, DiscreteUniform, NormalContinuous
-from fragile.core.swarm import Swarm
+from fragile.core.swarm import PipelinedSwarm, Swarm
+from fragile.core.tree import HistoryTree
+from fragile.core.utils import random_state
 from fragile.core.walkers import BaseWalkers, Walkers
-from fragile.optimize.benchmarks import Rastrigin
+from fragile.optimize.benchmarks import Rastrigin, Sphere
 from fragile.optimize.swarm import FunctionMapper
 
 
@@ -120,3 +126,161 @@ class TestSwarm:
         assert reward > target, "Iters: {}, rewards: {}".format(
             swarm.walkers.n_iters, swarm.walkers.states.cum_rewards
         )
+
+    @pytest.mark.parametrize("swarm", ["cartpole", "function"], indirect=True)
+    def test_ids_are_lazy(self, swarm):
+        assert not swarm.track_ids
+        swarm.reset()
+        swarm.walkers.max_iters = 5
+        swarm.run_swarm()
+        assert (swarm.walkers.states.id_walkers[:-1] == 0).all()
+        assert swarm.walkers.balance() == (None, None)
+        swarm.track_ids = True
+        assert swarm.walkers.track_ids
+        assert (swarm.walkers.states.id_walkers == swarm.walkers.ids()).all()
+        old_ids, new_ids = swarm.walkers.balance()
+        assert isinstance(old_ids, set) and isinstance(new_ids, set)
+
+    @pytest.mark.parametrize("seed", [1, 2, 3, 4, 5])
+    def test_run_swarm_with_history_tree(self, seed):
+        numpy.random.seed(seed)
+        swarm = FunctionMapper(
+            env=lambda: Sphere(shape=(2,)),
+            n_walkers=16,
+            max_iters=300,
+            tree=HistoryTree,
+            prune_tree=True,
+        )
+        swarm.run_swarm()
+        assert swarm.walkers.n_iters == 300
+        # The best state can be traced back to the root of the tree
+        states, _, _ = swarm.tree.get_branch(int(swarm.walkers.states.best_id), from_hash=True)
+        assert numpy.allclose(states[-1], swarm.walkers.states.best_state)
+
+    def test_ids_tracked_with_tree(self):
+        swarm = FunctionMapper(
+            env=lambda: Rastrigin(shape=(2,)), n_walkers=5, max_iters=5, tree=HistoryTree
+        )
+        assert swarm.track_ids
+        swarm.reset()
+        swarm.run_step()
+        ids = swarm.walkers.states.id_walkers
+        assert (ids[:-1] == swarm.walkers.ids()[:-1]).all()
+
+    def test_reset_reuses_buffers(self):
+        swarm = FunctionMapper(env=lambda: Rastrigin(shape=(2,)), n_walkers=5, max_iters=5)
+        swarm.reset()
+        arrays = {
+            id(swarm.walkers.env_states.observs),
+            id(swarm.walkers.env_states_buffer.observs),
+        }
+        for _ in range(3):
+            swarm.run_swarm()
+            swarm.reset()
+            env_states = swarm.walkers.env_states
+            assert numpy.allclose(env_states.rewards, swarm.env.function(env_states.observs))
+        observs = {
+            id(swarm.walkers.env_states.observs),
+            id(swarm.walkers.env_states_buffer.observs),
+        }
+        assert observs == arrays
+
+    def test_replay_best_branch(self):
+        swarm = Swarm(
+            model=lambda x: DiscreteUniform(env=x),
+            walkers=Walkers,
+            env=lambda: DiscreteEnv(ClassicControl()),
+            n_walkers=10,
+            max_iters=15,
+            tree=HistoryTree,
+            prune_tree=True,
+        )
+        swarm.run_swarm()
+        branch = swarm.get_best_branch(chunk_size=4)
+        assert numpy.array_equal(branch["states"][-1], swarm.walkers.states.best_state)
+        replayed = swarm.env.replay(branch["states"], branch["actions"], branch["dts"])
+        assert numpy.allclose(replayed.states, branch["states"][1:])
+
+
+class SleepyRastrigin(Rastrigin):
+    """Rastrigin function whose step sleeps, and records how many steps run at the same time."""
+
+    lock = threading.Lock()
+    active = 0
+    max_active = 0
+
+    def step(self, *args, **kwargs):
+        with self.lock:
+            SleepyRastrigin.active += 1
+            SleepyRastrigin.max_active = max(SleepyRastrigin.active, SleepyRastrigin.max_active)
+        time.sleep(0.01)
+        with self.lock:
+            SleepyRastrigin.active -= 1
+        return super(SleepyRastrigin, self).step(*args, **kwargs)
+
+
+def create_cohort(env=Rastrigin, max_iters=20, tree=None):
+    return FunctionMapper(env=lambda: env(shape=(2,)), n_walkers=8, max_iters=max_iters, tree=tree)
+
+
+def seed_everything(seed=160290):
+    random_state.seed(seed)
+    numpy.random.seed(seed)
+
+
+def run_pipelined(n_cohorts, **kwargs):
+    seed_everything()
+    swarm = PipelinedSwarm(swarm=lambda: create_cohort(**kwargs), n_cohorts=n_cohorts)
+    swarm.run_swarm()
+    swarm.close()
+    return swarm
+
+
+class TestPipelinedSwarm:
+    def test_one_cohort_same_as_swarm(self):
+        seed_everything()
+        swarm = create_cohort()
+        swarm.run_swarm()
+        pipelined = run_pipelined(n_cohorts=1)
+        cohort = pipelined.cohorts[0]
+        assert cohort.walkers.n_iters == swarm.walkers.n_iters == 20
+        assert pipelined.best_reward_found == swarm.best_reward_found
+        assert numpy.array_equal(
+            cohort.walkers.env_states.observs, swarm.walkers.env_states.observs
+        )
+
+    def test_reproducible(self):
+        first, second = run_pipelined(n_cohorts=3), run_pipelined(n_cohorts=3)
+        for cohort, other in zip(first.cohorts, second.cohorts):
+            assert numpy.array_equal(
+                cohort.walkers.env_states.observs, other.walkers.env_states.observs
+            )
+        assert first.best_reward_found == second.best_reward_found
+        assert first.best_reward_found == min(c.best_reward_found for c in first.cohorts)
+
+    def test_share_best(self):
+        swarm = PipelinedSwarm(swarm=create_cohort, n_cohorts=2)
+        swarm.reset()
+        swarm.run_step()
+        first, second = swarm.cohorts
+        second.walkers.states.update(
+            best_reward=-1.0, best_obs=numpy.ones(2), best_state=numpy.ones(2)
+        )
+        swarm._share_best(first)
+        assert first.best_reward_found == -1.0
+        assert numpy.array_equal(first.walkers.env_states.observs[-1], numpy.ones(2))
+        assert first.walkers.states.cum_rewards[-1] == -1.0
+        swarm.close()
+
+    def test_steps_overlap(self):
+        SleepyRastrigin.max_active = 0
+        run_pipelined(n_cohorts=2, env=SleepyRastrigin, max_iters=10)
+        assert SleepyRastrigin.max_active == 2
+
+    def test_cohorts_with_tree(self):
+        swarm = run_pipelined(n_cohorts=2, tree=HistoryTree)
+        for cohort in swarm.cohorts:
+            states, _, _ = cohort.tree.get_branch(
+                int(cohort.walkers.states.best_id), from_hash=True
+            )
+            assert numpy.allclose(states[-1], cohort.walkers.states.best_state)
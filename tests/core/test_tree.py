@@ -1,7 +1,10 @@
 import networkx
+import numpy
 import pytest
 
-from fragile.core.tree import _BaseNetworkxTree, HistoryTree
+from fragile.core.hash_table import HashTable
+from fragile.core.states import StatesEnv, StatesModel, StatesWalkers
+from fragile.core.tree import _BaseNetworkxTree, HistoryTree, NetworkxTree
 
 
 @pytest.fixture()
@@ -11,7 +14,7 @@ def networkx_tree(request):
 
 class TestBaseNetworkxTree:
 
-    networkx_trees = [_BaseNetworkxTree, HistoryTree]
+    networkx_trees = [_BaseNetworkxTree, NetworkxTree]
 
     @pytest.mark.parametrize("networkx_tree", networkx_trees, indirect=True)
     def test_init(self, networkx_tree):
@@ -23,3 +26,152 @@ class TestBaseNetworkxTree:
     @pytest.mark.parametrize("networkx_tree", networkx_trees, indirect=True)
     def test_get_update_hash(self, networkx_tree):
         pass
+
+
+def random_step(tree, parent_hashes, n_iter, random_state):
+    """Add a batch of random states to the tree, cloning some of them from a previous step."""
+    n_walkers = len(parent_hashes)
+    states = random_state.randint(0, 4, size=(n_walkers, 2))
+    hashes = states[:, 0] * 4 + states[:, 1] + 1 + 16 * n_iter
+    env_states = StatesEnv(batch_size=n_walkers, states=states, rewards=states[:, 0] * 1.0)
+    model_states = StatesModel(
+        batch_size=n_walkers, actions=states[:, 1], dt=numpy.ones(n_walkers, dtype=int)
+    )
+    walkers_states = StatesWalkers(batch_size=n_walkers)
+    walkers_states.update(id_walkers=hashes, cum_rewards=states.sum(axis=1) * 1.0)
+    tree.add_states(
+        parent_ids=list(parent_hashes),
+        env_states=env_states,
+        model_states=model_states,
+        walkers_states=walkers_states,
+        n_iter=n_iter,
+    )
+    return hashes
+
+
+class TestHashTable:
+    def test_insert_get_remove(self):
+        table = HashTable(capacity=8)
+        keys = numpy.random.randint(-(2 ** 63), 2 ** 63 - 1, size=5000, dtype=numpy.int64)
+        keys = numpy.unique(keys)
+        table.insert(keys, numpy.arange(len(keys)))
+        assert len(table) == len(keys)
+        assert table.capacity >= 2 * len(keys)
+        assert (table.get(keys) == numpy.arange(len(keys))).all()
+        table.remove(keys[::2])
+        assert len(table) == len(keys) // 2
+        assert (table.get(keys[::2]) == -1).all()
+        assert (table.get(keys[1::2]) == numpy.arange(len(keys))[1::2]).all()
+        table.insert(keys[:10], numpy.zeros(10))
+        assert (table.get(keys[:10]) == 0).all()
+        table.clear()
+        assert len(table) == 0
+        assert (table.get(keys) == -1).all()
+
+
+class TestHistoryTree:
+    def test_reset(self):
+        tree = HistoryTree()
+        assert tree.n_nodes == 1
+        assert tree.get_leaf_nodes() == [tree.ROOT_ID]
+        assert tree.hash_to_node.get([tree.ROOT_HASH])[0] == tree.ROOT_ID
+
+    def test_add_states_and_get_branch(self):
+        tree = HistoryTree(capacity=2)
+        random_state = numpy.random.RandomState(160290)
+        parents = numpy.zeros(10, dtype=int)
+        hashes = random_step(tree, parents, 1, random_state)
+        assert tree.n_nodes == len(numpy.unique(hashes)) + 1
+        assert tree.capacity >= tree.n_nodes
+        new_hashes = random_step(tree, hashes, 2, random_state)
+        states, actions, dts = tree.get_branch(int(new_hashes[3]), from_hash=True)
+        assert len(states) == 3
+        assert states[0] is None
+        assert len(actions) == len(dts) == 2
+        assert (states[2] // 1 == [(new_hashes[3] - 33) // 4, (new_hashes[3] - 33) % 4]).all()
+        assert actions[1] == (new_hashes[3] - 33) % 4
+        with pytest.raises(KeyError):
+            random_step(tree, numpy.full(10, -5), 3, random_state)
+
+    def test_same_as_networkx_tree(self):
+        tree, nx_tree = HistoryTree(capacity=4), NetworkxTree()
+        random_state = numpy.random.RandomState(160290)
+        parents = numpy.zeros(20, dtype=int)
+        for n_iter in range(1, 30):
+            state = random_state.get_state()
+            hashes = random_step(tree, parents, n_iter, random_state)
+            random_state.set_state(state)
+            random_step(nx_tree, parents, n_iter, random_state)
+            # Clone some of the walkers
+            parents = hashes[random_state.randint(0, len(hashes), size=len(hashes))]
+            tree.prune_tree(set(parents.tolist()), from_hash=True)
+            nx_tree.prune_tree(set(parents.tolist()), from_hash=True)
+            leafs = {
+                nx_tree.ids_to_hash[n]
+                for n in nx_tree.data.nodes
+                if nx_tree.data.out_degree(n) == 0
+            }
+            tree_leafs = set(tree._columns["hash"][tree.get_leaf_nodes()].tolist())
+            assert tree_leafs == leafs
+            assert tree.n_nodes == len(nx_tree.data.nodes)
+        for leaf_hash in parents:
+            states, actions, dts = tree.get_branch(int(leaf_hash), from_hash=True)
+            nx_states, nx_actions, nx_dts = nx_tree.get_branch(int(leaf_hash), from_hash=True)
+            assert numpy.array_equal(numpy.array(states[1:]), numpy.array(nx_states[1:]))
+            assert list(actions) == list(nx_actions)
+            assert list(dts) == list(nx_dts)
+
+    def test_prune_compacts_arrays(self):
+        tree = HistoryTree(capacity=4)
+        random_state = numpy.random.RandomState(160290)
+        parents = numpy.zeros(50, dtype=int)
+        for n_iter in range(1, 20):
+            parents = random_step(tree, parents, n_iter, random_state)
+        # Keep only one walker alive, so almost all the branches are removed
+        survivor = int(parents[0])
+        states, actions, dts = tree.get_branch(survivor, from_hash=True)
+        tree.prune_tree({survivor}, from_hash=True)
+        assert tree.n_nodes == len(states)
+        assert tree._size == tree.n_nodes
+        assert len(tree._free_ids) == 0
+        assert tree.get_leaf_nodes() == tree.get_path(survivor, from_hash=True)[-1:].tolist()
+        new_states, new_actions, new_dts = tree.get_branch(survivor, from_hash=True)
+        assert numpy.array_equal(numpy.array(states[1:]), numpy.array(new_states[1:]))
+        assert list(actions) == list(new_actions)
+        # The tree keeps working after compacting
+        parents = random_step(tree, numpy.full(50, survivor), 20, random_state)
+        tree.prune_tree(set(parents.tolist()), from_hash=True)
+        assert len(tree.get_branch(int(parents[0]), from_hash=True)[0]) == len(states) + 1
+
+    def test_branch_arrays_and_export(self, tmp_path):
+        tree = HistoryTree(capacity=4)
+        random_state = numpy.random.RandomState(160290)
+        parents = numpy.zeros(10, dtype=int)
+        for n_iter in range(1, 12):
+            parents = random_step(tree, parents, n_iter, random_state)
+        leaf = int(parents[0])
+        states, actions, dts = tree.get_branch(leaf, from_hash=True)
+        branch = tree.get_branch_arrays(leaf, from_hash=True, chunk_size=3)
+        assert numpy.array_equal(branch["states"], numpy.array(states[1:]))
+        assert numpy.array_equal(branch["actions"], numpy.array(actions))
+        assert numpy.array_equal(branch["dts"], numpy.array(dts))
+        assert numpy.array_equal(branch["rewards"], branch["states"][:, 0] * 1.0)
+        chunks = list(tree.iter_branch(leaf, from_hash=True, chunk_size=4))
+        assert [len(chunk["states"]) for chunk in chunks] == [4, 4, 3]
+        path = str(tmp_path / "branch.npz")
+        tree.save_branch(path, leaf, from_hash=True, chunk_size=4, compress=True)
+        with numpy.load(path) as data:
+            assert sorted(data.keys()) == sorted(branch.keys())
+            for name, values in branch.items():
+                assert numpy.array_equal(data[name], values)
+
+
+class TestNetworkxTree:
+    def test_prune_deep_branch(self):
+        tree = NetworkxTree()
+        depth = 5000
+        for node in range(1, depth + 1):
+            tree.append_leaf(node, node - 1, state=node)
+        tree.append_leaf(depth + 1, 10, state=depth + 1)
+        tree.prune_tree(alive_leafs={depth + 1})
+        assert set(tree.data.nodes) == set(range(11)) | {depth + 1}
@@ -2,9 +2,14 @@ from hypothesis import given
 from hypothesis.extra.numpy import arrays
 import hypothesis.strategies as st
 import numpy as np
+import pytest
 
-
-from fragile.core.utils import calculate_clone, calculate_virtual_reward, fai_iteration
+from fragile.core.utils import (
+    calculate_clone,
+    calculate_virtual_reward,
+    fai_iteration,
+    relativize,
+)
 
 
 @given(st.integers(), st.integers())
@@ -62,3 +67,35 @@ class TestFaiNumpy:
 
         assert isinstance(compas_ix[0], np.int64), type(compas_ix[0])
         assert isinstance(will_clone[0], np.bool_), type(will_clone[0])
+
+
+def reference_relativize(x):
+    std = x.std()
+    if float(std) == 0:
+        return np.ones(len(x), dtype=type(std))
+    standard = (x - x.mean()) / std
+    standard[standard > 0] = np.log(1.0 + standard[standard > 0]) + 1.0
+    standard[standard <= 0] = np.exp(standard[standard <= 0])
+    return standard
+
+
+class TestRelativize:
+    @pytest.mark.parametrize("dtype", [np.float32, np.float64])
+    def test_keeps_dtype(self, dtype):
+        x = np.random.standard_normal(100).astype(dtype)
+        result = relativize(x)
+        assert result.dtype == dtype
+        assert np.allclose(result, reference_relativize(x), rtol=1e-5)
+
+    def test_out(self):
+        x = np.random.standard_normal(100).astype(np.float32)
+        out = np.empty(100, dtype=np.float32)
+        result = relativize(x, out=out)
+        assert result is out
+        assert np.allclose(result, reference_relativize(x), rtol=1e-5)
+        assert (relativize(np.ones(100), out=out) == 1).all()
+
+    def test_ints(self):
+        x = np.arange(10)
+        assert relativize(x).dtype == np.float64
+        assert np.allclose(relativize(x), reference_relativize(x))
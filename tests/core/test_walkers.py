@@ -1,3 +1,5 @@
+from functools import partial
+
 from hypothesis import given
 from hypothesis.extra.numpy import arrays
 import numpy as np
@@ -32,7 +34,7 @@ def get_walkers_discrete_gym():
     )
 
 
-def get_function_walkers():
+def get_function_walkers(minimize=True, **kwargs):
     env_params = {
         "states": {"size": (3,), "dtype": np.int64},
         "observs": {"size": (3,), "dtype": np.float32},
@@ -47,11 +49,17 @@ def get_function_walkers():
         n_walkers=N_WALKERS,
         env_state_params=env_params,
         model_state_params=model_params,
-        minimize=True,
+        minimize=minimize,
+        **kwargs
     )
 
 
-walkers_config = {"discrete-gym": get_walkers_discrete_gym, "function": get_function_walkers}
+walkers_config = {
+    "discrete-gym": get_walkers_discrete_gym,
+    "function": get_function_walkers,
+    "arena": partial(get_function_walkers, minimize=False, use_arena=True),
+    "numba": partial(get_function_walkers, minimize=False, backend="numba"),
+}
 
 
 @pytest.fixture()
@@ -80,12 +88,18 @@ class TestStatesWalkers:
 
 
 class TestWalkers:
-    walkers_fixture_params = ["discrete-gym"]
+    walkers_fixture_params = ["discrete-gym", "arena", "numba"]
 
     @pytest.mark.parametrize("walkers", walkers_fixture_params, indirect=True)
     def test_init(self, walkers):
         pass
 
+    def test_invalid_backend(self):
+        with pytest.raises(ValueError):
+            Walkers(
+                n_walkers=N_WALKERS, env_state_params={}, model_state_params={}, backend="cuda",
+            )
+
     @pytest.mark.parametrize("walkers", walkers_fixture_params, indirect=True)
     def test_repr_not_crashes(self, walkers):
         assert isinstance(walkers.__repr__(), str)
@@ -172,3 +186,31 @@ class TestWalkers:
         assert isinstance(walkers.states.distances[0], np.float32)
         assert len(walkers.states.distances.shape) == 1
         assert walkers.states.distances.shape[0] == walkers.n
+
+    @pytest.mark.parametrize("walkers", walkers_fixture_params, indirect=True)
+    def test_update_ids(self, walkers):
+        walkers.reset()
+        states = np.arange(np.prod(walkers.env_states.states.shape))
+        walkers.env_states.update(states=states.reshape(walkers.env_states.states.shape))
+        walkers.update_ids()
+        ids = walkers.states.id_walkers.copy()
+        assert len(set(ids.tolist())) == walkers.n
+        walkers.env_states.states[[0, 1]] = walkers.env_states.states[2]
+        changed = np.zeros(walkers.n, dtype=bool)
+        changed[0] = True
+        walkers.update_ids(changed=changed)
+        assert walkers.states.id_walkers[0] == ids[2]
+        # Rows not marked as changed keep their cached id
+        assert walkers.states.id_walkers[1] == ids[1]
+        walkers.update_ids(changed=[1])
+        assert (walkers.states.id_walkers[:3] == ids[2]).all()
+
+    @pytest.mark.parametrize("walkers", walkers_fixture_params, indirect=True)
+    def test_update_states_swaps_buffer(self, walkers):
+        walkers.reset()
+        front, back = walkers.env_states, walkers.env_states_buffer
+        back.update(rewards=np.ones(walkers.n))
+        walkers.update_states(env_states=back)
+        assert walkers.env_states is back
+        assert walkers.env_states_buffer is front
+        assert (walkers.states.cum_rewards == 1).all()
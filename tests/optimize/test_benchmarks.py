@@ -5,7 +5,9 @@ import pytest
 
 from fragile.optimize.benchmarks import (
     EggHolder,
+    LennardJones,
     OptimBenchmark,
+    random_lennard,
     Rastrigin,
     Sphere,
     StyblinskiTang,
@@ -45,3 +47,18 @@ class TestBenchmarks:
         val = wiki_benchmark.function(best.reshape(new_shape))
         bench = wiki_benchmark.benchmark
         assert np.allclose(val[0], bench), wiki_benchmark.__class__.__name__
+
+
+class TestLennardJones:
+    def test_minimum(self):
+        env = LennardJones(n_atoms=2)
+        points = np.array([[0.0, 0.0, 0.0, 2 ** (1 / 6), 0.0, 0.0]])
+        assert np.allclose(env.function(points), env.benchmark[1])
+
+    def test_random_lennard(self):
+        points = np.random.uniform(-1.5, 1.5, (10, 3 * 4))
+        # With two atoms there is only one pair to choose
+        assert np.allclose(random_lennard(points[:, :6]), LennardJones(2).function(points[:, :6]))
+        result = random_lennard(points)
+        assert result.shape == (10,)
+        assert np.isfinite(result).all()
@@ -2,7 +2,15 @@ import numpy as np
 import pytest
 
 from fragile.core.states import States, StatesEnv
-from fragile.optimize.env import Function
+from fragile.optimize.benchmarks import Rastrigin, Sphere
+from fragile.optimize.designs import DESIGNS, sample_design
+from fragile.optimize.env import (
+    BatchedMinimizer,
+    Function,
+    Minimizer,
+    MinimizerWrapper,
+    ParallelMinimizer,
+)
 
 
 @pytest.fixture()
@@ -42,7 +50,195 @@ class TestFunction:
         assert isinstance(new_states, States)
         assert new_states.rewards[0].item() == 1
 
+    def test_step_out(self, env):
+        states = env.reset(batch_size=3)
+        actions = States(actions=np.ones((3, 2)), batch_size=3)
+        out = env.create_new_states(batch_size=3)
+        arrays = {name: id(val) for name, val in out.items()}
+        new_states: StatesEnv = env.step(actions, states, out=out)
+        assert new_states is out
+        assert {name: id(val) for name, val in out.items()} == arrays
+        assert np.allclose(out.observs, states.observs + 1)
+        assert (out.rewards == 1).all()
+
+    def test_step_out_clears_other_fields(self, env):
+        states = env.reset(batch_size=3)
+        actions = States(actions=np.ones((3, 2)), batch_size=3)
+        out = env.create_new_states(batch_size=3)
+        out["extra"] = np.ones(3)
+        env.step(actions, states, out=out)
+        assert (out.extra == 0).all()
+
+    @pytest.mark.parametrize("design", list(DESIGNS))
+    def test_reset_initial_design(self, env, design):
+        env.initial_design = design
+        states = env.reset(batch_size=16)
+        assert states.observs.shape == (16, 2)
+        assert env.bounds.points_in_bounds(states.observs).all()
+        assert len(np.unique(states.observs[:, 0])) == 16
+
+    def test_invalid_initial_design(self):
+        with pytest.raises(ValueError):
+            Function.from_bounds_params(
+                function=lambda x: np.ones(len(x)), shape=(2,), low=-1, high=1, initial_design="x"
+            )
+
+    def test_reset_out(self, env):
+        out = env.create_new_states(batch_size=5)
+        arrays = {name: id(val) for name, val in out.items()}
+        new_states = env.reset(batch_size=5, out=out)
+        assert new_states is out
+        assert {name: id(val) for name, val in out.items()} == arrays
+        assert env.bounds.points_in_bounds(out.observs).all()
+        assert (out.rewards == 1).all()
+
     def shapes_are_the_same(self, env, plangym_env):
         plan_states = plangym_env.reset()
         states = env.reset()
         assert states.rewards.shape == plan_states.shape
+
+
+class TestDesigns:
+    @pytest.mark.parametrize("design", list(DESIGNS))
+    def test_unit_cube(self, design):
+        points = sample_design(design, 64, 3, np.random.RandomState(160290))
+        assert points.shape == (64, 3)
+        assert ((points >= 0) & (points < 1)).all()
+
+    @pytest.mark.parametrize("design", ["lhs", "sobol"])
+    def test_one_point_per_interval(self, design):
+        # 16 points stratify each dimension in 16 intervals of the same size
+        points = sample_design(design, 16, 4, np.random.RandomState(160290))
+        intervals = np.sort(np.floor(points * 16), axis=0)
+        assert (intervals == np.arange(16)[:, np.newaxis]).all()
+
+    def test_invalid_design(self):
+        with pytest.raises(ValueError):
+            sample_design("grid", 4, 2, np.random.RandomState(160290))
+
+
+class TestMinimizer:
+    def test_minimize_batch(self):
+        minimizer = Minimizer(function=Sphere(shape=(3,)))
+        points = np.random.uniform(-1, 1, (4, 3))
+        new_points, rewards = minimizer.minimize_batch(points)
+        assert rewards.shape == (4, 1)
+        assert np.allclose(new_points, 0, atol=1e-4)
+        assert np.allclose(rewards, 0, atol=1e-6)
+
+    def test_budgets(self):
+        points = np.full((1, 5), 2.0)
+        env = Rastrigin(shape=(5,))
+        _, reward = Minimizer(function=env, max_iter=1).minimize_point(points[0])
+        _, best_reward = Minimizer(function=env).minimize_point(points[0])
+        assert best_reward < reward
+        point, reward = Minimizer(function=env, max_time=0).minimize_point(points[0])
+        # Only the starting point is evaluated before the time runs out
+        assert np.allclose(point, points[0])
+        assert reward == env.function(points)[0]
+
+
+class TestParallelMinimizer:
+    def test_same_as_minimizer(self):
+        env = Rastrigin(shape=(2,))
+        points = np.random.uniform(-3, 3, (13, 2)).astype(np.float32)
+        minimizer = ParallelMinimizer(function=env, n_workers=2, chunk_size=3)
+        try:
+            new_points, rewards = minimizer.minimize_batch(points)
+            target_points, target_rewards = Minimizer(function=env).minimize_batch(points)
+            assert new_points.dtype == points.dtype
+            assert np.allclose(new_points, target_points)
+            assert np.allclose(rewards, target_rewards)
+            # The shared memory is reused for smaller batches
+            block = minimizer._block
+            new_points, rewards = minimizer.minimize_batch(points[:5])
+            assert minimizer._block is block
+            assert np.allclose(rewards, target_rewards[:5])
+        finally:
+            minimizer.close()
+
+
+class CallCounter:
+    def __init__(self, function):
+        self.function = function
+        self.n_calls = 0
+        self.n_points = 0
+
+    def __call__(self, x):
+        self.n_calls += 1
+        self.n_points += len(x)
+        return self.function(x)
+
+
+def shifted_sphere(x):
+    return np.sum((x - 3) ** 2, axis=1)
+
+
+class TestBatchedMinimizer:
+    @pytest.mark.parametrize("method", BatchedMinimizer.METHODS)
+    def test_minimize_sphere(self, method):
+        counter = CallCounter(lambda x: np.sum(x ** 2, axis=1))
+        env = Function.from_bounds_params(counter, shape=(5,), low=-2, high=2)
+        points = np.random.RandomState(160290).uniform(-2, 2, (1000, 5)).astype(np.float32)
+        learning_rate = 0.1 if method == "adam" else None
+        minimizer = BatchedMinimizer(env, method=method, learning_rate=learning_rate)
+        new_points, rewards = minimizer.minimize_batch(points)
+        assert new_points.shape == points.shape and new_points.dtype == points.dtype
+        assert rewards.shape == (1000, 1)
+        assert np.allclose(rewards.ravel(), np.sum(new_points.astype(np.float64) ** 2, 1))
+        assert np.allclose(new_points, 0, atol=0.05)
+        if method == "lbfgs":
+            # Every call evaluates the whole batch, so a few dozen calls are enough
+            assert counter.n_calls <= 40
+
+    @pytest.mark.parametrize("method", BatchedMinimizer.METHODS)
+    def test_projected_to_bounds(self, method):
+        env = Function.from_bounds_params(shifted_sphere, shape=(3,), low=-1, high=1)
+        points = np.random.uniform(-1, 1, (20, 3))
+        learning_rate = 0.1 if method == "adam" else None
+        minimizer = BatchedMinimizer(env, method=method, learning_rate=learning_rate)
+        new_points, rewards = minimizer.minimize_batch(points)
+        assert np.allclose(new_points, 1, atol=1e-3)
+        assert np.allclose(rewards, 12, atol=1e-2)
+
+    def test_analytic_gradient(self):
+        counter = CallCounter(shifted_sphere)
+        env = Function.from_bounds_params(counter, shape=(4,), low=-10, high=10)
+        minimizer = BatchedMinimizer(env, gradient=lambda x: 2 * (x - 3))
+        new_points, _ = minimizer.minimize_batch(np.zeros((50, 4)))
+        assert np.allclose(new_points, 3, atol=1e-4)
+        # The finite differences would evaluate four shifted points per point
+        assert counter.n_points < 50 * counter.n_calls + 1
+        with pytest.raises(ValueError):
+            BatchedMinimizer(env, method="newton")
+
+    def test_infinite_values(self):
+        env = Function.from_bounds_params(
+            lambda x: np.where(x[:, 0] > 0, np.inf, np.sum(x ** 2, 1)), shape=(2,), low=-5, high=5
+        )
+        points = np.array([[1.0, 1.0], [-1.0, 1.0]])
+        new_points, rewards = BatchedMinimizer(env).minimize_batch(points)
+        assert np.allclose(new_points[0], points[0]) and np.isinf(rewards[0, 0])
+        assert np.isfinite(rewards[1, 0]) and rewards[1, 0] < 2
+
+
+class TestMinimizerWrapper:
+    @pytest.mark.parametrize("refine", ["best", "random"])
+    def test_refine_some_walkers(self, refine):
+        env = MinimizerWrapper(Sphere(shape=(2,)), n_refine=3, refine=refine)
+        states = env.reset(batch_size=10)
+        actions = States(actions=np.zeros((10, 2)), batch_size=10)
+        new_states = env.step(actions, states)
+        refined = np.isclose(new_states.rewards, 0, atol=1e-6)
+        assert refined.sum() == 3
+        assert np.allclose(new_states.observs[~refined], states.observs[~refined])
+        if refine == "best":
+            best = np.argsort(states.rewards)[:3]
+            assert refined[best].all()
+
+    def test_batched(self):
+        env = MinimizerWrapper(Sphere(shape=(2,)), batched=True, method="gd")
+        assert isinstance(env.minimizer, BatchedMinimizer)
+        states = env.reset(batch_size=10)
+        new_states = env.step(States(actions=np.zeros((10, 2)), batch_size=10), states)
+        assert (new_states.rewards < states.rewards).all()
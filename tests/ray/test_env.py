@@ -0,0 +1,178 @@
+import os
+import time
+
+from gym.spaces import Box, Discrete
+import numpy as np
+from plangym.minimal import ClassicControl
+import pytest
+
+from fragile.core.env import DiscreteEnv
+from fragile.core.states import StatesEnv, StatesModel
+from fragile.optimize.benchmarks import sphere, Sphere
+from fragile.optimize.env import Function
+from fragile.ray.env import (
+    AdaptiveChunks,
+    BatchEnv,
+    ExternalProcess,
+    ParallelDiscreteEnv,
+    ParallelFunction,
+    SharedBatch,
+)
+
+
+def slow_first_coordinate(points):
+    """Return the first coordinate of each point, sleeping when it is negative."""
+    time.sleep(0.005 * (points[:, 0] < 0).sum())
+    return points[:, 0]
+
+
+@pytest.fixture()
+def parallel_function():
+    function = ParallelFunction(env_callable=lambda: Sphere(shape=(3,)), n_workers=3)
+    yield function
+    function.close()
+
+
+class TestSharedBatch:
+    def test_arrays(self):
+        batch = SharedBatch(4, (3,), np.float32)
+        points, rewards = SharedBatch.arrays(batch.memory.buf, *batch.spec[1:])
+        points[:] = 1
+        rewards[:] = 2
+        assert (batch.points == 1).all() and batch.points.dtype == np.float32
+        assert (batch.rewards == 2).all()
+        del points, rewards
+        assert batch.fits(np.ones((2, 3), dtype=np.float32))
+        assert not batch.fits(np.ones((5, 3), dtype=np.float32))
+        assert not batch.fits(np.ones((2, 3), dtype=np.float64))
+        batch.close()
+
+
+class FakeEnv:
+    """Environment that follows the interface of plangym and moves along a line."""
+
+    action_space = Discrete(3)
+    observation_space = Box(low=-np.inf, high=np.inf, shape=(2,), dtype=np.float32)
+
+    def get_state(self):
+        return np.zeros(2)
+
+    def reset(self):
+        return self.get_state(), np.zeros(2)
+
+    def step_batch(self, actions, states=None, n_repeat_action=1):
+        dts = np.ones(len(actions)) * n_repeat_action
+        new_states = [state + (action - 1) * dt for state, action, dt in zip(states, actions, dts)]
+        observs = [state.copy() for state in new_states]
+        rewards = [float(state[0]) for state in new_states]
+        ends = [False for _ in new_states]
+        infos = [{"pid": os.getpid()} for _ in new_states]
+        return new_states, observs, rewards, ends, infos
+
+
+class TestAdaptiveChunks:
+    def test_guided_chunks(self):
+        chunks = AdaptiveChunks(n_workers=4, tasks_per_worker=2)
+        assert chunks.chunk_size(80) == 10
+        assert chunks.chunk_size(9) == 2
+        assert chunks.chunk_size(1) == 1
+
+    def test_latency(self):
+        chunks = AdaptiveChunks(n_workers=4, target_time=0.01, tasks_per_worker=2, smoothing=0.5)
+        chunks.update(n_items=10, elapsed=0.01)
+        assert np.isclose(chunks.latency, 0.001)
+        assert chunks.chunk_size(1000) == 10
+        chunks.update(n_items=10, elapsed=0.03)
+        assert np.isclose(chunks.latency, 0.002)
+        assert chunks.chunk_size(1000) == 5
+        # Slow items are sent one by one
+        chunks.update(n_items=1, elapsed=10)
+        assert chunks.chunk_size(1000) == 1
+        # Cheap items are split evenly across the workers
+        chunks.latency = 1e-6
+        assert chunks.chunk_size(100, n_items=1000) == 250
+
+
+class TestBatchEnv:
+    @pytest.mark.parametrize("blocking", [True, False])
+    def test_run_tasks_in_order(self, blocking):
+        envs = [
+            ExternalProcess(lambda: Function.from_bounds_params(slow_first_coordinate, shape=(2,)))
+            for _ in range(3)
+        ]
+        batch_env = BatchEnv(envs, blocking=blocking)
+        points = np.random.uniform(-1, 1, (60, 2))
+        results = batch_env.run_tasks(
+            60, lambda env, start, stop: env.step_batch(points[start:stop])
+        )
+        assert len(results) > len(envs)
+        assert [start for start, _, _ in results[1:]] == [stop for _, stop, _ in results[:-1]]
+        for start, stop, result in results:
+            assert np.allclose(result, points[start:stop, 0])
+        assert np.allclose(batch_env.step_batch(points), points[:, 0])
+        assert batch_env.chunks.latency is not None
+        batch_env.close()
+
+
+class TestParallelFunction:
+    def test_step_batch(self, parallel_function):
+        points = np.random.uniform(-10, 10, (10, 3))
+        rewards = parallel_function.step_batch(points)
+        assert rewards.shape == (10,)
+        assert np.allclose(rewards, sphere(points))
+        # Smaller batches reuse the same shared memory block
+        name = parallel_function._batch_env._batch.memory.name
+        rewards = parallel_function.step_batch(points[:4])
+        assert np.allclose(rewards, sphere(points[:4]))
+        assert parallel_function._batch_env._batch.memory.name == name
+
+    def test_new_dtype_and_size(self, parallel_function):
+        for n_points, dtype in [(5, np.float64), (7, np.float32), (20, np.float32)]:
+            points = np.random.uniform(-10, 10, (n_points, 3)).astype(dtype)
+            rewards = parallel_function.step_batch(points)
+            assert np.allclose(rewards, sphere(points), rtol=1e-5)
+
+    @pytest.mark.parametrize("use_shared_memory", [True, False])
+    @pytest.mark.parametrize("blocking", [True, False])
+    def test_transports(self, use_shared_memory, blocking):
+        function = ParallelFunction(
+            env_callable=lambda: Sphere(shape=(2,)),
+            n_workers=2,
+            blocking=blocking,
+            use_shared_memory=use_shared_memory,
+        )
+        points = np.random.uniform(-10, 10, (9, 2))
+        assert np.allclose(function.step_batch(points), sphere(points))
+        function.close()
+
+
+class TestParallelDiscreteEnv:
+    def test_step(self):
+        env = ParallelDiscreteEnv(env_callable=FakeEnv, n_workers=3)
+        assert env.n_actions == 3
+        env_states = env.reset(batch_size=50)
+        env_states.update(states=np.random.normal(size=(50, 2)))
+        actions = np.random.randint(0, 3, 50)
+        dt = np.random.randint(1, 4, 50)
+        model_states = StatesModel(batch_size=50, actions=actions, dt=dt)
+        new_states = env.step(model_states, env_states)
+        assert isinstance(new_states, StatesEnv)
+        expected = env_states.states + ((actions - 1) * dt)[:, np.newaxis]
+        assert np.allclose(new_states.states, expected)
+        assert np.allclose(new_states.rewards, expected[:, 0])
+        _, _, _, _, infos = env._env.step_batch(actions, env_states.states, dt)
+        assert len({info["pid"] for info in infos}) > 1
+        env.close()
+
+    def test_same_as_discrete_env(self):
+        env = DiscreteEnv(ClassicControl())
+        parallel_env = ParallelDiscreteEnv(env_callable=ClassicControl, n_workers=2)
+        env_states = env.reset(batch_size=10)
+        model_states = StatesModel(batch_size=10, actions=np.random.randint(0, 2, 10), dt=1)
+        for _ in range(5):
+            new_states = env.step(model_states, env_states)
+            parallel_states = parallel_env.step(model_states, env_states)
+            assert np.allclose(new_states.states, parallel_states.states)
+            assert np.allclose(new_states.rewards, parallel_states.rewards)
+            env_states = new_states
+        parallel_env.close()
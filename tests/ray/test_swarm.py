@@ -0,0 +1,105 @@
+import os
+
+import numpy as np
+import pytest
+
+from fragile.core.utils import random_state
+from fragile.optimize.benchmarks import rastrigin, Rastrigin
+from fragile.optimize.swarm import FunctionMapper
+from fragile.ray.swarm import LocalDistributedSwarm, SharedParamServer
+
+
+def create_swarm():
+    return FunctionMapper(env=lambda: Rastrigin(shape=(2,)), n_walkers=8, max_iters=20)
+
+
+class FailingIsland:
+    """Create a swarm in the current process, and fail in any other process."""
+
+    def __init__(self):
+        self.pid = os.getpid()
+
+    def __call__(self):
+        if os.getpid() != self.pid:
+            raise ValueError("Island failed")
+        return create_swarm()
+
+
+@pytest.fixture()
+def param_server():
+    server = SharedParamServer((2,), np.float32, (3,), np.float64, maxlen=2, minimize=True)
+    yield server
+    server.close()
+
+
+def walker(value):
+    return np.full(2, value, dtype=np.float32), np.full(3, value), value
+
+
+class TestSharedParamServer:
+    def test_empty(self, param_server):
+        assert param_server.get_best() == (None, None, np.inf)
+        assert param_server.exchange_walker((None, None, 0)) == ((None, None, np.inf),) * 2
+
+    def test_exchange_walker(self, param_server):
+        best, other = param_server.exchange_walker(walker(3.0))
+        assert best[2] == other[2] == 3.0
+        assert np.array_equal(best[0], walker(3.0)[0]) and np.array_equal(best[1], walker(3.0)[1])
+        for value in [1.0, 2.0, 4.0]:
+            param_server.append_walker(walker(value))
+        # The buffer only keeps the last two walkers, but the best one is not forgotten
+        assert param_server.n_stored == 2
+        assert sorted(param_server.rewards[1:]) == [2.0, 4.0]
+        state, obs, reward = param_server.get_best()
+        assert reward == 1.0 and (state == 1).all() and (obs == 1).all()
+        param_server.reset()
+        assert param_server.get_best() == (None, None, np.inf)
+
+    def test_attach(self, param_server):
+        other = SharedParamServer.attach(param_server.spec, param_server.lock)
+        other.append_walker(walker(5.0))
+        other.iterations[0] += 1
+        other.close()
+        assert param_server.get_best()[2] == 5.0
+        assert param_server.iterations[0] == 1
+
+    def test_object_dtype(self):
+        with pytest.raises(TypeError):
+            SharedParamServer((1,), object, (3,), np.float64)
+
+
+class TestLocalDistributedSwarm:
+    def test_run_swarm(self):
+        swarm = LocalDistributedSwarm(
+            create_swarm, n_swarms=2, max_iters=10, log_every=2, minimize=True, plot=False
+        )
+        try:
+            swarm.run_swarm()
+            state, obs, reward = swarm.best
+            assert swarm.n_iters == 20
+            assert state.shape == obs.shape == (2,)
+            assert np.isclose(rastrigin(obs.reshape(1, -1))[0], reward)
+            assert reward == swarm.param_server.get_best()[2]
+        finally:
+            swarm.close()
+
+    def test_reproducible(self):
+        rewards = []
+        for _ in range(2):
+            random_state.seed(160290)
+            np.random.seed(160290)
+            swarm = LocalDistributedSwarm(
+                create_swarm, n_swarms=1, max_iters=5, minimize=True, plot=False, seed=1
+            )
+            swarm.run_swarm()
+            swarm.close()
+            rewards.append(swarm.best[2])
+        assert rewards[0] == rewards[1]
+
+    def test_island_error(self):
+        swarm = LocalDistributedSwarm(FailingIsland(), n_swarms=2, max_iters=2, plot=False)
+        try:
+            with pytest.raises(RuntimeError):
+                swarm.run_swarm()
+        finally:
+            swarm.close()